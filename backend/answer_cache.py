@@ -0,0 +1,160 @@
+"""
+Semantic cache of chat answers.
+
+Students working from the same PDF keep asking the same questions. Each
+question is embedded (the vector is reused for retrieval) and compared with
+questions already answered for the same documents and the same recent chat
+history. If the cosine similarity is at least ANSWER_CACHE_SIMILARITY, the
+stored answer and sources are returned without retrieval or an LLM call.
+
+Entries are grouped by scope: a fingerprint of the session's documents (content
+hashes of the PDFs plus the embedding model) and a hash of the history turns
+that go into the prompt. Sessions built from the same PDFs therefore share
+answers, and adding or removing a PDF starts a new scope. The cache lives in
+process memory and is bounded by an entry count (least recently used first)
+and a TTL.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# ANSWER CACHE CONFIG
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between two questions for the cached answer to be reused
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+
+
+def history_key(history: List[tuple]) -> str:
+    """Hash of the history turns included in a prompt."""
+    return hashlib.sha256(json.dumps([list(turn) for turn in history]).encode("utf-8")).hexdigest()[:16]
+
+
+class _Entry:
+    __slots__ = ("scope", "question", "vector", "answer", "sources", "created")
+
+    def __init__(self, scope: str, question: str, vector: np.ndarray, answer: str, sources: List[Dict[str, str]]):
+        self.scope = scope
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.sources = sources
+        self.created = time.time()
+
+
+class AnswerCache:
+    """Answers keyed by scope and question embedding, bounded by entry count and TTL."""
+
+    def __init__(self, max_entries: int, ttl: int, similarity: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.enabled = enabled
+        # Least recently used first
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._scopes: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _normalize(vector: Any) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry.scope]
+        ids.remove(entry_id)
+        if not ids:
+            del self._scopes[entry.scope]
+
+    def _expire(self, scope: str) -> None:
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for entry_id in list(self._scopes.get(scope, [])):
+            if self._entries[entry_id].created < cutoff:
+                self._remove(entry_id)
+                self.expirations += 1
+
+    def _best(self, scope: str, vector: np.ndarray):
+        ids = self._scopes.get(scope)
+        if not ids:
+            return None, 0.0
+        similarities = np.stack([self._entries[entry_id].vector for entry_id in ids]) @ vector
+        best = int(np.argmax(similarities))
+        return ids[best], float(similarities[best])
+
+    def lookup(self, scope: str, vector: Any) -> Optional[Dict[str, Any]]:
+        """Return the cached answer for the closest earlier question in scope, if close enough."""
+        if not self.enabled:
+            return None
+        vector = self._normalize(vector)
+        with self._lock:
+            self._expire(scope)
+            entry_id, similarity = self._best(scope, vector)
+            if entry_id is None or similarity < self.similarity:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            entry = self._entries[entry_id]
+            return {
+                "question": entry.question,
+                "answer": entry.answer,
+                "sources": entry.sources,
+                "similarity": round(similarity, 4),
+            }
+
+    def store(self, scope: str, question: str, vector: Any, answer: str, sources: List[Dict[str, str]]) -> None:
+        if not self.enabled or not answer:
+            return
+        vector = self._normalize(vector)
+        with self._lock:
+            # A near-duplicate answered concurrently is replaced rather than kept twice
+            entry_id, similarity = self._best(scope, vector)
+            if entry_id is not None and similarity >= self.similarity:
+                self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(scope, question, vector, answer, sources)
+            self._scopes.setdefault(scope, []).append(entry_id)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "scopes": len(self._scopes),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "similarity_threshold": self.similarity,
+        }
+
+
+answer_cache = AnswerCache(
+    ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY, enabled=ANSWER_CACHE_ENABLED
+)
@@ -0,0 +1,115 @@
+"""
+Recall vs latency of the session index tiers (flat, HNSW, IVF) and vector compressions.
+
+Builds indexes with the same code the backend uses (vector_index.build_index) over
+synthetic clustered embeddings, then reports build time, per-query search
+latency, recall@k against exact search and vector bytes per chunk for several
+efSearch / nprobe values. Compressed indexes re-rank with exact vectors, as in
+the backend.
+
+    cd backend
+    python benchmarks/ann_benchmark.py --chunks 5000 20000 50000 --compression none sq8 pq --json ann_results.json
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vector_index import build_index, bytes_per_vector, vector_bytes  # noqa: E402
+
+
+def synthetic_embeddings(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors grouped around topics, roughly like sentence embeddings of PDF chunks."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(8, int(np.sqrt(count))), dimension)).astype(np.float32)
+    vectors = topics[rng.integers(0, len(topics), count)] + 0.6 * rng.normal(size=(count, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray) -> dict:
+    # One query at a time, like a chat request
+    latencies = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(ids[0])
+    recall = np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)])
+    latencies = np.array(latencies)
+    return {
+        "recall": round(float(recall), 4),
+        "latency_ms_mean": round(float(latencies.mean()), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def run(chunk_counts, dimension: int, query_count: int, k: int, compressions=("none",)) -> list:
+    import faiss
+
+    results = []
+    for count in chunk_counts:
+        vectors = synthetic_embeddings(count, dimension)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(0, count, query_count)] + 0.05 * rng.normal(size=(query_count, dimension)).astype(np.float32)
+        queries = queries.astype(np.float32)
+
+        # The uncompressed flat index is exact and doubles as ground truth
+        _, truth = build_index(vectors, "flat").search(queries, k)
+        configs = [("flat", None, [None]), ("hnsw", "efSearch", [16, 32, 64, 128]), ("ivf", "nprobe", [4, 8, 16, 32])]
+        for compression in compressions:
+            for kind, knob, values in configs:
+                started = time.perf_counter()
+                index = build_index(vectors, kind, compression=compression)
+                build_seconds = time.perf_counter() - started
+                chunk_bytes = bytes_per_vector(index)
+                # The backend memory-maps saved indexes; only this part is on the heap
+                heap_bytes = vector_bytes(index, mapped=True)[0]
+                base = faiss.downcast_index(index.base_index) if isinstance(index, faiss.IndexRefine) else index
+                for value in values:
+                    if knob == "efSearch":
+                        base.hnsw.efSearch = value
+                    elif knob == "nprobe":
+                        base.nprobe = value
+                    row = {
+                        "chunks": count, "index": kind, "compression": compression, knob or "param": value,
+                        "build_s": round(build_seconds, 2), "vector_bytes_per_chunk": chunk_bytes,
+                        "heap_vector_bytes_per_chunk": heap_bytes,
+                    }
+                    row.update(measure(index, queries, k, truth))
+                    results.append(row)
+                    label = f"{kind}/{compression}" + (f" {knob}={value}" if knob else "")
+                    print(f"{count:>8} {label:<24} build {build_seconds:7.2f}s  {chunk_bytes:>5} B/chunk ({heap_bytes} heap)  "
+                          f"recall@{k} {row['recall']:.3f}  mean {row['latency_ms_mean']:.3f} ms  p95 {row['latency_ms_p95']:.3f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[5000, 20000, 50000])
+    parser.add_argument("--dim", type=int, default=384, help="Embedding size (all-MiniLM-L6-v2 is 384)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="Chunks retrieved per question, as in /api/chat")
+    parser.add_argument("--compression", nargs="+", default=["none"], choices=["none", "sq8", "pq"])
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    import faiss
+    faiss.omp_set_num_threads(args.threads)
+
+    results = run(args.chunks, args.dim, args.queries, args.k, args.compression)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"dim": args.dim, "k": args.k, "queries": args.queries, "results": results}, results_file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
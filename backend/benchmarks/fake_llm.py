@@ -0,0 +1,184 @@
+"""
+Local stand-in for the Groq chat completions API.
+
+Answers are deterministic functions of the prompt and shaped like what the
+backend asks for (quiz questions, flashcards, study packs, titles, summaries),
+so the parsers downstream do their normal work. Every call waits latency
+seconds plus token_latency per output token, like a provider would, and
+reports token usage. Streaming requests get server-sent event chunks.
+
+The backend talks to it through GROQ_BASE_URL:
+
+    python benchmarks/fake_llm.py --port 8900 --latency 0.4
+    GROQ_BASE_URL=http://127.0.0.1:8900 GROQ_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+CHARS_PER_TOKEN = 4
+
+
+def _words(prompt: str, count: int) -> List[str]:
+    seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+    vocabulary = [word.strip(".,:;()[]\"'").lower() for word in prompt.split()]
+    vocabulary = [word for word in vocabulary if len(word) > 3] or ["answer"]
+    return [vocabulary[(seed[i % len(seed)] + i * 7) % len(vocabulary)] for i in range(count)]
+
+
+def completion_text(prompt: str, answer_tokens: int) -> str:
+    """The fake model's answer to a prompt."""
+    words = _words(prompt, 40)
+    quiz = "\n\n".join(
+        f"Q{i}: What does {words[i]} relate to?\nA) {words[i + 1]}\nB) {words[i + 2]}\nC) {words[i + 3]}\n"
+        f"D) {words[i + 4]}\nCorrect: {'ABCD'[i % 4]}"
+        for i in range(1, 6)
+    )
+    flashcards = "\n\n".join(f"Front: {words[i]}\nBack: {' '.join(words[i + 1:i + 9])}" for i in range(10))
+    if "study pack" in prompt:
+        return f"TITLE: {words[0].title()} {words[1].title()} Notes\n\nQUIZ:\n{quiz}\n\nFLASHCARDS:\n{flashcards}"
+    if "multiple-choice" in prompt:
+        return quiz
+    if "flashcards" in prompt:
+        return flashcards
+    if "conversation title" in prompt:
+        return f"{words[0].title()} and {words[1].title()}"
+    if "Update the summary" in prompt:
+        return " ".join(_words(prompt, 60))
+    if "image generation prompt" in prompt:
+        return "A detailed diagram of " + " ".join(words[:12])
+    return " ".join(_words(prompt, answer_tokens)).capitalize() + "."
+
+
+class FakeLLMServer:
+    """OpenAI-compatible chat completions server on a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.3,
+                 token_latency: float = 0.0, answer_tokens: int = 120):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-llm")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _complete(self, body: Dict) -> Tuple[str, Dict[str, int]]:
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        text = completion_text(prompt, self.answer_tokens)
+        usage = {
+            "prompt_tokens": len(prompt) // CHARS_PER_TOKEN,
+            "completion_tokens": max(1, len(text) // CHARS_PER_TOKEN),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+        return text, usage
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                text, usage = server._complete(body)
+                model = body.get("model", "fake")
+                time.sleep(server.latency)
+                if body.get("stream"):
+                    self._stream(model, text, usage)
+                    return
+                time.sleep(server.token_latency * usage["completion_tokens"])
+                data = json.dumps({
+                    "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, model: str, text: str, usage: Dict[str, int]):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                pieces = text.split(" ")
+                for number, piece in enumerate(pieces):
+                    chunk = {
+                        "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece if number == 0 else " " + piece},
+                                     "finish_reason": None}],
+                    }
+                    if number == len(pieces) - 1:
+                        chunk["choices"][0]["finish_reason"] = "stop"
+                        # Groq reports usage on the last chunk
+                        chunk["x_groq"] = {"usage": usage}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.token_latency * max(1, len(piece) // CHARS_PER_TOKEN))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per output token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Words in a chat answer")
+    args = parser.parse_args()
+    server = FakeLLMServer(args.host, args.port, args.latency, args.token_latency, args.answer_tokens)
+    print(f"Fake LLM listening on {server.url}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
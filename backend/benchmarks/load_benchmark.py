@@ -0,0 +1,467 @@
+"""
+Throughput and latency of the API under load, without network services.
+
+Generates synthetic PDFs (synthetic_pdf.py), replaces Groq with a local
+deterministic fake of configurable latency (fake_llm.py) and drives the FastAPI
+app in-process through uploads, chat questions, quizzes and flashcards at a
+configurable concurrency. Reports uploads/sec, request throughput, p50/p95/p99
+latency per phase, peak RSS and the per-stage breakdown from /api/metrics, and
+writes them as JSON tagged with the git commit so runs can be compared.
+
+Everything the backend writes goes to a temporary directory. --embeddings hash
+swaps the sentence-transformers model for a hashing embedder, for machines
+without the model (latencies then leave out embedding cost). --url drives an
+already running server instead (start it with GROQ_BASE_URL pointing at
+fake_llm.py); RSS is then not measured. The client only sees streamed chat
+tokens as they arrive with --url; in-process, time to first token is the
+chat_stream/llm_first_token stage.
+
+    cd backend
+    python benchmarks/load_benchmark.py --pages 20 --uploads 8 --questions 60 --concurrency 4 --json before.json
+    python benchmarks/load_benchmark.py --pages 20 --uploads 8 --questions 60 --concurrency 4 --compare before.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from fake_llm import FakeLLMServer  # noqa: E402
+from synthetic_pdf import TOPICS, write_corpus  # noqa: E402
+
+UPLOAD_POLL_SECONDS = 0.05
+RSS_SAMPLE_SECONDS = 0.2
+_SAMPLE = re.compile(r'^(\w+?)(_bucket|_sum|_count)?\{(.*)\} ([0-9.e+-]+|\+Inf)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class HashEmbeddings:
+    """Bag-of-words hashing embedder: deterministic, instant, no model download."""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimension] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, Optional[float]]:
+    if not seconds:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    values = np.array(seconds) * 1000
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "mean": round(float(values.mean()), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def git_commit() -> Tuple[Optional[str], Optional[bool]]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def parse_stage_histogram(text: str, name: str = "fasarliai_stage_seconds") -> Dict[str, Dict[str, Any]]:
+    """Buckets, sum and count per "pipeline/stage" from Prometheus text."""
+    stages: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match or match.group(1) != name:
+            continue
+        labels = dict(_LABEL.findall(match.group(3)))
+        key = f"{labels.get('pipeline')}/{labels.get('stage')}"
+        stage = stages.setdefault(key, {"buckets": {}, "sum": 0.0, "count": 0})
+        value = float(match.group(4).replace("+Inf", "inf"))
+        if match.group(2) == "_bucket":
+            stage["buckets"][float(labels["le"].replace("+Inf", "inf"))] = value
+        elif match.group(2) == "_sum":
+            stage["sum"] = value
+        elif match.group(2) == "_count":
+            stage["count"] = int(value)
+    return stages
+
+
+def _bucket_quantile(buckets: Dict[float, float], count: int, quantile: float) -> Optional[float]:
+    """Quantile estimated from cumulative buckets, interpolating inside the bucket like Prometheus."""
+    if not count:
+        return None
+    rank = quantile * count
+    lower_bound, lower_count = 0.0, 0.0
+    for bound in sorted(buckets):
+        if buckets[bound] >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            share = (rank - lower_count) / max(buckets[bound] - lower_count, 1e-9)
+            return lower_bound + (bound - lower_bound) * share
+        lower_bound, lower_count = bound, buckets[bound]
+    return lower_bound
+
+
+def stage_breakdown(before: str, after: str) -> Dict[str, Dict[str, Any]]:
+    """Per-stage count, mean and p95 (ms) of what happened between two metric scrapes."""
+    start, end = parse_stage_histogram(before), parse_stage_histogram(after)
+    breakdown = {}
+    for key, stage in sorted(end.items()):
+        base = start.get(key, {"buckets": {}, "sum": 0.0, "count": 0})
+        count = stage["count"] - base["count"]
+        if count <= 0:
+            continue
+        buckets = {bound: value - base["buckets"].get(bound, 0) for bound, value in stage["buckets"].items()}
+        p95 = _bucket_quantile(buckets, count, 0.95)
+        breakdown[key] = {
+            "count": count,
+            "mean_ms": round((stage["sum"] - base["sum"]) / count * 1000, 2),
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+        }
+    return breakdown
+
+
+class Phase:
+    """Latencies and errors of one kind of request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.first_token: List[float] = []
+        self.errors = 0
+        self.first_error: Optional[str] = None
+        self.seconds = 0.0
+
+    def failed(self, message: str) -> None:
+        self.errors += 1
+        if self.first_error is None:
+            self.first_error = message[:300]
+
+    def result(self) -> Dict[str, Any]:
+        completed = len(self.latencies)
+        result = {
+            "requests": completed + self.errors,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "throughput_per_s": round(completed / self.seconds, 3) if self.seconds else None,
+            "latency_ms": latency_summary(self.latencies),
+        }
+        if self.first_token:
+            result["first_token_ms"] = latency_summary(self.first_token)
+        if self.first_error:
+            result["first_error"] = self.first_error
+        return result
+
+
+async def run_concurrently(count: int, concurrency: int, job) -> float:
+    """Run job(0..count-1) with at most concurrency in flight; returns the wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(number: int):
+        async with semaphore:
+            await job(number)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(number) for number in range(count)))
+    return time.perf_counter() - started
+
+
+async def upload_phase(client, pdfs: List[Path], concurrency: int, timeout: float) -> Tuple[Phase, List[str]]:
+    phase = Phase("upload")
+    sessions: List[str] = []
+
+    async def upload(number: int):
+        path = pdfs[number]
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/upload", files={"file": (path.name, path.read_bytes(), "application/pdf")}
+        )
+        if response.status_code != 202:
+            phase.failed(f"HTTP {response.status_code}: {response.text}")
+            return
+        job = response.json()
+        while time.perf_counter() - started < timeout:
+            await asyncio.sleep(UPLOAD_POLL_SECONDS)
+            status = (await client.get(f"/api/upload/{job['job_id']}")).json()
+            if status.get("status") == "done":
+                phase.latencies.append(time.perf_counter() - started)
+                sessions.append(job["session_id"])
+                return
+            if status.get("status") == "failed":
+                phase.failed(f"ingestion failed: {status.get('error')}")
+                return
+        phase.failed("ingestion timed out")
+
+    phase.seconds = await run_concurrently(len(pdfs), concurrency, upload)
+    return phase, sessions
+
+
+def question(number: int) -> str:
+    """Distinct questions across the synthetic topics, so the answer cache does not serve them."""
+    topic = list(TOPICS)[number % len(TOPICS)]
+    words = TOPICS[topic].split()
+    return f"How does {words[number % len(words)]} relate to {words[(number * 3 + 1) % len(words)]} in {topic} ({number})?"
+
+
+async def chat_phase(client, sessions: List[str], count: int, concurrency: int, stream: bool,
+                     time_first_token: bool) -> Phase:
+    phase = Phase("chat_stream" if stream else "chat")
+
+    async def ask(number: int):
+        payload = {"question": question(number), "session_id": sessions[number % len(sessions)]}
+        started = time.perf_counter()
+        if not stream:
+            response = await client.post("/api/chat", json=payload)
+            if response.status_code == 200:
+                phase.latencies.append(time.perf_counter() - started)
+            else:
+                phase.failed(f"HTTP {response.status_code}: {response.text}")
+            return
+        first_token = None
+        async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("event: token") and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif line.startswith("event: error"):
+                    phase.failed(f"stream error after {time.perf_counter() - started:.2f}s")
+                    return
+        if response.status_code != 200:
+            phase.failed(f"HTTP {response.status_code}")
+            return
+        phase.latencies.append(time.perf_counter() - started)
+        if first_token is not None and time_first_token:
+            phase.first_token.append(first_token)
+
+    phase.seconds = await run_concurrently(count, concurrency, ask)
+    return phase
+
+
+async def generation_phase(client, name: str, path: str, sessions: List[str], count: int, concurrency: int,
+                           regenerate: bool) -> Phase:
+    phase = Phase(name)
+
+    async def generate(number: int):
+        started = time.perf_counter()
+        response = await client.post(path, json={"session_id": sessions[number % len(sessions)], "regenerate": regenerate})
+        if response.status_code == 200:
+            phase.latencies.append(time.perf_counter() - started)
+        else:
+            phase.failed(f"HTTP {response.status_code}: {response.text}")
+
+    phase.seconds = await run_concurrently(count, concurrency, generate)
+    return phase
+
+
+async def sample_rss(peak: Dict[str, int], stop: asyncio.Event) -> None:
+    from embeddings import get_rss_bytes
+
+    while not stop.is_set():
+        peak["bytes"] = max(peak["bytes"], get_rss_bytes())
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def drive(client, args, pdfs: List[Path]) -> Dict[str, Any]:
+    metrics_before = (await client.get("/api/metrics")).text
+    phases: Dict[str, Any] = {}
+
+    print(f"Uploading {len(pdfs)} PDFs of {args.pages} pages at concurrency {args.concurrency} ...")
+    upload, sessions = await upload_phase(client, pdfs, args.concurrency, args.upload_timeout)
+    phases["upload"] = upload.result()
+    phases["upload"]["pages_per_s"] = (
+        round(len(upload.latencies) * args.pages / upload.seconds, 2) if upload.seconds else None
+    )
+    if not sessions:
+        raise SystemExit(f"No upload succeeded: {upload.first_error}")
+
+    if args.questions:
+        print(f"Asking {args.questions} questions ...")
+        # The in-process transport buffers streamed bodies; the first token is then timed by the server's stages
+        phases["chat"] = (await chat_phase(
+            client, sessions, args.questions, args.concurrency, args.stream, time_first_token=bool(args.url)
+        )).result()
+    if args.quizzes:
+        print(f"Generating {args.quizzes} quizzes ...")
+        phases["quiz"] = (await generation_phase(
+            client, "quiz", "/api/quiz", sessions, args.quizzes, args.concurrency, not args.cached
+        )).result()
+    if args.flashcards:
+        print(f"Generating {args.flashcards} flashcard sets ...")
+        phases["flashcards"] = (await generation_phase(
+            client, "flashcards", "/api/flashcards", sessions, args.flashcards, args.concurrency, not args.cached
+        )).result()
+
+    metrics_after = (await client.get("/api/metrics")).text
+    return {"phases": phases, "stages": stage_breakdown(metrics_before, metrics_after)}
+
+
+def configure_environment(args, data_dir: Path, llm_url: str) -> None:
+    """Point the backend at temporary storage and the fake LLM; must run before main is imported."""
+    os.environ.update({
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_BASE_URL": llm_url,
+        "VECTOR_STORE_DIR": str(data_dir / "vector_stores"),
+        "EMBEDDING_CACHE_DIR": str(data_dir / "embedding_cache"),
+        "STUDY_PACK_DIR": str(data_dir / "study_packs"),
+        "IMAGE_CACHE_DIR": str(data_dir / "images"),
+        "CODE_STORE_PATH": str(data_dir / "codes.sqlite3"),
+        "MAIL_SINK": "console",
+        "STUDY_PACK_PRECOMPUTE": "true" if args.precompute else "false",
+        "EMBEDDING_WARMUP": "true" if args.embeddings == "model" else "false",
+    })
+    if not args.rate_limits:
+        # The fake provider has no limits; the scheduler's would only measure the sleep
+        os.environ["LLM_REQUESTS_PER_MINUTE"] = "0"
+        os.environ["LLM_TOKENS_PER_MINUTE"] = "0"
+
+
+async def run_in_process(args, pdfs: List[Path], data_dir: Path) -> Dict[str, Any]:
+    import httpx
+
+    with FakeLLMServer(latency=args.llm_latency, token_latency=args.llm_token_latency,
+                       answer_tokens=args.answer_tokens) as llm:
+        configure_environment(args, data_dir, llm.url)
+        import main as backend
+        from embeddings import DEFAULT_EMBEDDING_MODEL, embedding_registry, get_rss_bytes
+
+        if args.embeddings == "hash":
+            embedding_registry.register(DEFAULT_EMBEDDING_MODEL, HashEmbeddings())
+
+        peak = {"bytes": 0}
+        stop = asyncio.Event()
+        async with backend.app.router.lifespan_context(backend.app):
+            rss_before = get_rss_bytes()
+            sampler = asyncio.create_task(sample_rss(peak, stop))
+            transport = httpx.ASGITransport(app=backend.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                try:
+                    report = await drive(client, args, pdfs)
+                finally:
+                    stop.set()
+                    await sampler
+        report["rss_mb"] = {
+            "start": round(rss_before / 2 ** 20, 1),
+            "peak": round(peak["bytes"] / 2 ** 20, 1),
+        }
+        report["fake_llm"] = llm.stats()
+        return report
+
+
+async def run_against(args, pdfs: List[Path]) -> Dict[str, Any]:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        report = await drive(client, args, pdfs)
+    report["rss_mb"] = None
+    return report
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    """Print how the phases moved against an earlier result file."""
+    def change(old, new) -> str:
+        if old in (None, 0) or new is None:
+            return "    n/a"
+        return f"{(new - old) / old * 100:+6.1f}%"
+
+    print(f"\nCompared with {str(previous.get('commit'))[:10]} ({previous.get('started_at')}):")
+    for name, phase in current["phases"].items():
+        old = previous.get("phases", {}).get(name)
+        if old is None:
+            continue
+        print(f"  {name:<11} p50 {change(old['latency_ms']['p50'], phase['latency_ms']['p50'])}"
+              f"  p95 {change(old['latency_ms']['p95'], phase['latency_ms']['p95'])}"
+              f"  throughput {change(old['throughput_per_s'], phase['throughput_per_s'])}")
+    if previous.get("rss_mb") and current.get("rss_mb"):
+        print(f"  peak RSS    {change(previous['rss_mb']['peak'], current['rss_mb']['peak'])}")
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print()
+    for name, phase in report["phases"].items():
+        latency = phase["latency_ms"]
+        extra = f"  {phase['pages_per_s']} pages/s" if "pages_per_s" in phase else ""
+        if "first_token_ms" in phase:
+            extra += f"  first token p50 {phase['first_token_ms']['p50']} ms"
+        print(f"{name:<11} {phase['requests']:>5} req  {phase['errors']:>3} err  {phase['throughput_per_s']}/s  "
+              f"p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms{extra}")
+        if phase.get("first_error"):
+            print(f"            first error: {phase['first_error']}")
+    if report.get("rss_mb"):
+        print(f"RSS         start {report['rss_mb']['start']} MB, peak {report['rss_mb']['peak']} MB")
+    print("\nStages (mean / p95 ms):")
+    for key, stage in report["stages"].items():
+        print(f"  {key:<32} {stage['count']:>5}  {stage['mean_ms']:>9}  {stage['p95_ms']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic PDF")
+    parser.add_argument("--uploads", type=int, default=8, help="PDFs uploaded, one session each")
+    parser.add_argument("--questions", type=int, default=40, help="Chat questions, spread over the sessions")
+    parser.add_argument("--quizzes", type=int, default=8)
+    parser.add_argument("--flashcards", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--stream", action="store_true", help="Ask through /api/chat/stream and time the first token")
+    parser.add_argument("--cached", action="store_true", help="Let quizzes and flashcards come from the study pack cache")
+    parser.add_argument("--precompute", action="store_true", help="Precompute study packs after uploads, as in production")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the configured LLM rate limits")
+    parser.add_argument("--embeddings", choices=["model", "hash"], default="model")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake LLM seconds before the first token")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="Fake LLM seconds per output token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Words in a fake chat answer")
+    parser.add_argument("--upload-timeout", type=float, default=600)
+    parser.add_argument("--url", help="Drive a running server instead of the app in-process")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with tempfile.TemporaryDirectory(prefix="fasarliai-bench-") as data_dir:
+        pdfs = write_corpus(Path(data_dir) / "pdfs", args.uploads, args.pages)
+        if args.url:
+            report = asyncio.run(run_against(args, pdfs))
+        else:
+            report = asyncio.run(run_in_process(args, pdfs, Path(data_dir)))
+
+    report = {"benchmark": "load", "commit": commit, "dirty": dirty, "started_at": started_at,
+              "config": vars(args), **report}
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(json.load(previous_file), report)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(report, results_file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
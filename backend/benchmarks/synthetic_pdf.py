@@ -0,0 +1,105 @@
+"""
+Deterministic synthetic PDFs for benchmarks.
+
+Pages hold lines of pseudo-prose drawn from a few topic vocabularies, so chunks
+on the same topic are similar and retrieval has something to find. The PDF is
+written directly (Helvetica text objects, no dependencies) and pypdf extracts
+the text back, like a real upload.
+
+    python benchmarks/synthetic_pdf.py --pages 50 --count 3 --out /tmp/pdfs
+"""
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+TOPICS = {
+    "photosynthesis": "chlorophyll light energy glucose carbon dioxide oxygen leaf stomata thylakoid calvin cycle",
+    "thermodynamics": "entropy heat engine temperature pressure volume work energy equilibrium carnot cycle",
+    "genetics": "gene allele chromosome mutation inheritance dominant recessive protein dna replication",
+    "economics": "market supply demand price inflation interest rate monetary policy growth employment",
+    "networks": "packet router protocol latency bandwidth routing congestion tcp handshake throughput",
+}
+FILLER = "the a of and in to is that which with for as by on this these are can be from its"
+LINES_PER_PAGE = 45
+WORDS_PER_LINE = 12
+
+
+def page_lines(page: int, seed: int, lines: int = LINES_PER_PAGE) -> List[str]:
+    """Lines of one page; each page dwells on one topic."""
+    rng = random.Random(f"{seed}:{page}")
+    topic = list(TOPICS)[(page + seed) % len(TOPICS)]
+    vocabulary = TOPICS[topic].split()
+    filler = FILLER.split()
+    text = [f"Chapter {page + 1}: {topic.title()}"]
+    for line in range(lines - 1):
+        words = [rng.choice(vocabulary) if rng.random() < 0.45 else rng.choice(filler) for _ in range(WORDS_PER_LINE)]
+        text.append(" ".join(words).capitalize() + ".")
+    return text
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def pdf_bytes(pages: int, seed: int = 0, title: str = "Synthetic Study Notes") -> bytes:
+    """A PDF of the given number of text pages."""
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Title ({_escape(title)}) >>".encode("latin-1"),
+    ]
+    page_ids = []
+    for page in range(pages):
+        lines = page_lines(page, seed)
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        content = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def write_corpus(directory: Path, count: int, pages: int) -> List[Path]:
+    """count distinct PDFs of the given page count in directory."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for seed in range(count):
+        path = directory / f"synthetic_{pages}p_{seed}.pdf"
+        if not path.exists():
+            path.write_bytes(pdf_bytes(pages, seed, title=f"Synthetic Study Notes {seed}"))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--out", default="synthetic_pdfs")
+    args = parser.parse_args()
+    for path in write_corpus(Path(args.out), args.count, args.pages):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
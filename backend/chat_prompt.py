@@ -0,0 +1,181 @@
+"""
+Token-budgeted chat prompts and rolling history summaries.
+
+A chat prompt is the QA system prompt with the retrieved chunks, a summary of
+the earlier conversation, the most recent turns and the question. The parts
+are counted in tokens and fitted into CHAT_PROMPT_TOKENS: the instructions and
+the question always go in, the history gets at most CHAT_HISTORY_SHARE of what
+is left (summary first, then turns from the newest back), and retrieved chunks
+fill the rest in rank order, the last one truncated if only part of it fits.
+
+Only the last CHAT_RECENT_TURNS turns are kept verbatim. Older turns are folded
+into the session's summary by one background LLM call once CHAT_SUMMARY_BATCH
+of them have built up, so each turn is summarised once and the summary is
+updated rather than rebuilt. Stored histories never hold more than
+CHAT_HISTORY_MAX_TURNS turns, whether or not summarising succeeded.
+
+Tokens are counted with tiktoken's cl100k encoding when it is installed (close
+to Llama 3's tokenizer) and estimated from the text length otherwise.
+"""
+import os
+from typing import Any, List, Optional, Tuple
+
+# CHAT PROMPT CONFIG
+# Tokens of a chat prompt (the answer gets CHAT_ANSWER_TOKENS on top)
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", "3000"))
+CHAT_ANSWER_TOKENS = int(os.getenv("CHAT_ANSWER_TOKENS", "1024"))
+# Largest share of the prompt left after instructions and question that goes to history
+CHAT_HISTORY_SHARE = 0.35
+# Turns sent verbatim; older ones are folded into the summary
+CHAT_RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "3"))
+# Turns beyond the recent ones that trigger a summary update
+CHAT_SUMMARY_BATCH = 2
+CHAT_SUMMARY_TOKENS = 300
+# Turns kept per session in memory and on disk
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))
+# A truncated chunk shorter than this is left out
+MIN_CHUNK_TOKENS = 60
+CHARS_PER_TOKEN = 4
+
+QA_SYSTEM_PROMPT = (
+    "Use the following pieces of context to answer the user's question. \n"
+    "If you don't know the answer, just say that you don't know, don't try to make up an answer.\n"
+    "----------------\n"
+    "{context}"
+)
+CHAT_INSTRUCTION = (
+    "You are a helpful chatbot. Answer using the information found in the uploaded PDF documents. "
+    "Search across ALL available documents to provide a comprehensive answer. "
+    "Be clear, friendly, and helpful."
+)
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in a text (tiktoken cl100k when installed, otherwise estimated)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """The beginning of a text, at most tokens long, cut at a word boundary."""
+    if count_tokens(text) <= tokens:
+        return text
+    if _encoding:
+        cut = _encoding.decode(_encoding.encode(text, disallowed_special=())[:tokens])
+    else:
+        cut = text[:tokens * CHARS_PER_TOKEN]
+    return cut.rsplit(" ", 1)[0] + " ..."
+
+
+def _turn_text(question: str, answer: str) -> str:
+    return f"Q: {question}\nA: {answer}"
+
+
+def prompt_history(history: List[tuple]) -> Tuple[str, List[tuple]]:
+    """The summary and turns of a history that can go into a prompt."""
+    return getattr(history, "summary", ""), list(history[-CHAT_RECENT_TURNS:]) if CHAT_RECENT_TURNS else []
+
+
+def build_chat_prompt(question: str, history: List[tuple], docs: List[Any],
+                      budget: int = CHAT_PROMPT_TOKENS) -> Tuple[List[Any], List[Any]]:
+    """Messages for a chat question within budget tokens, and the retrieved docs that made it in."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    question = truncate_to_tokens(question, budget // 4)
+    fixed = count_tokens(QA_SYSTEM_PROMPT.format(context="")) + count_tokens(CHAT_INSTRUCTION) + count_tokens(question)
+    available = max(0, budget - fixed - 20)
+
+    # History: summary first, then turns from the newest back while they fit
+    summary, turns = prompt_history(history)
+    history_budget = int(available * CHAT_HISTORY_SHARE)
+    history_parts: List[str] = []
+    if summary and history_budget > 0:
+        summary_text = truncate_to_tokens(summary, min(CHAT_SUMMARY_TOKENS, history_budget))
+        history_parts.append(f"Summary of the earlier conversation: {summary_text}")
+        history_budget -= count_tokens(history_parts[0])
+    recent: List[str] = []
+    for question_before, answer_before in reversed(turns):
+        text = _turn_text(question_before, answer_before)
+        tokens = count_tokens(text)
+        if tokens > history_budget:
+            # A long answer is cut rather than dropping the turn, if a useful part fits
+            if history_budget >= MIN_CHUNK_TOKENS:
+                recent.append(truncate_to_tokens(text, history_budget))
+            break
+        recent.append(text)
+        history_budget -= tokens
+    history_parts.extend(reversed(recent))
+    history_text = "\n".join(history_parts)
+
+    # Retrieved chunks in rank order fill what is left
+    context_budget = available - count_tokens(history_text)
+    context_parts: List[str] = []
+    used_docs: List[Any] = []
+    for doc in docs:
+        tokens = count_tokens(doc.page_content) + 1
+        if tokens > context_budget:
+            if context_budget >= MIN_CHUNK_TOKENS:
+                context_parts.append(truncate_to_tokens(doc.page_content, context_budget))
+                used_docs.append(doc)
+            break
+        context_parts.append(doc.page_content)
+        used_docs.append(doc)
+        context_budget -= tokens
+
+    if history_text:
+        final_question = f"{CHAT_INSTRUCTION}\n\nPrevious conversation:\n{history_text}\n\nCurrent question: {question}"
+    else:
+        final_question = f"{CHAT_INSTRUCTION}\n\nQuestion: {question}"
+    messages = [
+        SystemMessage(content=QA_SYSTEM_PROMPT.format(context="\n\n".join(context_parts))),
+        HumanMessage(content=final_question),
+    ]
+    return messages, used_docs
+
+
+def turns_to_summarize(history: List[tuple]) -> List[tuple]:
+    """Oldest turns due to be folded into the summary (empty until a batch has built up)."""
+    if len(history) < CHAT_RECENT_TURNS + CHAT_SUMMARY_BATCH:
+        return []
+    return list(history[:len(history) - CHAT_RECENT_TURNS])
+
+
+def summary_prompt(summary: str, turns: List[tuple]) -> str:
+    """Prompt updating a conversation summary with the turns that follow it."""
+    exchanges = "\n\n".join(_turn_text(question, truncate_to_tokens(answer, 400)) for question, answer in turns)
+    return (
+        f"Update the summary of a conversation between a student and an assistant about their PDF documents.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        f"New exchanges:\n{exchanges}\n\n"
+        f"Write the updated summary in at most 150 words, keeping the topics, facts and open questions "
+        f"the student may refer back to. Return only the summary."
+    )
+
+
+def fold_summary(history: List[tuple], folded: List[tuple], summary: Optional[str]) -> Optional[List[tuple]]:
+    """History with folded turns replaced by the new summary, or None if it changed under the summary."""
+    from session_store import ChatHistory
+
+    if list(history[:len(folded)]) != folded:
+        return None
+    return ChatHistory(history[len(folded):], summary or getattr(history, "summary", ""))
+
+
+def capped(history: List[tuple]) -> List[tuple]:
+    """History limited to CHAT_HISTORY_MAX_TURNS turns (keeping its summary)."""
+    from session_store import ChatHistory
+
+    if len(history) <= CHAT_HISTORY_MAX_TURNS:
+        return history
+    return ChatHistory(history[-CHAT_HISTORY_MAX_TURNS:], getattr(history, "summary", ""))
@@ -0,0 +1,115 @@
+"""
+Chunk texts kept in a memory-mapped file instead of the Python heap.
+
+A session's docstore holds the text and metadata of every chunk, which costs
+more memory than its vectors. MappedDocstore writes the documents back to back
+as JSON records in chunks.bin and keeps only their ids and byte offsets in
+memory; a document is decoded when retrieval asks for it. Documents added since
+the file was written stay in memory until the session is saved again.
+"""
+import json
+import mmap
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+CHUNKS_FILE = "chunks.bin"
+# Heap bytes per mapped chunk: its id string, the id -> row entry and its offset (measured)
+MAPPED_CHUNK_BYTES = 170
+# Heap bytes per in-memory Document on top of its text (measured)
+DOCUMENT_OVERHEAD_BYTES = 900
+
+
+class MappedDocstore(Docstore, AddableMixin):
+    """LangChain docstore reading documents on demand from a memory-mapped file."""
+
+    def __init__(self, ids: List[str], offsets: np.ndarray):
+        self._ids = ids
+        self._offsets = offsets
+        self._rows = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._added: Dict[str, Document] = {}
+        self._path: Optional[Path] = None
+        self._buffer: Optional[Union[mmap.mmap, bytes]] = None
+
+    @classmethod
+    def write(cls, path: Path, documents: Iterable[Tuple[str, Document]]) -> "MappedDocstore":
+        """Write (id, document) pairs to a chunks file and return a docstore for it (not yet attached)."""
+        ids = []
+        offsets = [0]
+        with open(path, "wb") as chunks_file:
+            for doc_id, doc in documents:
+                record = json.dumps(
+                    {"page_content": doc.page_content, "metadata": doc.metadata}, default=str
+                ).encode("utf-8")
+                chunks_file.write(record)
+                ids.append(doc_id)
+                offsets.append(offsets[-1] + len(record))
+        return cls(ids, np.array(offsets, dtype=np.int64))
+
+    def attach(self, path: Path) -> None:
+        """Map the chunks file (once it has been moved into place).
+
+        The mapping stays valid when the file is later replaced or deleted.
+        """
+        self._path = Path(path)
+        with open(self._path, "rb") as chunks_file:
+            if self._offsets[-1] == 0:
+                # mmap refuses empty files
+                self._buffer = b""
+            else:
+                self._buffer = mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def search(self, search: str) -> Union[str, Document]:
+        doc = self._added.get(search)
+        if doc is not None:
+            return doc
+        row = self._rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        record = json.loads(self._buffer[self._offsets[row]:self._offsets[row + 1]])
+        return Document(id=search, page_content=record["page_content"], metadata=record["metadata"])
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = set(texts).intersection(self._rows) | set(texts).intersection(self._added)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        missing = [doc_id for doc_id in ids if doc_id not in self._rows and doc_id not in self._added]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for doc_id in ids:
+            # Deleted records stay in the file until the next save rewrites it
+            if self._added.pop(doc_id, None) is None:
+                del self._rows[doc_id]
+
+    def copy(self) -> "MappedDocstore":
+        """A copy that can be added to and deleted from without changing this one; both read the same file."""
+        docstore = MappedDocstore.__new__(MappedDocstore)
+        docstore._ids = self._ids
+        docstore._offsets = self._offsets
+        docstore._rows = dict(self._rows)
+        docstore._added = dict(self._added)
+        docstore._path = self._path
+        docstore._buffer = self._buffer
+        return docstore
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._added)
+
+    def resident_bytes(self) -> int:
+        return len(self._rows) * MAPPED_CHUNK_BYTES + sum(
+            len(doc.page_content) + DOCUMENT_OVERHEAD_BYTES for doc in self._added.values()
+        )
+
+    def __getstate__(self) -> dict:
+        if self._added or len(self._rows) != len(self._ids):
+            raise ValueError("Write a new chunks file before pickling a modified MappedDocstore")
+        return {"ids": self._ids, "offsets": self._offsets}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["ids"], state["offsets"])
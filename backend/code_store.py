@@ -0,0 +1,226 @@
+"""
+One-time codes for MFA logins and password resets.
+
+Codes are looked up by (purpose, email, code) in constant time and expire on
+their own: the in-memory backend keeps a heap ordered by expiry, the SQLite
+backend an index on it, and a background sweeper removes expired codes every
+CODE_SWEEP_INTERVAL_SECONDS. Consumed codes are removed immediately. Each email
+keeps at most CODE_MAX_ACTIVE_PER_EMAIL codes per purpose; issuing another one
+drops the oldest.
+
+Expired codes are kept for CODE_EXPIRED_RETENTION_SECONDS so users can still be
+told their code expired rather than that it is wrong.
+
+CODE_STORE_BACKEND=sqlite (the default) keeps codes in CODE_STORE_PATH, so they
+survive restarts and are shared by every worker on the host. With
+CODE_STORE_BACKEND=memory each process has its own codes.
+"""
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# CODE STORE CONFIG
+CODE_STORE_BACKEND = os.getenv("CODE_STORE_BACKEND", "sqlite").lower()
+CODE_STORE_PATH = Path(os.getenv("CODE_STORE_PATH", str(Path(__file__).parent / "data" / "codes.sqlite3")))
+CODE_MAX_ACTIVE_PER_EMAIL = int(os.getenv("CODE_MAX_ACTIVE_PER_EMAIL", "5"))
+CODE_SWEEP_INTERVAL_SECONDS = int(os.getenv("CODE_SWEEP_INTERVAL_SECONDS", "60"))
+CODE_EXPIRED_RETENTION_SECONDS = 600
+
+# Outcomes of CodeStore.check
+CODE_VALID = "valid"
+CODE_EXPIRED = "expired"
+CODE_INVALID = "invalid"
+
+
+class CodeStore(ABC):
+    """Interface of the code store backends."""
+
+    @abstractmethod
+    def issue(self, purpose: str, email: str, code: str, ttl_seconds: float) -> None:
+        """Store a code valid for ttl_seconds, dropping the oldest if the email is at its cap."""
+
+    @abstractmethod
+    def check(self, purpose: str, email: str, code: str, consume: bool = False) -> str:
+        """CODE_VALID, CODE_EXPIRED or CODE_INVALID; a valid code is removed if consume is set.
+
+        Only one of several concurrent consumers of a code sees CODE_VALID.
+        """
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Remove codes expired for longer than the retention; returns how many were removed."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, object]:
+        """Counts for the stats endpoint."""
+
+
+class MemoryCodeStore(CodeStore):
+    """Codes in process memory with a heap ordered by expiry."""
+
+    def __init__(self, max_active: int, retention: float = CODE_EXPIRED_RETENTION_SECONDS):
+        self.max_active = max_active
+        self.retention = retention
+        # (purpose, email) -> {code: (expires_at, issued order)}
+        self._codes: Dict[Tuple[str, str], Dict[str, Tuple[float, int]]] = {}
+        # (expires_at, purpose, email, code); entries of codes consumed or reissued are skipped when popped
+        self._expiry: List[Tuple[float, str, str, str]] = []
+        self._issued = 0
+        self._lock = threading.Lock()
+        self.swept = 0
+
+    def _discard(self, key: Tuple[str, str], code: str) -> None:
+        codes = self._codes.get(key)
+        if codes is not None:
+            codes.pop(code, None)
+            if not codes:
+                del self._codes[key]
+
+    def issue(self, purpose: str, email: str, code: str, ttl_seconds: float) -> None:
+        expires_at = time.time() + ttl_seconds
+        key = (purpose, email)
+        with self._lock:
+            codes = self._codes.setdefault(key, {})
+            self._issued += 1
+            codes[code] = (expires_at, self._issued)
+            heapq.heappush(self._expiry, (expires_at, purpose, email, code))
+            while len(codes) > self.max_active:
+                oldest = min(codes, key=lambda existing: codes[existing][1])
+                del codes[oldest]
+
+    def check(self, purpose: str, email: str, code: str, consume: bool = False) -> str:
+        key = (purpose, email)
+        with self._lock:
+            found = self._codes.get(key, {}).get(code)
+            if found is None:
+                return CODE_INVALID
+            if time.time() > found[0]:
+                return CODE_EXPIRED
+            if consume:
+                self._discard(key, code)
+            return CODE_VALID
+
+    def sweep(self) -> int:
+        cutoff = time.time() - self.retention
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < cutoff:
+                expires_at, purpose, email, code = heapq.heappop(self._expiry)
+                found = self._codes.get((purpose, email), {}).get(code)
+                # A reissued code has a later heap entry of its own
+                if found is not None and found[0] == expires_at:
+                    self._discard((purpose, email), code)
+                    removed += 1
+            self.swept += removed
+        return removed
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "emails": len(self._codes),
+                "codes": sum(len(codes) for codes in self._codes.values()),
+                "heap_entries": len(self._expiry),
+                "swept": self.swept,
+                "max_active_per_email": self.max_active,
+            }
+
+
+class SQLiteCodeStore(CodeStore):
+    """Codes in a SQLite database shared by the workers of a host."""
+
+    def __init__(self, path: Path, max_active: int, retention: float = CODE_EXPIRED_RETENTION_SECONDS):
+        self.path = Path(path)
+        self.max_active = max_active
+        self.retention = retention
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection per thread; SQLite serialises the writers of all processes
+        self._local = threading.local()
+        self.swept = 0
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS codes (
+                    purpose TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    issued_at REAL NOT NULL,
+                    PRIMARY KEY (purpose, email, code)
+                ) WITHOUT ROWID
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS codes_expires_at ON codes (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def issue(self, purpose: str, email: str, code: str, ttl_seconds: float) -> None:
+        now = time.time()
+        db = self._connect()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT OR REPLACE INTO codes (purpose, email, code, expires_at, issued_at) VALUES (?, ?, ?, ?, ?)",
+                (purpose, email, code, now + ttl_seconds, now),
+            )
+            db.execute(
+                """DELETE FROM codes WHERE purpose = ? AND email = ? AND code NOT IN (
+                       SELECT code FROM codes WHERE purpose = ? AND email = ? ORDER BY issued_at DESC LIMIT ?
+                   )""",
+                (purpose, email, purpose, email, self.max_active),
+            )
+
+    def check(self, purpose: str, email: str, code: str, consume: bool = False) -> str:
+        now = time.time()
+        db = self._connect()
+        if consume:
+            # The delete decides which of several concurrent consumers gets the code
+            deleted = db.execute(
+                "DELETE FROM codes WHERE purpose = ? AND email = ? AND code = ? AND expires_at >= ?",
+                (purpose, email, code, now),
+            ).rowcount
+            if deleted:
+                return CODE_VALID
+        row = db.execute(
+            "SELECT expires_at FROM codes WHERE purpose = ? AND email = ? AND code = ?", (purpose, email, code)
+        ).fetchone()
+        if row is None:
+            return CODE_INVALID
+        return CODE_EXPIRED if now > row[0] else CODE_VALID
+
+    def sweep(self) -> int:
+        removed = self._connect().execute(
+            "DELETE FROM codes WHERE expires_at < ?", (time.time() - self.retention,)
+        ).rowcount
+        self.swept += removed
+        return removed
+
+    def stats(self) -> Dict[str, object]:
+        emails, codes = self._connect().execute("SELECT COUNT(DISTINCT email), COUNT(*) FROM codes").fetchone()
+        return {
+            "backend": "sqlite",
+            "path": str(self.path),
+            "emails": emails,
+            "codes": codes,
+            "swept": self.swept,
+            "max_active_per_email": self.max_active,
+        }
+
+
+def create_code_store(backend: str, path: Path, max_active: int) -> CodeStore:
+    """Build the code store selected by CODE_STORE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteCodeStore(path, max_active)
+    if backend == "memory":
+        return MemoryCodeStore(max_active)
+    raise ValueError(f"Unknown CODE_STORE_BACKEND: {backend!r} (expected 'sqlite' or 'memory')")
@@ -0,0 +1,36 @@
+"""
+Helpers for keeping blocking work off the event loop.
+
+FAISS searches, embedding calls and synchronous SDKs run on a dedicated, bounded
+thread pool, so one slow request cannot stall every other user served by the
+same process. LLM calls are admitted by llm_scheduler.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# CONCURRENCY CONFIG
+# Threads for FAISS, embedding and other blocking calls made from request handlers
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+# Maximum LLM requests in flight per process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking function on the shared worker pool and await its result."""
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_blocking_pool() -> None:
+    global _blocking_executor
+    if _blocking_executor is not None:
+        _blocking_executor.shutdown(wait=False)
+        _blocking_executor = None
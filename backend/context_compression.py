@@ -0,0 +1,169 @@
+"""
+Post-retrieval context compression.
+
+Chunks are split with a 100-character overlap, so the nearest neighbours of a
+question are often the same passage twice: adjacent chunks sharing their edges,
+or identical chunks of a PDF uploaded twice. Sending them all wastes prompt
+tokens and LLM time. Retrieval therefore goes through three steps:
+
+1. Maximal marginal relevance over CONTEXT_FETCH_FACTOR * k candidates picks k
+   chunks that are relevant to the query but not to each other, using the
+   vectors already stored in the index (one matrix product, no re-embedding).
+   Candidates at least CONTEXT_DUPLICATE_SIMILARITY similar to a chunk already
+   picked are dropped outright.
+2. Picked chunks that are neighbours in the same document are merged into one
+   passage, with the overlapping text kept once.
+3. trim_passages fits the passages into a token budget in rank order; the chat
+   prompt builder does the same against the chat prompt budget.
+"""
+import os
+import re
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chat_prompt import count_tokens, truncate_to_tokens
+from session_store import reading
+from vector_index import reconstruct_rows
+
+# CONTEXT COMPRESSION CONFIG
+# Candidates considered per chunk returned
+CONTEXT_FETCH_FACTOR = int(os.getenv("CONTEXT_FETCH_FACTOR", "3"))
+# 1 ranks by relevance only, 0 by diversity only
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Cosine similarity above which a candidate counts as a copy of a chunk already picked
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.97"))
+# Longest chunk overlap looked for when merging neighbours (the splitter uses 100)
+MAX_OVERLAP_CHARS = 200
+# Shorter matches are coincidences (a shared space or word ending), not the splitter's overlap
+MIN_OVERLAP_CHARS = 20
+# A passage cut shorter than this is left out
+MIN_PASSAGE_TOKENS = 15
+
+_CHUNK_ID = re.compile(r"^(.+):(\d+)$")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(query_vector: Any, vectors: np.ndarray, k: int, lambda_mult: float = CONTEXT_MMR_LAMBDA,
+               duplicate_similarity: float = CONTEXT_DUPLICATE_SIMILARITY) -> List[int]:
+    """Rows of vectors picked by maximal marginal relevance, in the order they were picked."""
+    if len(vectors) == 0 or k <= 0:
+        return []
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    relevance = vectors @ _normalize(np.asarray(query_vector, dtype=np.float32))
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    # Similarity of every candidate to the closest chunk picked so far
+    closest = similarity[selected[0]].copy()
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * closest
+        scores[closest >= duplicate_similarity] = -np.inf
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] == -np.inf:
+            break
+        selected.append(best)
+        np.maximum(closest, similarity[best], out=closest)
+    return selected
+
+
+def search_candidates(vector_store: Any, query_vector: Any, fetch_k: int) -> Tuple[List[str], np.ndarray]:
+    """Docstore ids and stored vectors of the fetch_k nearest chunks, nearest first."""
+    import faiss
+
+    query = np.asarray([query_vector], dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        faiss.normalize_L2(query)
+    _, found = vector_store.index.search(query, min(fetch_k, vector_store.index.ntotal))
+    rows = [int(row) for row in found[0] if row != -1]
+    ids = [vector_store.index_to_docstore_id[row] for row in rows]
+    return ids, reconstruct_rows(vector_store.index, rows)
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """Two consecutive chunks as one text, with their shared edge kept once."""
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def merge_neighbours(ids: Sequence[str], docs: Sequence[Any]) -> List[Any]:
+    """Merge chunks that follow each other on the same page of a document; passages keep the best rank of their chunks.
+
+    Chunk ids are "<document_id>:<position>" (sessions indexed before chunk ids were
+    positional are left unmerged). Chunks on different pages stay apart so each
+    passage is cited with the page it comes from.
+    """
+    from langchain_core.documents import Document
+
+    positions = []
+    for rank, (docstore_id, doc) in enumerate(zip(ids, docs)):
+        match = _CHUNK_ID.match(str(docstore_id))
+        key = (match.group(1), int(match.group(2))) if match else (str(docstore_id), 0)
+        positions.append((key, rank, doc))
+    positions.sort(key=lambda item: item[0])
+
+    passages = []
+    for (document, position), rank, doc in positions:
+        if passages:
+            last = passages[-1]
+            if (last["document"] == document and last["position"] == position - 1
+                    and last["metadata"].get("page") == (doc.metadata or {}).get("page")):
+                last["text"] = _join_overlapping(last["text"], doc.page_content)
+                last["position"] = position
+                last["rank"] = min(last["rank"], rank)
+                last["chunks"] += 1
+                continue
+        passages.append({
+            "document": document, "position": position, "rank": rank, "chunks": 1,
+            "text": doc.page_content, "metadata": dict(doc.metadata or {}),
+        })
+    passages.sort(key=lambda passage: passage["rank"])
+    merged = []
+    for passage in passages:
+        if passage["chunks"] > 1:
+            passage["metadata"]["merged_chunks"] = passage["chunks"]
+        merged.append(Document(page_content=passage["text"], metadata=passage["metadata"]))
+    return merged
+
+
+def retrieve_context(vector_store: Any, query_vector: Any, k: int, fetch_k: Optional[int] = None,
+                     lambda_mult: float = CONTEXT_MMR_LAMBDA) -> List[Any]:
+    """Diverse passages for a query: MMR over the nearest chunks, neighbours merged, best first."""
+    # Uploads append to the session in place; the search waits while they do
+    with reading(vector_store):
+        if vector_store.index.ntotal == 0:
+            return []
+        ids, vectors = search_candidates(vector_store, query_vector, fetch_k or k * CONTEXT_FETCH_FACTOR)
+        picked = [ids[row] for row in mmr_select(query_vector, vectors, k, lambda_mult)]
+        docs = [vector_store.docstore.search(docstore_id) for docstore_id in picked]
+    return merge_neighbours(picked, docs)
+
+
+def similarity_search(vector_store: Any, query: str, k: int) -> List[Any]:
+    """The k chunks nearest to a query text, searched while no upload is appending to the session."""
+    with reading(vector_store):
+        return vector_store.similarity_search(query, k=k)
+
+
+def trim_passages(docs: Sequence[Any], max_tokens: int, max_passage_tokens: Optional[int] = None) -> List[str]:
+    """Passage texts in rank order within max_tokens, each cut to max_passage_tokens, the last one shortened."""
+    parts: List[str] = []
+    remaining = max_tokens
+    for doc in docs:
+        text = doc.page_content if hasattr(doc, 'page_content') else str(doc)
+        if max_passage_tokens:
+            text = truncate_to_tokens(text, max_passage_tokens)
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if remaining >= MIN_PASSAGE_TOKENS:
+                parts.append(truncate_to_tokens(text, remaining))
+            break
+        parts.append(text)
+        remaining -= tokens
+    return parts
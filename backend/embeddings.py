@@ -0,0 +1,479 @@
+"""
+Shared embedding models for the PDF ChatBot API.
+
+Loading a sentence-transformers model reads the weights and tokenizer from disk
+and takes several seconds, so each configured model is loaded once per process
+and handed out to every endpoint that embeds text.
+
+Chunk embeddings are also cached by content: identical chunk text embedded with
+the same model is looked up instead of recomputed, which makes re-uploading a
+known PDF almost free.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the cache directory is not shared between workers
+    fcntl = None
+
+# EMBEDDING CONFIG
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Comma separated list of models to load and warm at startup
+EMBEDDING_MODELS = [
+    name.strip()
+    for name in os.getenv("EMBEDDING_MODELS", DEFAULT_EMBEDDING_MODEL).split(",")
+    if name.strip()
+]
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+# Texts embedded per turn on the model; queries waiting meanwhile go before the next turn
+EMBEDDING_LOCK_BATCH = int(os.getenv("EMBEDDING_LOCK_BATCH", "32"))
+
+# EMBEDDING CACHE CONFIG
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", str(Path(__file__).parent / "data" / "embedding_cache")))
+# Maximum number of cached vectors per model (least recently used are evicted first)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# New vectors are appended to a segment file; this many pending rows trigger a compaction (shutdown compacts the rest)
+EMBEDDING_CACHE_COMPACT_ROWS = int(os.getenv("EMBEDDING_CACHE_COMPACT_ROWS", "20000"))
+
+
+def get_rss_bytes() -> int:
+    """Return the resident memory of this process in bytes (0 if unknown)."""
+    try:
+        # Linux: second field of statm is resident pages
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak RSS is the best we can do without /proc (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return 0
+
+
+class SharedEmbeddings(Embeddings):
+    """Thread-safe wrapper around a loaded HuggingFace embedding model.
+
+    Documents are embedded EMBEDDING_LOCK_BATCH texts at a time, releasing the
+    model in between, and waiting queries (chat questions) take it first, so a
+    question never waits for more than one small batch of an ingest.
+    """
+
+    def __init__(self, model_name: str, model: Any):
+        self.model_name = model_name
+        self._model = model
+        # Fast tokenizers are not safe to call from several threads at once
+        self._lock = threading.Lock()
+        # Queries waiting for or holding the model; document batches wait until there are none
+        self._queries = 0
+        self._no_queries = threading.Condition()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBEDDING_LOCK_BATCH):
+            with self._no_queries:
+                self._no_queries.wait_for(lambda: not self._queries)
+            with self._lock:
+                vectors.extend(self._model.embed_documents(texts[start:start + EMBEDDING_LOCK_BATCH]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._no_queries:
+            self._queries += 1
+        try:
+            with self._lock:
+                return self._model.embed_query(text)
+        finally:
+            with self._no_queries:
+                self._queries -= 1
+                if not self._queries:
+                    self._no_queries.notify_all()
+
+
+class EmbeddingRegistry:
+    """Loads each embedding model once per process and reports its cost."""
+
+    def __init__(self):
+        self._models: Dict[str, SharedEmbeddings] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: Optional[str] = None) -> SharedEmbeddings:
+        """Return the shared embeddings for a model, loading it on first use."""
+        model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self._load(model_name)
+            return self._models[model_name]
+
+    def register(self, model_name: str, model: Any) -> SharedEmbeddings:
+        """Serve an already built embeddings object under a model name (offline runs and benchmarks)."""
+        with self._lock:
+            self._models[model_name] = SharedEmbeddings(model_name, model)
+            self._stats[model_name] = {
+                "model": model_name, "load_seconds": 0.0, "rss_delta_mb": 0.0,
+                "warmup_seconds": None, "loaded_at": time.time(),
+            }
+            return self._models[model_name]
+
+    def _load(self, model_name: str) -> SharedEmbeddings:
+        # Import ML libraries only when needed
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        rss_before = get_rss_bytes()
+        started = time.perf_counter()
+        model = HuggingFaceEmbeddings(model_name=model_name)
+        load_seconds = time.perf_counter() - started
+        rss_after = get_rss_bytes()
+
+        self._stats[model_name] = {
+            "model": model_name,
+            "load_seconds": round(load_seconds, 3),
+            "rss_delta_mb": round(max(rss_after - rss_before, 0) / (1024 * 1024), 1),
+            "warmup_seconds": None,
+            "loaded_at": time.time(),
+        }
+        print(f"[EMBED] Loaded {model_name} in {load_seconds:.2f}s "
+              f"(+{self._stats[model_name]['rss_delta_mb']} MB RSS)")
+        return SharedEmbeddings(model_name, model)
+
+    def warm_up(self, model_names: Optional[List[str]] = None) -> None:
+        """Load the configured models and run one embedding through each."""
+        for model_name in model_names or EMBEDDING_MODELS:
+            try:
+                model = self.get(model_name)
+                started = time.perf_counter()
+                model.embed_query("warm up")
+                self._stats[model_name]["warmup_seconds"] = round(time.perf_counter() - started, 3)
+            except Exception as e:
+                print(f"[WARN] Could not warm up embedding model {model_name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return load time and memory figures for every loaded model."""
+        return {
+            "default_model": DEFAULT_EMBEDDING_MODEL,
+            "models": list(self._stats.values()),
+            "rss_mb": round(get_rss_bytes() / (1024 * 1024), 1),
+        }
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Exclusive lock on a file, shared by the worker processes using one cache directory."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+class _CacheTable:
+    """Cached vectors of one model.
+
+    Compacted vectors are a float32 .npy file listed, with their text hashes, in
+    index.json. New vectors are appended to this process's segment (raw float32
+    rows in a .f32 file, text hashes in a .keys file) and folded into a new .npy
+    generation by compact() once COMPACT_ROWS are pending, and at shutdown.
+    Worker processes sharing the directory append and compact under index.lock,
+    and a compaction merges the index and every segment on disk, so one worker
+    never overwrites another's entries.
+    """
+
+    def __init__(self, path: Path, model_name: str, max_entries: int, compact_rows: int):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.compact_rows = compact_rows
+        # text hash -> row, oldest use first
+        self.rows: "OrderedDict[str, int]" = OrderedDict()
+        self.vectors: Optional[np.ndarray] = None
+        # Rows added since the last compaction, the first `appended` of them already on disk
+        self.pending: List[np.ndarray] = []
+        self.pending_keys: List[str] = []
+        self.appended = 0
+        self.segment = f"segment-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not (self.path / "index.json").exists() and not any(self.path.glob("segment-*.keys")):
+            return
+        try:
+            with _file_lock(self.path / "index.lock"):
+                index, vectors = self._read_index()
+                segments = self._read_segments()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Ignoring unreadable embedding cache for {self.model_name}: {e}")
+            return
+        if index is not None:
+            # Memory-mapped, so a large cache costs page cache, not heap
+            self.vectors = vectors
+            self.rows = OrderedDict((key, row) for key, row in index["entries"])
+        # Rows other workers (or an earlier run) appended but nobody compacted yet
+        for keys, rows in segments:
+            for key, vector in zip(keys, rows):
+                self.insert(key, vector)
+        self.appended = len(self.pending)
+
+    def _read_index(self) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        index_path = self.path / "index.json"
+        if not index_path.exists():
+            return None, None
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        return index, np.load(self.path / index["vectors"], mmap_mode="r")
+
+    def _read_segments(self) -> List[Tuple[List[str], np.ndarray]]:
+        """(text hashes, rows) of every segment in the directory; call with index.lock held."""
+        segments = []
+        for keys_path in sorted(self.path.glob("segment-*.keys")):
+            try:
+                header, *keys = keys_path.read_text().split()
+                dim = int(header)
+                rows = np.fromfile(keys_path.with_suffix(".f32"), dtype=np.float32)
+            except (OSError, ValueError):
+                continue
+            rows = rows[:len(rows) - len(rows) % dim].reshape(-1, dim)
+            # Rows are written before their hashes, so a torn append leaves extra rows, never extra hashes
+            count = min(len(keys), len(rows))
+            segments.append((keys[:count], rows[:count]))
+        return segments
+
+    def _row(self, row: int) -> np.ndarray:
+        stored = 0 if self.vectors is None else len(self.vectors)
+        if row < stored:
+            return self.vectors[row]
+        return self.pending[row - stored]
+
+    def lookup(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        self.rows.move_to_end(key)
+        return np.array(self._row(row), dtype=np.float32)
+
+    def insert(self, key: str, vector: np.ndarray) -> None:
+        if key in self.rows:
+            self.rows.move_to_end(key)
+            return
+        self.rows[key] = (0 if self.vectors is None else len(self.vectors)) + len(self.pending)
+        self.pending.append(np.asarray(vector, dtype=np.float32))
+        self.pending_keys.append(key)
+
+    def evict(self) -> int:
+        evicted = 0
+        while len(self.rows) > self.max_entries:
+            self.rows.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def append(self) -> None:
+        """Write the pending rows not on disk yet to the end of this process's segment."""
+        if self.appended == len(self.pending):
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        rows = np.stack(self.pending[self.appended:]).astype(np.float32)
+        keys_path = self.path / f"{self.segment}.keys"
+        with _file_lock(self.path / "index.lock"):
+            # A compaction in another worker may have folded in and removed the segment
+            new_segment = not keys_path.exists()
+            with open(self.path / f"{self.segment}.f32", "wb" if new_segment else "ab") as rows_file:
+                rows_file.write(rows.tobytes())
+                rows_file.flush()
+                os.fsync(rows_file.fileno())
+            with open(keys_path, "a") as keys_file:
+                if new_segment:
+                    keys_file.write(f"{rows.shape[1]}\n")
+                keys_file.write("".join(f"{key}\n" for key in self.pending_keys[self.appended:]))
+                keys_file.flush()
+                os.fsync(keys_file.fileno())
+        self.appended = len(self.pending)
+
+    def compact(self) -> None:
+        """Merge the index, every segment and this process's rows into a new generation of the vectors file."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.path / "index.lock"):
+            merged: "OrderedDict[str, np.ndarray]" = OrderedDict()
+            generation = 0
+            old_vectors_file = None
+            try:
+                index, vectors = self._read_index()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[WARN] Replacing unreadable embedding cache index for {self.model_name}: {e}")
+                index = None
+            if index is not None:
+                generation = index["generation"]
+                old_vectors_file = index["vectors"]
+                merged.update((key, vectors[row]) for key, row in index["entries"])
+            for keys, rows in self._read_segments():
+                for key, vector in zip(keys, rows):
+                    merged[key] = vector
+                    merged.move_to_end(key)
+            # This process's own uses are the most recent it knows of
+            for key, row in self.rows.items():
+                merged[key] = self._row(row)
+                merged.move_to_end(key)
+            while len(merged) > self.max_entries:
+                merged.popitem(last=False)
+
+            if merged:
+                vectors = np.stack(list(merged.values())).astype(np.float32)
+            else:
+                vectors = np.zeros((0, 0), dtype=np.float32)
+            generation += 1
+            # Unique per writer so no worker can replace a file another one has mapped
+            suffix = uuid.uuid4().hex[:8]
+            vectors_file = f"vectors-{generation}-{suffix}.npy"
+            np.save(self.path / vectors_file, vectors)
+
+            # The index is swapped in last so it always points at a complete vectors file
+            tmp_index = self.path / f"index.json.{suffix}.tmp"
+            with open(tmp_index, "w") as index_file:
+                json.dump({
+                    "model": self.model_name,
+                    "generation": generation,
+                    "vectors": vectors_file,
+                    "entries": [[key, row] for row, key in enumerate(merged)],
+                }, index_file)
+            os.replace(tmp_index, self.path / "index.json")
+
+            # Every segment is in the new generation now
+            for segment_file in [*self.path.glob("segment-*.keys"), *self.path.glob("segment-*.f32")]:
+                segment_file.unlink(missing_ok=True)
+            if old_vectors_file is not None and old_vectors_file != vectors_file:
+                try:
+                    (self.path / old_vectors_file).unlink(missing_ok=True)
+                except OSError:
+                    # Still mapped somewhere (Windows); leave it behind
+                    pass
+            # Mapped before the lock is released: the next compaction anywhere deletes the file
+            vectors = np.load(self.path / vectors_file, mmap_mode="r")
+
+        self.rows = OrderedDict((key, row) for row, key in enumerate(merged))
+        self.vectors = vectors
+        self.pending = []
+        self.pending_keys = []
+        self.appended = 0
+
+
+class EmbeddingCache:
+    """Content-addressed cache of chunk embeddings keyed by (model name, text hash)."""
+
+    def __init__(self, root: Path, max_entries: int, enabled: bool = True,
+                 compact_rows: int = EMBEDDING_CACHE_COMPACT_ROWS):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.compact_rows = compact_rows
+        self.enabled = enabled
+        self._tables: Dict[str, _CacheTable] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _table(self, model_name: str) -> _CacheTable:
+        with self._lock:
+            if model_name not in self._tables:
+                model_key = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16]
+                self._tables[model_name] = _CacheTable(
+                    self.root / model_key, model_name, self.max_entries, self.compact_rows
+                )
+            return self._tables[model_name]
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, embeddings: SharedEmbeddings, texts: List[str]) -> np.ndarray:
+        """Return one float32 vector per text, embedding only the texts not seen before."""
+        if not self.enabled:
+            return np.array(embeddings.embed_documents(texts), dtype=np.float32)
+
+        table = self._table(embeddings.model_name)
+        keys = [self.text_key(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        with table.lock:
+            for i, key in enumerate(keys):
+                vectors[i] = table.lookup(key)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            # Repeated chunks inside one document only need embedding once
+            unique_missing = list(OrderedDict((keys[i], i) for i in missing).values())
+            self.hits += len(texts) - len(missing)
+            self.misses += len(unique_missing)
+
+        if unique_missing:
+            computed = np.array(embeddings.embed_documents([texts[i] for i in unique_missing]), dtype=np.float32)
+            by_key = {keys[i]: computed[n] for n, i in enumerate(unique_missing)}
+            for i in missing:
+                vectors[i] = by_key[keys[i]]
+            with table.lock:
+                for key, vector in by_key.items():
+                    table.insert(key, vector)
+                self.evictions += table.evict()
+                try:
+                    # Appending costs only the new rows; the whole file is rewritten once COMPACT_ROWS pile up
+                    if len(table.pending) >= table.compact_rows:
+                        table.compact()
+                    else:
+                        table.append()
+                except OSError as e:
+                    print(f"[WARN] Could not persist embedding cache: {e}")
+
+        return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def flush(self) -> None:
+        """Compact the vectors appended since the last compaction (at shutdown)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            tables = list(self._tables.values())
+        for table in tables:
+            with table.lock:
+                if not table.pending:
+                    continue
+                try:
+                    table.compact()
+                except OSError as e:
+                    print(f"[WARN] Could not compact embedding cache for {table.model_name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": {name: len(table.rows) for name, table in self._tables.items()},
+            "pending": {name: len(table.pending) for name, table in self._tables.items()},
+            "max_entries": self.max_entries,
+            "compact_rows": self.compact_rows,
+        }
+
+
+embedding_registry = EmbeddingRegistry()
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES, enabled=EMBEDDING_CACHE_ENABLED)
@@ -0,0 +1,242 @@
+"""
+Content-addressed cache of generated images.
+
+An image is identified by a hash of what produced it: the (enhanced) prompt,
+its size and the provider chain. Images are stored once under IMAGE_CACHE_DIR
+as <id><extension>. GET /api/images/{id} serves them as plain binary files, and
+since an id always names the same bytes, responses carry the id as a strong
+ETag and can be cached by browsers for good.
+
+Prompt enhancement asks the LLM for a new wording each time, so a repeated
+request would hash differently. Requests are therefore also remembered by the
+raw prompt and the session's document fingerprint, and a repeated request is
+answered without the LLM or a provider. Concurrent requests for the same image
+share one generation.
+
+The images on disk are indexed in memory (id -> file and size, least recently
+used first, with a running total), built with one directory scan at startup,
+so lookups and eviction never list the directory. Images another worker stored
+in a shared directory are picked up on first lookup, and each worker evicts the
+images it knows of.
+"""
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, BinaryIO, Callable, Dict, Optional, Tuple
+
+from concurrency import run_blocking
+
+# IMAGE CACHE CONFIG
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", str(Path(__file__).parent / "data" / "images")))
+# Total size of the cached images (least recently used are removed first)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+# Requests remembered by raw prompt (in memory)
+IMAGE_CACHE_REQUEST_ENTRIES = 1024
+
+_IMAGE_ID = re.compile(r"^[0-9a-f]{32}$")
+# Extensions tried for an image this process has not indexed (stored by another worker)
+_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".img")
+
+
+def image_id(prompt: str, width: int, height: int, model: str) -> str:
+    """Id of the image a provider chain generates for a prompt at a size."""
+    return hashlib.sha256(json.dumps([prompt, width, height, model]).encode("utf-8")).hexdigest()[:32]
+
+
+class ImageCache:
+    """Generated images on disk keyed by image id, bounded by total size."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # request key -> (image id, enhanced prompt), most recently used last
+        self._requests: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Generations in flight, only touched from the event loop
+        self._pending: Dict[str, "asyncio.Future"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.request_hits = 0
+        self.evictions = 0
+        # image id -> (file, size), least recently used first
+        self._images: "OrderedDict[str, Tuple[Path, int]]" = OrderedDict()
+        self._bytes = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        images = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".") or not _IMAGE_ID.match(path.stem):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            images.append((stat.st_mtime, path.stem, path, stat.st_size))
+        # The modification time orders eviction across restarts
+        for _, image_id, path, size in sorted(images):
+            self._add(image_id, path, size)
+
+    def _add(self, image_id: str, path: Path, size: int) -> None:
+        self._forget(image_id)
+        self._images[image_id] = (path, size)
+        self._bytes += size
+
+    def _forget(self, image_id: str) -> None:
+        known = self._images.pop(image_id, None)
+        if known is not None:
+            self._bytes -= known[1]
+
+    def path(self, image_id: str) -> Optional[Path]:
+        """File of a cached image, or None."""
+        if not _IMAGE_ID.match(image_id):
+            return None
+        with self._lock:
+            known = self._images.get(image_id)
+        if known is not None:
+            if known[0].exists():
+                return known[0]
+            # Evicted by another worker sharing the directory
+            with self._lock:
+                self._forget(image_id)
+            return None
+        for extension in _EXTENSIONS:
+            path = self.root / f"{image_id}{extension}"
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            with self._lock:
+                self._add(image_id, path, size)
+                self._prune()
+            return path
+        return None
+
+    @staticmethod
+    def content_type(path: Path) -> str:
+        return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    def _touch(self, image_id: str, path: Path) -> None:
+        with self._lock:
+            if image_id in self._images:
+                self._images.move_to_end(image_id)
+        # Keeps the order for the next startup's scan
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _tmp_file(self, image_id: str) -> Path:
+        # Other workers may share the directory: every generation writes its own file
+        return self.root / f".{image_id}.{uuid.uuid4().hex[:8]}.tmp"
+
+    def _store(self, image_id: str, tmp_file: Path, content_type: str) -> Path:
+        """Move a fully written image into place."""
+        extension = mimetypes.guess_extension(content_type) or ".img"
+        path = self.root / f"{image_id}{extension}"
+        os.replace(tmp_file, path)
+        size = path.stat().st_size
+        with self._lock:
+            known = self._images.get(image_id)
+            if known is not None and known[0] != path:
+                # Stored again as another type; only the new file is indexed
+                known[0].unlink(missing_ok=True)
+            self._add(image_id, path, size)
+            self._prune()
+        return path
+
+    def _prune(self) -> None:
+        """Remove least recently used images until the total fits; call with the lock held."""
+        while self._bytes > self.max_bytes and self._images:
+            image_id, (path, _) = next(iter(self._images.items()))
+            self._forget(image_id)
+            # Responses already streaming keep their open file
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+
+    def cached_request(self, request_key: str) -> Optional[Tuple[str, str]]:
+        """(image id, enhanced prompt) of an earlier request whose image is still cached."""
+        with self._lock:
+            found = self._requests.get(request_key)
+            if found is not None:
+                self._requests.move_to_end(request_key)
+        if found is None or self.path(found[0]) is None:
+            return None
+        self.request_hits += 1
+        return found
+
+    def remember_request(self, request_key: str, image_id: str, prompt: str) -> None:
+        with self._lock:
+            self._requests[request_key] = (image_id, prompt)
+            self._requests.move_to_end(request_key)
+            while len(self._requests) > IMAGE_CACHE_REQUEST_ENTRIES:
+                self._requests.popitem(last=False)
+
+    def _lookup(self, image_id: str) -> Optional[Path]:
+        path = self.path(image_id)
+        if path is not None:
+            self._touch(image_id, path)
+        return path
+
+    async def get_or_generate(self, image_id: str, generate: Callable[[BinaryIO], Awaitable[Tuple[int, str, str]]]) -> Path:
+        """Return the cached image file, generating (and storing) it if missing.
+
+        generate(image_file) writes the image to an open temporary file and returns
+        (size, content type, provider name).
+        """
+        if image_id not in self._pending:
+            path = await run_blocking(self._lookup, image_id)
+            if path is not None:
+                self.hits += 1
+                return path
+            self.misses += 1
+        # Another request may have started the generation while the disk was checked
+        pending = self._pending.get(image_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._generate(image_id, generate))
+            self._pending[image_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(image_id, None))
+        # A disconnecting client must not cancel a generation other requests are waiting for
+        return await asyncio.shield(pending)
+
+    async def _generate(self, image_id: str, generate: Callable[[BinaryIO], Awaitable[Tuple[int, str, str]]]) -> Path:
+        started = time.perf_counter()
+        tmp_file = self._tmp_file(image_id)
+        image_file = await run_blocking(open, tmp_file, "w+b")
+        try:
+            size, content_type, provider = await generate(image_file)
+            await run_blocking(image_file.close)
+            path = await run_blocking(self._store, image_id, tmp_file, content_type)
+        except BaseException:
+            image_file.close()
+            tmp_file.unlink(missing_ok=True)
+            raise
+        print(f"[IMAGE] Cached {image_id[:12]} from {provider} ({size} bytes, "
+              f"{time.perf_counter() - started:.1f} s)")
+        return path
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "request_hits": self.request_hits,
+            "evictions": self.evictions,
+            "entries": len(self._images),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "pending": len(self._pending),
+        }
+
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
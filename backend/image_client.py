@@ -0,0 +1,192 @@
+"""
+Image generation providers behind one pooled async HTTP client.
+
+Every provider is a GET endpoint returning image bytes for a prompt. They are
+tried in IMAGE_PROVIDERS order until one answers with an image. Each provider
+has its own total time limit, and bodies are streamed with a size cap straight
+into the file the caller passes (the image cache's temporary file), so an image
+is never held in memory whole. The client keeps its connections alive between
+requests and is closed on shutdown.
+
+A provider's URL and timeout can be overridden from the environment, which also
+lets tests point the chain at a local stub server:
+
+    IMAGE_PROVIDER_POLLINATIONS_URL=http://127.0.0.1:9000/prompt/{prompt}
+    IMAGE_PROVIDER_POLLINATIONS_TIMEOUT=5
+
+Other names in IMAGE_PROVIDERS define new providers from the same variables.
+"""
+import asyncio
+import os
+import time
+from typing import BinaryIO, Dict, List, Tuple
+from urllib.parse import quote
+
+from concurrency import run_blocking
+
+# IMAGE GENERATION CONFIG
+# Providers tried in order until one returns an image
+IMAGE_PROVIDERS = [
+    name.strip()
+    for name in os.getenv("IMAGE_PROVIDERS", "pollinations,pollinations-turbo").split(",")
+    if name.strip()
+]
+IMAGE_WIDTH = int(os.getenv("IMAGE_WIDTH", "512"))
+IMAGE_HEIGHT = int(os.getenv("IMAGE_HEIGHT", "512"))
+# Larger responses are rejected while streaming
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_HTTP_MAX_CONNECTIONS = int(os.getenv("IMAGE_HTTP_MAX_CONNECTIONS", "20"))
+
+# url is formatted with the quoted prompt, width and height; params are sent as the query string
+BUILTIN_PROVIDERS: Dict[str, Dict] = {
+    "pollinations": {
+        "url": "https://image.pollinations.ai/prompt/{prompt}",
+        "params": {"width": "{width}", "height": "{height}", "model": "flux", "nologo": "true"},
+        "timeout": 60.0,
+    },
+    # Faster, lower quality model of the same service
+    "pollinations-turbo": {
+        "url": "https://image.pollinations.ai/prompt/{prompt}",
+        "params": {"width": "{width}", "height": "{height}", "model": "turbo", "nologo": "true"},
+        "timeout": 30.0,
+    },
+}
+
+
+class ImageProviderError(Exception):
+    def __init__(self, provider: str, message: str, timed_out: bool = False):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.timed_out = timed_out
+
+
+class ImageGenerationFailed(Exception):
+    """Every provider in the chain failed."""
+
+    def __init__(self, errors: List[ImageProviderError]):
+        super().__init__("; ".join(str(error) for error in errors) or "no image providers configured")
+        self.errors = errors
+
+    @property
+    def timed_out(self) -> bool:
+        return bool(self.errors) and all(error.timed_out for error in self.errors)
+
+
+class ImageProvider:
+    def __init__(self, name: str, url: str, params: Dict[str, str], timeout: float):
+        self.name = name
+        self.url = url
+        self.params = params
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls, name: str) -> "ImageProvider":
+        builtin = BUILTIN_PROVIDERS.get(name, {})
+        env_prefix = "IMAGE_PROVIDER_" + name.upper().replace("-", "_")
+        url = os.getenv(f"{env_prefix}_URL", builtin.get("url"))
+        if not url:
+            raise ValueError(f"Image provider {name!r} has no URL (set {env_prefix}_URL)")
+        timeout = float(os.getenv(f"{env_prefix}_TIMEOUT", str(builtin.get("timeout", 60.0))))
+        return cls(name, url, dict(builtin.get("params", {})), timeout)
+
+
+class ImageClient:
+    """Pooled HTTP client trying the configured image providers in order."""
+
+    def __init__(self, provider_names: List[str], max_bytes: int, max_connections: int):
+        self.providers = [ImageProvider.from_env(name) for name in provider_names]
+        self.max_bytes = max_bytes
+        self.max_connections = max_connections
+        self._client = None
+        self.requests: Dict[str, Dict[str, int]] = {
+            provider.name: {"ok": 0, "failed": 0, "timed_out": 0} for provider in self.providers
+        }
+
+    def _http(self):
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def generate(self, prompt: str, image_file: BinaryIO, width: int = IMAGE_WIDTH,
+                       height: int = IMAGE_HEIGHT) -> Tuple[int, str, str]:
+        """Write the image of the first provider that succeeds to image_file.
+
+        Returns (image size in bytes, content type, provider name).
+        """
+        import httpx
+
+        errors = []
+        for provider in self.providers:
+            started = time.perf_counter()
+            try:
+                # A provider that failed halfway may have left part of its image behind
+                await run_blocking(self._rewind, image_file)
+                # The provider timeout bounds the whole request, not each read
+                size, content_type = await asyncio.wait_for(
+                    self._fetch(provider, prompt, width, height, image_file), timeout=provider.timeout
+                )
+            except asyncio.TimeoutError:
+                error = ImageProviderError(provider.name, f"timed out after {provider.timeout:g}s", timed_out=True)
+            except ImageProviderError as e:
+                error = e
+            except Exception as e:
+                # Connection errors and malformed responses
+                error = ImageProviderError(
+                    provider.name, f"{type(e).__name__}: {e}", timed_out=isinstance(e, httpx.TimeoutException)
+                )
+            else:
+                self.requests[provider.name]["ok"] += 1
+                print(f"[IMAGE] {provider.name} returned {size} bytes in {time.perf_counter() - started:.1f} s")
+                return size, content_type, provider.name
+            self.requests[provider.name]["timed_out" if error.timed_out else "failed"] += 1
+            print(f"[WARN] Image provider failed, trying the next one: {error}")
+            errors.append(error)
+        raise ImageGenerationFailed(errors)
+
+    @staticmethod
+    def _rewind(image_file: BinaryIO) -> None:
+        image_file.seek(0)
+        image_file.truncate()
+
+    async def _fetch(self, provider: ImageProvider, prompt: str, width: int, height: int,
+                     image_file: BinaryIO) -> Tuple[int, str]:
+        values = {"prompt": quote(prompt, safe=""), "width": width, "height": height}
+        url = provider.url.format(**values)
+        params = {key: value.format(**values) for key, value in provider.params.items()}
+        async with self._http().stream("GET", url, params=params, timeout=provider.timeout) as response:
+            if response.status_code != 200:
+                raise ImageProviderError(provider.name, f"HTTP {response.status_code}")
+            content_type = response.headers.get("content-type", "").split(";")[0].strip()
+            if not content_type.startswith("image/"):
+                raise ImageProviderError(provider.name, f"unexpected content type {content_type or 'none'}")
+            if int(response.headers.get("content-length") or 0) > self.max_bytes:
+                raise ImageProviderError(provider.name, "image too large")
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageProviderError(provider.name, "image too large")
+                await run_blocking(image_file.write, chunk)
+        return size, content_type
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "providers": [
+                {"name": provider.name, "timeout": provider.timeout, **self.requests[provider.name]}
+                for provider in self.providers
+            ],
+            "max_bytes": self.max_bytes,
+        }
+
+
+image_client = ImageClient(IMAGE_PROVIDERS, IMAGE_MAX_BYTES, IMAGE_HTTP_MAX_CONNECTIONS)
@@ -0,0 +1,205 @@
+"""
+Background ingestion jobs for PDF uploads.
+
+Extraction, splitting, embedding and indexing are CPU-bound, so uploads are
+queued and processed by a small bounded thread pool while the event loop keeps
+serving chat, quiz and flashcard requests. Job status is kept in memory so the
+client can poll it; when several workers serve the API it is also written to a
+shared directory so any worker can answer the poll.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from metrics import observe_stage
+
+# INGESTION CONFIG
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Jobs waiting or running at once; further uploads are rejected until a slot frees up
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+# How long finished jobs stay queryable
+INGEST_JOB_TTL_SECONDS = int(os.getenv("INGEST_JOB_TTL_SECONDS", "3600"))
+# Minimum interval between progress writes to the shared status directory
+INGEST_STATUS_WRITE_INTERVAL = 0.5
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestError(Exception):
+    """The upload itself is unusable (e.g. a PDF without text); reported to the client with status_code."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestJob:
+    """Status of one upload moving through the ingestion pipeline."""
+
+    def __init__(self, session_id: str, filename: str):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.filename = filename
+        self.status = "queued"  # queued, running, done, failed
+        self.stage = "queued"  # queued, extracting, splitting, embedding, indexing, done
+        self.progress = 0.0
+        self.chunks_count = 0
+        # Id of the document the upload adds to its session, set by the pipeline
+        self.document_id: Optional[str] = None
+        self.message: Optional[str] = None
+        self.error: Optional[str] = None
+        # HTTP status the client should see for a failed job
+        self.error_status: Optional[int] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # When the current stage started, for the stage latency metrics
+        self._stage_started = time.perf_counter()
+        # Set when job status is shared with other workers
+        self.status_path: Optional[Path] = None
+        self._written_at = 0.0
+
+    def update(self, **fields: Any) -> None:
+        changed_stage = any(name in fields for name in ("status", "stage"))
+        if "stage" in fields and fields["stage"] != self.stage:
+            now = time.perf_counter()
+            observe_stage("upload", self.stage, now - self._stage_started)
+            self._stage_started = now
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated_at = time.time()
+        if self.status_path is not None and (
+            changed_stage or self.updated_at - self._written_at >= INGEST_STATUS_WRITE_INTERVAL
+        ):
+            self.write_status()
+
+    def write_status(self) -> None:
+        """Publish the job status for the other workers."""
+        tmp_file = self.status_path.with_suffix(".tmp")
+        try:
+            with open(tmp_file, "w") as status_file:
+                json.dump(self.to_dict(), status_file)
+            os.replace(tmp_file, self.status_path)
+            self._written_at = self.updated_at
+        except OSError as e:
+            print(f"[WARN] Could not write status of ingestion job {self.job_id}: {e}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "chunks_count": self.chunks_count,
+            "document_id": self.document_id,
+            "message": self.message,
+            "error": self.error,
+            "error_status": self.error_status,
+        }
+
+
+class IngestQueue:
+    """Runs ingestion pipelines on a bounded worker pool and tracks their status."""
+
+    def __init__(self, workers: int, max_pending: int, job_ttl: int):
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_pending = max_pending
+        self._job_ttl = job_ttl
+        self._jobs: Dict[str, IngestJob] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._status_dir: Optional[Path] = None
+
+    def share_status(self, status_dir: Path) -> None:
+        """Also publish job status to a directory shared with the other workers."""
+        self._status_dir = Path(status_dir)
+        self._status_dir.mkdir(parents=True, exist_ok=True)
+
+    def _status_path(self, job_id: str) -> Optional[Path]:
+        if self._status_dir is None:
+            return None
+        return self._status_dir / f"{job_id}.json"
+
+    def submit(self, pipeline: Callable[[IngestJob], None], session_id: str, filename: str) -> IngestJob:
+        """Queue a pipeline run. Raises IngestQueueFull when too many jobs are in flight."""
+        with self._lock:
+            self._prune()
+            if self._pending >= self._max_pending:
+                raise IngestQueueFull()
+            self._pending += 1
+            job = IngestJob(session_id, filename)
+            job.status_path = self._status_path(job.job_id)
+            if job.status_path is not None:
+                job.write_status()
+            self._jobs[job.job_id] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="ingest")
+            executor = self._executor
+        executor.submit(self._run, job, pipeline)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job queued by this worker or, with shared status, by any worker."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self._status_dir is None:
+            return None
+        try:
+            # Job ids come from the client and end up in a file path
+            status_path = self._status_path(str(uuid.UUID(job_id)))
+            with open(status_path) as status_file:
+                return json.load(status_file)
+        except (ValueError, OSError):
+            return None
+
+    def pending(self) -> int:
+        return self._pending
+
+    def _run(self, job: IngestJob, pipeline: Callable[[IngestJob], None]) -> None:
+        job.update(status="running")
+        try:
+            pipeline(job)
+            job.update(status="done", stage="done", progress=1.0)
+        except Exception as e:
+            print(f"[ERROR] Ingestion job {job.job_id} failed at stage {job.stage}: {e}")
+            job.update(status="failed", error=str(e), error_status=getattr(e, "status_code", 500))
+        finally:
+            observe_stage("upload", "total" if job.status == "done" else "failed", time.time() - job.created_at)
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self._job_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in ("done", "failed") and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job.status_path is not None:
+                try:
+                    os.unlink(job.status_path)
+                except OSError:
+                    pass
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+ingest_queue = IngestQueue(INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_JOB_TTL_SECONDS)
@@ -0,0 +1,476 @@
+"""
+Central scheduler for LLM calls.
+
+Every chat, quiz, flashcard, title and image prompt call goes through
+llm_scheduler, which holds the Groq clients (one per sampling setting, so
+connections are reused) and admits calls within the provider's limits:
+
+- Two token buckets, one on requests and one on tokens per minute
+  (LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE), both off unless set. A
+  call reserves the estimated tokens of its prompt plus the expected size of
+  its answer (LLM_EXPECTED_OUTPUT_TOKENS, at most its max_tokens); once it
+  finishes the reservation is corrected with the usage the provider reports.
+  The buckets are kept per worker process: with several workers, set each
+  limit to the provider's divided by the number of workers.
+- At most LLM_CONCURRENCY calls in flight.
+- Priority classes: interactive calls (chat, quiz, flashcards, names, image
+  prompts) go ahead of background ones (study packs precomputed after upload),
+  and background calls leave LLM_INTERACTIVE_RESERVE of both buckets unused.
+- Fairness: within a class, waiting callers (sessions) are served round-robin,
+  so one session's burst cannot starve the others.
+- Bounded queueing: a call is rejected up front when the queue is full
+  (LLMOverloaded, HTTP 503) or when the buckets cannot admit it within its
+  class's maximum wait (LLMRateLimited, HTTP 429 with Retry-After). A call
+  still waiting when its wait runs out is rejected the same way.
+- A 429 from the provider pauses all dispatch for its Retry-After, and the
+  call is queued again while its deadline allows.
+
+Callers say who they are with set_llm_caller(); tasks started from a request
+inherit it. GROQ_BASE_URL points the clients at another OpenAI-compatible
+server, such as a local fake LLM for load tests.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from concurrency import LLM_CONCURRENCY
+from metrics import llm_calls, llm_tokens
+
+# LLM SCHEDULER CONFIG
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+# Provider limits per worker process, 0 (the default) disables a bucket
+# (Groq's free tier for llama-3.1-8b-instant is 30 requests and 6000 tokens per minute)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# Calls waiting for admission, over all classes
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "200"))
+# Share of both buckets background calls leave for interactive ones
+LLM_INTERACTIVE_RESERVE = float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.25"))
+# Longest a call may wait to start before it is rejected, per class
+LLM_INTERACTIVE_MAX_WAIT_SECONDS = float(os.getenv("LLM_INTERACTIVE_MAX_WAIT_SECONDS", "15"))
+LLM_BACKGROUND_MAX_WAIT_SECONDS = float(os.getenv("LLM_BACKGROUND_MAX_WAIT_SECONDS", "600"))
+# Retries of a call the provider answered with 429
+LLM_MAX_RETRIES = 2
+# Answer tokens reserved per call until the provider reports its usage (capped by the call's max_tokens)
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "300"))
+CHARS_PER_TOKEN = 4
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+MAX_WAIT_SECONDS = {
+    PRIORITY_INTERACTIVE: LLM_INTERACTIVE_MAX_WAIT_SECONDS,
+    PRIORITY_BACKGROUND: LLM_BACKGROUND_MAX_WAIT_SECONDS,
+}
+
+_caller: ContextVar[str] = ContextVar("llm_caller", default="anonymous")
+_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+def set_llm_caller(caller: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+    """Attribute the current task's LLM calls (and those of tasks it starts) to a caller and class."""
+    _caller.set(caller)
+    _priority.set(priority)
+
+
+class LLMUnavailable(Exception):
+    """An LLM call was not admitted; maps to an HTTP error with a Retry-After hint."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimited(LLMUnavailable):
+    status_code = 429
+
+
+class LLMOverloaded(LLMUnavailable):
+    status_code = 503
+
+
+class TokenBucket:
+    """Refills per_minute units evenly over a minute, holding at most a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float, keep: float = 0.0) -> float:
+        """Seconds until amount units are available with a keep share of the capacity left over.
+
+        Amounts above what may be used need a full bucket.
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        kept = self.capacity * keep
+        missing = min(amount, self.capacity - kept) + kept - self.level
+        return max(0.0, missing / self.rate)
+
+    def estimate_wait(self, amount: float, now: float) -> float:
+        """Seconds until amount units will have been available, for work queued ahead included."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Give back (or, negative, charge) units once the real cost is known."""
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+    def empty(self, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("priority", "caller", "cost", "future")
+
+    def __init__(self, priority: int, caller: str, cost: int, future: "asyncio.Future"):
+        self.priority = priority
+        self.caller = caller
+        self.cost = cost
+        self.future = future
+
+
+def estimate_tokens(messages: Any) -> int:
+    """Prompt tokens of a call, estimated from its length."""
+    if isinstance(messages, str):
+        chars = len(messages)
+    else:
+        chars = sum(len(str(getattr(message, "content", message))) for message in messages)
+    return chars // CHARS_PER_TOKEN
+
+
+def expected_output_tokens(max_tokens: Optional[int]) -> int:
+    """Answer tokens reserved for a call; max_tokens is only an upper bound, rarely reached."""
+    return min(max_tokens or LLM_EXPECTED_OUTPUT_TOKENS, LLM_EXPECTED_OUTPUT_TOKENS)
+
+
+def _provider_retry_after(error: Exception) -> Optional[float]:
+    """Retry-After of a provider 429, or None for other errors."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(0.5, float(headers.get("retry-after", "2")))
+    except ValueError:
+        return 2.0
+
+
+class LLMScheduler:
+    """Admits LLM calls by priority, per-caller round-robin and the provider's rate limits."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, concurrency: int, queue_limit: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self._clients: Dict[Tuple[Optional[float], Optional[int]], Any] = {}
+        self.granted = 0
+        self.rejected_rate_limited = 0
+        self.rejected_overloaded = 0
+        self.expired = 0
+        self.provider_rate_limits = 0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        # State tied to an event loop, rebuilt when a new loop starts using the scheduler
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        # priority -> caller -> waiting calls; callers are served in insertion order and rotate to the back
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_NAMES
+        }
+        self._queued = 0
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._requests = TokenBucket(self.requests_per_minute)
+        self._tokens = TokenBucket(self.tokens_per_minute)
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset()
+            # Clients hold connections opened on the previous loop
+            self._clients.clear()
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._dispatch())
+
+    def client(self, temperature: Optional[float] = None, max_tokens: Optional[int] = None):
+        """Groq chat model for a sampling setting, shared by every call using it."""
+        key = (temperature, max_tokens)
+        if key not in self._clients:
+            from langchain_groq import ChatGroq
+
+            options: Dict[str, Any] = {"api_key": os.getenv("GROQ_API_KEY"), "model_name": LLM_MODEL, "max_retries": 0}
+            if temperature is not None:
+                options["temperature"] = temperature
+            if max_tokens is not None:
+                options["max_tokens"] = max_tokens
+            if GROQ_BASE_URL:
+                options["base_url"] = GROQ_BASE_URL
+            self._clients[key] = ChatGroq(**options)
+        return self._clients[key]
+
+    # Admission
+
+    def _ahead(self, priority: int) -> Tuple[int, int]:
+        """Calls and tokens waiting in classes served before or with the given one."""
+        calls = tokens = 0
+        for queued_priority, callers in self._queues.items():
+            if queued_priority <= priority:
+                for waiters in callers.values():
+                    calls += len(waiters)
+                    tokens += sum(waiter.cost for waiter in waiters)
+        return calls, tokens
+
+    def _expected_wait(self, priority: int, cost: int) -> float:
+        now = time.monotonic()
+        calls, tokens = self._ahead(priority)
+        return max(
+            self._paused_until - now,
+            self._requests.estimate_wait(calls + 1, now),
+            self._tokens.estimate_wait(tokens + cost, now),
+        )
+
+    async def _acquire(self, cost: int, deadline: float) -> None:
+        self._ensure_running()
+        priority, caller = _priority.get(), _caller.get()
+        if self._queued >= self.queue_limit:
+            self.rejected_overloaded += 1
+            raise LLMOverloaded("The assistant is overloaded. Please try again shortly.", retry_after=5.0)
+        expected = self._expected_wait(priority, cost)
+        if time.monotonic() + expected > deadline:
+            self.rejected_rate_limited += 1
+            raise LLMRateLimited(
+                f"The assistant is busy (about {expected:.0f} s wait). Please try again shortly.", retry_after=expected
+            )
+        waiter = _Waiter(priority, caller, cost, self._loop.create_future())
+        self._queues[priority].setdefault(caller, deque()).append(waiter)
+        self._queued += 1
+        self._wake.set()
+        try:
+            await asyncio.wait_for(waiter.future, max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # The client went away or the wait ran out; wait_for has cancelled the future, so the dispatcher skips it
+            self._discard(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just before the timeout or cancellation landed: give the slot back
+                self._release(cost, None)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.expired += 1
+            retry_after = self._expected_wait(priority, cost)
+            raise LLMRateLimited("The assistant is busy. Please try again shortly.", retry_after=max(1.0, retry_after))
+
+    def _discard(self, waiter: _Waiter) -> None:
+        callers = self._queues[waiter.priority]
+        waiters = callers.get(waiter.caller)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del callers[waiter.caller]
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Oldest call of the next caller in the highest waiting class (without removing it)."""
+        for priority in sorted(self._queues):
+            callers = self._queues[priority]
+            while callers:
+                caller, waiters = next(iter(callers.items()))
+                if waiters[0].future.done():
+                    # Cancelled or timed out while queued
+                    self._pop(priority, caller)
+                    continue
+                return waiters[0]
+        return None
+
+    def _pop(self, priority: int, caller: str) -> None:
+        callers = self._queues[priority]
+        waiters = callers[caller]
+        waiters.popleft()
+        self._queued -= 1
+        if waiters:
+            # Round-robin: the caller's next call waits behind the other callers
+            callers.move_to_end(caller)
+        else:
+            del callers[caller]
+
+    async def _dispatch(self) -> None:
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None or self.in_flight >= self.concurrency:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            now = time.monotonic()
+            keep = LLM_INTERACTIVE_RESERVE if waiter.priority == PRIORITY_BACKGROUND else 0.0
+            wait = max(
+                self._paused_until - now,
+                self._requests.wait_time(1, now, keep),
+                self._tokens.wait_time(waiter.cost, now, keep),
+            )
+            if wait > 0:
+                # Wake early if a more urgent call arrives
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pop(waiter.priority, waiter.caller)
+            self._requests.take(1, now)
+            self._tokens.take(waiter.cost, now)
+            self.in_flight += 1
+            self.granted += 1
+            self.tokens_reserved += waiter.cost
+            waiter.future.set_result(None)
+
+    def _release(self, reserved: int, used: Optional[int]) -> None:
+        self.in_flight -= 1
+        if used is not None:
+            self.tokens_used += used
+            self._tokens.adjust(reserved - used)
+        self._wake.set()
+
+    def _provider_limited(self, retry_after: float) -> None:
+        self.provider_rate_limits += 1
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + retry_after)
+        self._tokens.empty(now)
+        print(f"[LLM] Provider rate limit hit, pausing LLM calls for {retry_after:.1f} s")
+
+    def _record_call(self, outcome: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        priority = PRIORITY_NAMES[_priority.get()]
+        llm_calls.inc(outcome=outcome, priority=priority)
+        if prompt_tokens or completion_tokens:
+            llm_tokens.inc(prompt_tokens, kind="prompt", priority=priority)
+            llm_tokens.inc(completion_tokens, kind="completion", priority=priority)
+
+    # Calls
+
+    async def invoke(self, messages: Any, temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Any:
+        """Run one LLM call once admitted; returns the model's message."""
+        llm = self.client(temperature, max_tokens)
+        prompt_tokens = estimate_tokens(messages)
+        cost = prompt_tokens + expected_output_tokens(max_tokens)
+        deadline = time.monotonic() + MAX_WAIT_SECONDS[_priority.get()]
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self._acquire(cost, deadline)
+            used = None
+            try:
+                response = await llm.ainvoke(messages)
+                usage = getattr(response, "usage_metadata", None) or {}
+                if not usage:
+                    # No usage reported: reconcile with the prompt estimate and the answer's length
+                    content = str(getattr(response, "content", response))
+                    usage = {"input_tokens": prompt_tokens, "output_tokens": len(content) // CHARS_PER_TOKEN}
+                used = usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+                self._record_call("ok", usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+                return response
+            except Exception as e:
+                retry_after = _provider_retry_after(e)
+                self._record_call("error" if retry_after is None else "rate_limited")
+                if retry_after is None:
+                    raise
+                self._provider_limited(retry_after)
+                if attempt == LLM_MAX_RETRIES or time.monotonic() + retry_after > deadline:
+                    raise LLMRateLimited("The assistant is busy. Please try again shortly.", retry_after) from e
+            finally:
+                self._release(cost, used)
+
+    async def stream(self, messages: Any, temperature: Optional[float] = None,
+                     max_tokens: Optional[int] = None) -> AsyncIterator[Any]:
+        """Stream one LLM call once admitted; a provider 429 is retried only before the first chunk."""
+        llm = self.client(temperature, max_tokens)
+        prompt_tokens = estimate_tokens(messages)
+        cost = prompt_tokens + expected_output_tokens(max_tokens)
+        deadline = time.monotonic() + MAX_WAIT_SECONDS[_priority.get()]
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self._acquire(cost, deadline)
+            used: Optional[int] = None
+            usage_total = {"input_tokens": 0, "output_tokens": 0}
+            output: List[str] = []
+            try:
+                async for chunk in llm.astream(messages):
+                    usage = getattr(chunk, "usage_metadata", None)
+                    if usage:
+                        used = (used or 0) + usage.get("total_tokens", 0)
+                        for kind in usage_total:
+                            usage_total[kind] += usage.get(kind, 0)
+                    if chunk.content:
+                        output.append(chunk.content)
+                    yield chunk
+                if used is None:
+                    # No usage reported: reconcile with the prompt estimate and the answer's length
+                    used = prompt_tokens + len("".join(output)) // CHARS_PER_TOKEN
+                    usage_total = {"input_tokens": prompt_tokens, "output_tokens": used - prompt_tokens}
+                self._record_call("ok", usage_total["input_tokens"], usage_total["output_tokens"])
+                return
+            except Exception as e:
+                retry_after = _provider_retry_after(e)
+                self._record_call("error" if retry_after is None else "rate_limited")
+                if retry_after is None or output:
+                    raise
+                self._provider_limited(retry_after)
+                if attempt == LLM_MAX_RETRIES or time.monotonic() + retry_after > deadline:
+                    raise LLMRateLimited("The assistant is busy. Please try again shortly.", retry_after) from e
+            finally:
+                self._release(cost, used)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "model": LLM_MODEL,
+            "base_url": GROQ_BASE_URL,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "queued": {
+                name: sum(len(waiters) for waiters in self._queues[priority].values())
+                for priority, name in PRIORITY_NAMES.items()
+            },
+            "queue_limit": self.queue_limit,
+            "granted": self.granted,
+            "rejected_rate_limited": self.rejected_rate_limited,
+            "rejected_overloaded": self.rejected_overloaded,
+            "expired": self.expired,
+            "provider_rate_limits": self.provider_rate_limits,
+            "paused_for_seconds": round(max(0.0, self._paused_until - now), 1),
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "expected_output_tokens": LLM_EXPECTED_OUTPUT_TOKENS,
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_used,
+        }
+
+
+llm_scheduler = LLMScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_CONCURRENCY, LLM_QUEUE_LIMIT)
@@ -0,0 +1,318 @@
+"""
+Outbound email, sent in the background.
+
+Request handlers queue an email and return; MAIL_WORKERS dispatcher tasks send
+it. The queue is bounded (MAIL_QUEUE_SIZE). Emails built from the same
+template are batched into one provider call: Brevo sends one message version
+per recipient, each with its own params, so a burst of logins costs a few API
+calls instead of one each. Failed sends are retried with exponential backoff
+and jitter, up to MAIL_MAX_ATTEMPTS; errors the provider will not recover from
+(4xx other than 429) are not retried. Brevo rejects a whole batch for one bad
+recipient, so a rejected batch is sent again one email at a time and only the
+emails rejected on their own are given up. Addresses that do not look like
+email addresses are refused before they are queued.
+
+The sink is chosen by MAIL_SINK:
+
+    brevo    Brevo transactional API through one reusable client (default with BREVO_API_KEY)
+    console  log the rendered email (default without BREVO_API_KEY)
+    file     append rendered emails as JSON lines to MAIL_FILE_PATH, for tests
+
+Templates use Brevo's {{ params.name }} placeholders; console and file sinks
+fill them in locally.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from concurrency import run_blocking
+
+# MAIL CONFIG
+BREVO_API_KEY = os.getenv("BREVO_API_KEY")
+FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@fasarliai.com")
+FROM_NAME = os.getenv("FROM_NAME", "FasarliAI")
+MAIL_SINK = os.getenv("MAIL_SINK", "brevo" if BREVO_API_KEY else "console").lower()
+MAIL_FILE_PATH = Path(os.getenv("MAIL_FILE_PATH", str(Path(__file__).parent / "data" / "outbox.jsonl")))
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+# Concurrent provider calls
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+# Emails per provider call, and how long a dispatcher waits to fill a batch
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_BATCH_WAIT_SECONDS = float(os.getenv("MAIL_BATCH_WAIT_SECONDS", "0.05"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "1"))
+MAIL_RETRY_MAX_SECONDS = 60.0
+# How long shutdown waits for queued emails
+MAIL_DRAIN_SECONDS = 5.0
+
+_PARAM = re.compile(r"\{\{\s*params\.(\w+)\s*\}\}")
+# Loose on purpose: one @, no whitespace, a dot in the domain; the provider has the last word
+_ADDRESS = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+def valid_address(address: str) -> bool:
+    return isinstance(address, str) and len(address) <= 254 and _ADDRESS.fullmatch(address) is not None
+
+
+def render(template: str, params: Dict[str, Any]) -> str:
+    """Fill in {{ params.name }} placeholders the way Brevo does."""
+    return _PARAM.sub(lambda match: str(params.get(match.group(1), "")), template)
+
+
+class Email:
+    __slots__ = ("to", "subject", "html", "params", "attempts", "queued_at")
+
+    def __init__(self, to: str, subject: str, html: str, params: Optional[Dict[str, Any]] = None):
+        self.to = to
+        self.subject = subject
+        self.html = html
+        self.params = params or {}
+        self.attempts = 0
+        self.queued_at = time.time()
+
+    def rendered(self) -> Dict[str, Any]:
+        return {"to": self.to, "subject": self.subject, "html": render(self.html, self.params)}
+
+
+class PermanentMailError(Exception):
+    """The provider rejected the emails; sending them again will not help."""
+
+
+class ConsoleSink:
+    name = "console"
+
+    def send(self, emails: List[Email]) -> None:
+        for email in emails:
+            print(f"[MAIL] Email sink not configured. To {email.to}: {email.subject} {email.params}")
+
+
+class FileSink:
+    name = "file"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def send(self, emails: List[Email]) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as outbox:
+            for email in emails:
+                outbox.write(json.dumps({**email.rendered(), "params": email.params, "sent_at": time.time()}) + "\n")
+
+
+class BrevoSink:
+    name = "brevo"
+
+    def __init__(self, api_key: str, sender_email: str, sender_name: str):
+        import sib_api_v3_sdk
+
+        configuration = sib_api_v3_sdk.Configuration()
+        configuration.api_key["api-key"] = api_key
+        # One client, and so one connection pool, for the life of the process
+        self._api = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+        self._sender = {"email": sender_email, "name": sender_name}
+
+    def send(self, emails: List[Email]) -> None:
+        import sib_api_v3_sdk
+        from sib_api_v3_sdk.rest import ApiException
+
+        first = emails[0]
+        if len(emails) == 1:
+            message = sib_api_v3_sdk.SendSmtpEmail(
+                to=[{"email": first.to}], sender=self._sender, subject=first.subject,
+                html_content=first.html, params=first.params or None,
+            )
+        else:
+            # One message version per recipient; the dispatcher only batches emails sharing a template
+            message = sib_api_v3_sdk.SendSmtpEmail(
+                sender=self._sender, subject=first.subject, html_content=first.html,
+                message_versions=[
+                    sib_api_v3_sdk.SendSmtpEmailMessageVersions(
+                        to=[{"email": email.to}], subject=email.subject, params=email.params or None
+                    )
+                    for email in emails
+                ],
+            )
+        try:
+            self._api.send_transac_email(message)
+        except ApiException as e:
+            if e.status and 400 <= e.status < 500 and e.status != 429:
+                raise PermanentMailError(f"Brevo rejected the email: HTTP {e.status} {e.reason}") from e
+            raise
+
+
+def create_sink(name: str):
+    """Build the sink selected by MAIL_SINK."""
+    if name == "brevo":
+        if not BREVO_API_KEY:
+            raise ValueError("MAIL_SINK=brevo requires BREVO_API_KEY")
+        return BrevoSink(BREVO_API_KEY, FROM_EMAIL, FROM_NAME)
+    if name == "file":
+        return FileSink(MAIL_FILE_PATH)
+    if name == "console":
+        return ConsoleSink()
+    raise ValueError(f"Unknown MAIL_SINK: {name!r} (expected 'brevo', 'file' or 'console')")
+
+
+class Mailer:
+    """Bounded queue of outgoing emails drained by background dispatcher tasks."""
+
+    def __init__(self, sink, queue_size: int, workers: int, batch_size: int, max_attempts: int):
+        self.sink = sink
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Created in start() inside the running loop
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Retries waiting for their backoff to pass, by id of the email
+        self._retry_handles: Dict[int, asyncio.TimerHandle] = {}
+        self.sent = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        print(f"[MAIL] Dispatching email through the {self.sink.name} sink with {self.workers} workers")
+
+    async def stop(self, timeout: float = MAIL_DRAIN_SECONDS) -> None:
+        """Give queued emails a moment to go out, then stop the dispatchers."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[WARN] Stopping the mailer with {self._queue.qsize()} emails unsent")
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def send(self, to: str, subject: str, html: str, params: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue an email without waiting for it to be sent; False if the queue is full
+        or the address is not an email address.
+
+        Must be called from the event loop.
+        """
+        if not valid_address(to):
+            self.rejected += 1
+            print(f"[WARN] Not sending email to invalid address {to!r}: {subject}")
+            return False
+        if not self._tasks:
+            self.start()
+        try:
+            self._queue.put_nowait(Email(to, subject, html, params))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"[WARN] Mail queue full, dropping email to {to}: {subject}")
+            return False
+
+    async def _next_batch(self) -> List[Email]:
+        first = await self._queue.get()
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + MAIL_BATCH_WAIT_SECONDS
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                batch.append(self._queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(
+                    self._queue.get(), remaining
+                ))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _dispatch(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            # A provider call carries a single template
+            by_template: Dict[str, List[Email]] = {}
+            for email in batch:
+                by_template.setdefault(email.html, []).append(email)
+            try:
+                for emails in by_template.values():
+                    await self._send_batch(emails)
+            except Exception as e:
+                print(f"[ERROR] Mail dispatcher failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _send_batch(self, batch: List[Email], count_attempt: bool = True) -> None:
+        if count_attempt:
+            for email in batch:
+                email.attempts += 1
+        try:
+            # The Brevo SDK is synchronous, keep it off the event loop
+            await run_blocking(self.sink.send, batch)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            if isinstance(e, PermanentMailError) and len(batch) > 1:
+                # One bad recipient fails the whole call; send each email alone so only it is lost
+                print(f"[WARN] {self.sink.name} rejected a batch of {len(batch)} emails, sending them one by one")
+                for email in batch:
+                    await self._send_batch([email], count_attempt=False)
+                return
+            self._retry_later(batch, retryable=not isinstance(e, PermanentMailError))
+            return
+        self.sent += len(batch)
+        self.batches += 1
+        waited = time.time() - min(email.queued_at for email in batch)
+        print(f"[MAIL] Sent {len(batch)} email(s) through {self.sink.name} ({waited:.2f} s after queueing)")
+
+    def _retry_later(self, batch: List[Email], retryable: bool) -> None:
+        loop = asyncio.get_running_loop()
+        for email in batch:
+            if not retryable or email.attempts >= self.max_attempts:
+                self.failed += 1
+                print(f"[WARN] Giving up on email to {email.to} ({email.subject}) after "
+                      f"{email.attempts} attempt(s): {self.last_error}")
+                continue
+            self.retried += 1
+            delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (email.attempts - 1), MAIL_RETRY_MAX_SECONDS)
+            # Jitter keeps retries of one failed batch from hitting the provider together
+            delay *= random.uniform(0.5, 1.5)
+            self._retry_handles[id(email)] = loop.call_later(delay, self._requeue, email)
+
+    def _requeue(self, email: Email) -> None:
+        self._retry_handles.pop(id(email), None)
+        try:
+            self._queue.put_nowait(email)
+        except asyncio.QueueFull:
+            self.failed += 1
+            print(f"[WARN] Mail queue full, dropping retry of email to {email.to}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sink": self.sink.name,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "retrying": len(self._retry_handles),
+            "queue_size": self.queue_size,
+            "sent": self.sent,
+            "batches": self.batches,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+mailer = Mailer(create_sink(MAIL_SINK), MAIL_QUEUE_SIZE, MAIL_WORKERS, MAIL_BATCH_SIZE, MAIL_MAX_ATTEMPTS)
@@ -1,89 +1,106 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import os
 import tempfile
 from pathlib import Path
 from datetime import datetime
-from pypdf import PdfReader
 from dotenv import load_dotenv
 import uuid
 import shutil
 import re
-import sib_api_v3_sdk
-from sib_api_v3_sdk.rest import ApiException
+import asyncio
+import bisect
+import functools
+import hashlib
+import itertools
+import json
+import time
 
 # Load environment variables from backend directory
 env_path = Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=env_path, override=True)
 
+from answer_cache import answer_cache, history_key
+from chat_prompt import (
+    build_chat_prompt, prompt_history, turns_to_summarize, summary_prompt, fold_summary, capped,
+    CHAT_ANSWER_TOKENS, CHAT_SUMMARY_TOKENS,
+)
+from code_store import (
+    create_code_store, CODE_STORE_BACKEND, CODE_STORE_PATH, CODE_MAX_ACTIVE_PER_EMAIL, CODE_SWEEP_INTERVAL_SECONDS,
+    CODE_VALID, CODE_EXPIRED,
+)
+from concurrency import run_blocking, shutdown_blocking_pool
+from context_compression import retrieve_context, similarity_search, trim_passages
+from embeddings import embedding_registry, embedding_cache, EMBEDDING_WARMUP
+from image_cache import image_cache, image_id
+from image_client import image_client, ImageGenerationFailed, IMAGE_WIDTH, IMAGE_HEIGHT
+from ingest_jobs import ingest_queue, IngestError, IngestJob, IngestQueueFull
+from llm_scheduler import llm_scheduler, set_llm_caller, LLMUnavailable, PRIORITY_BACKGROUND
+from mailer import mailer
+from metrics import (
+    registry, render_metrics, timed, observe_stage, cache_samples, RequestTimer, sessions_created, documents_indexed, chunks_indexed,
+)
+from pdf_extract import extract_pdf_text, shutdown_pools
+from vector_index import shutdown_rebuilds
+from study_pack import study_packs, STUDY_PACK_PRECOMPUTE
+from titles import local_title, pdf_title, TITLE_MIN_CONFIDENCE, TITLE_SAMPLE_CHUNKS
+from session_store import (
+    create_session_store, VECTOR_STORE_DIR, VECTOR_STORE_PERSIST, VECTOR_STORE_MMAP,
+    SESSION_MEMORY_BUDGET_MB, SESSION_IDLE_TTL_SECONDS, SESSION_BACKEND, is_valid_session_id, reading, ChatHistory
+)
+
 app = FastAPI(title="PDF ChatBot API")
 
-# EMAIL CONFIG
-BREVO_API_KEY = os.getenv("BREVO_API_KEY")
-FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@fasarliai.com")
-FROM_NAME = os.getenv("FROM_NAME", "FasarliAI")
+# EMAIL CONFIG (sending itself is configured in mailer.py)
 MFA_DEBUG_MODE = os.getenv("MFA_DEBUG_MODE", "false").lower() == "true"
 
-async def send_mfa_email(recipient: str, code: str, subject: str = "Your Login Verification Code") -> bool:
-    """
-    Send MFA code via email using Brevo API. Falls back to console logging if not configured.
-    Returns True if email was sent successfully, False otherwise.
-    """
-    try:
-        # Check if Brevo is configured
-        if not BREVO_API_KEY:
-            print(f"[INFO] Brevo not configured. MFA code for {recipient}: {code}")
-            return False
-        
-        configuration = sib_api_v3_sdk.Configuration()
-        configuration.api_key['api-key'] = BREVO_API_KEY
-
-        api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
-
-        # Modern HTML email design matching FasarliAI branding
-        html_content = f"""
-        <div style='background:linear-gradient(135deg,#000000 0%,#40e0d0 100%);padding:40px 0;font-family:Segoe UI,Roboto,sans-serif;'>
-            <div style='max-width:420px;margin:0 auto;background:#fff;border-radius:18px;box-shadow:0 4px 24px #0001;padding:32px 28px 28px 28px;'>
-                <div style='text-align:center;margin-bottom:18px;'>
-                    <div style='width:48px;height:48px;margin:0 auto 8px auto;background:linear-gradient(135deg,#40e0d0 0%,#20b2aa 100%);border-radius:12px;display:flex;align-items:center;justify-content:center;box-shadow:0 4px 12px rgba(64,224,208,0.3);'>
-                        <svg width='32' height='32' viewBox='0 0 24 24' fill='none' xmlns='http://www.w3.org/2000/svg'>
-                            <path d='M12 2L2 7L12 12L22 7L12 2Z' fill='white'/>
-                            <path d='M2 17L12 22L22 17V12L12 17L2 12V17Z' fill='white'/>
-                        </svg>
-                    </div>
-                    <h2 style='color:#40e0d0;font-weight:700;margin:0 0 8px 0;font-size:1.5rem;'>FasarliAI</h2>
-                </div>
-                <h3 style='color:#000000;font-size:1.15rem;font-weight:600;margin-bottom:12px;text-align:center;'>Votre code de vérification</h3>
-                <div style='background:#f0f0f0;border-radius:10px;padding:18px 0;margin:0 auto 18px auto;text-align:center;font-size:2rem;letter-spacing:0.2em;color:#40e0d0;font-weight:700;width:220px;'>
-                    {code}
-                </div>
-                <p style='color:#000000;font-size:1rem;margin-bottom:10px;text-align:center;'>Ce code expire dans <b>3 minutes</b>.<br>Ne partagez jamais ce code avec qui que ce soit.</p>
-                
+# Modern HTML email design matching FasarliAI branding; {{ params.* }} are filled in per recipient
+CODE_EMAIL_TEMPLATE = """
+<div style='background:linear-gradient(135deg,#000000 0%,#40e0d0 100%);padding:40px 0;font-family:Segoe UI,Roboto,sans-serif;'>
+    <div style='max-width:420px;margin:0 auto;background:#fff;border-radius:18px;box-shadow:0 4px 24px #0001;padding:32px 28px 28px 28px;'>
+        <div style='text-align:center;margin-bottom:18px;'>
+            <div style='width:48px;height:48px;margin:0 auto 8px auto;background:linear-gradient(135deg,#40e0d0 0%,#20b2aa 100%);border-radius:12px;display:flex;align-items:center;justify-content:center;box-shadow:0 4px 12px rgba(64,224,208,0.3);'>
+                <svg width='32' height='32' viewBox='0 0 24 24' fill='none' xmlns='http://www.w3.org/2000/svg'>
+                    <path d='M12 2L2 7L12 12L22 7L12 2Z' fill='white'/>
+                    <path d='M2 17L12 22L22 17V12L12 17L2 12V17Z' fill='white'/>
+                </svg>
             </div>
-            <p style='text-align:center;color:#ffffff;font-size:0.95rem;margin-top:32px;'>© {datetime.now().year} FasarliAI. Tous droits réservés.</p>
+            <h2 style='color:#40e0d0;font-weight:700;margin:0 0 8px 0;font-size:1.5rem;'>FasarliAI</h2>
         </div>
-        """
-        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-            to=[{"email": recipient}],
-            sender={"email": FROM_EMAIL, "name": FROM_NAME},
-            subject=subject,
-            html_content=html_content
-        )
-
-        api_instance.send_transac_email(send_smtp_email)
-        print(f"[INFO] MFA email sent successfully to {recipient}")
-        return True
+        <h3 style='color:#000000;font-size:1.15rem;font-weight:600;margin-bottom:12px;text-align:center;'>Votre code de vérification</h3>
+        <div style='background:#f0f0f0;border-radius:10px;padding:18px 0;margin:0 auto 18px auto;text-align:center;font-size:2rem;letter-spacing:0.2em;color:#40e0d0;font-weight:700;width:220px;'>
+            {{ params.code }}
+        </div>
+        <p style='color:#000000;font-size:1rem;margin-bottom:10px;text-align:center;'>Ce code expire dans <b>3 minutes</b>.<br>Ne partagez jamais ce code avec qui que ce soit.</p>
         
-    except ApiException as e:
-        print(f"[WARN] Unable to send MFA email to {recipient}: {e}")
-        print(f"[DEBUG] MFA CODE for {recipient}: {code}")
-        return False
-    except Exception as exc:
-        print(f"[WARN] Unable to send MFA email to {recipient}: {exc}")
+    </div>
+    <p style='text-align:center;color:#ffffff;font-size:0.95rem;margin-top:32px;'>© {{ params.year }} FasarliAI. Tous droits réservés.</p>
+</div>
+"""
+
+def send_mfa_email(recipient: str, code: str, subject: str = "Your Login Verification Code") -> bool:
+    """
+    Queue an MFA code email; it is sent in the background by the mailer.
+    Returns False if the mail queue is full or the address is not an email address.
+    """
+    queued = mailer.send(recipient, subject, CODE_EMAIL_TEMPLATE, {"code": code, "year": datetime.now().year})
+    if not queued:
         print(f"[DEBUG] MFA CODE for {recipient}: {code}")
-        return False
+    return queued
+
+@app.on_event("startup")
+async def start_mailer():
+    """Start the background email dispatchers."""
+    mailer.start()
+
+@app.on_event("shutdown")
+async def stop_mailer():
+    """Let queued emails go out before the process exits."""
+    await mailer.stop()
 
 # CORS middleware - Allow all origins in production for Vercel dynamic URLs
 app.add_middleware(
@@ -94,15 +111,85 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for vector stores (in production, use a database)
-vector_stores: Dict[str, Any] = {}
-chat_histories: Dict[str, List[tuple]] = {}
+# Requests timed as a whole, by the pipeline they belong to
+PIPELINE_ROUTES = {
+    "/api/upload": "upload",
+    "/api/chat": "chat",
+    "/api/chat/stream": "chat_stream",
+    "/api/quiz": "quiz",
+    "/api/flashcards": "flashcards",
+    "/api/generate-conversation-name": "conversation_name",
+    "/api/study-pack": "study_pack",
+    "/api/generate-image": "image",
+}
+app.add_middleware(RequestTimer, routes=PIPELINE_ROUTES)
+
+@app.on_event("startup")
+async def warm_up_embeddings():
+    """Load the embedding models once so the first upload doesn't pay for it."""
+    if EMBEDDING_WARMUP:
+        # Model loading is blocking, keep it off the event loop
+        await asyncio.to_thread(embedding_registry.warm_up)
+
+@app.on_event("shutdown")
+def stop_workers():
+    """Stop the ingestion workers, PDF extraction processes, index rebuilds and blocking pool."""
+    ingest_queue.shutdown()
+    embedding_cache.flush()
+    shutdown_pools()
+    shutdown_rebuilds()
+    shutdown_blocking_pool()
+
+# Vector stores and chat histories are kept in memory within a budget and persisted per session on disk.
+# With SESSION_BACKEND=shared every worker (uvicorn --workers N or several containers) serves every session.
+vector_stores = create_session_store(
+    SESSION_BACKEND,
+    VECTOR_STORE_DIR,
+    persist=VECTOR_STORE_PERSIST,
+    use_mmap=VECTOR_STORE_MMAP,
+    memory_budget_bytes=SESSION_MEMORY_BUDGET_MB * 1024 * 1024,
+    idle_ttl=SESSION_IDLE_TTL_SECONDS,
+)
+chat_histories = vector_stores.histories
+if SESSION_BACKEND == "shared":
+    # Upload status polls may land on any worker
+    ingest_queue.share_status(VECTOR_STORE_DIR / ".jobs")
+
+async def evict_idle_sessions():
+    """Periodically move idle sessions out of memory."""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await run_blocking(vector_stores.evict_idle)
+        except Exception as e:
+            print(f"[WARN] Idle session eviction failed: {e}")
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    """Start the background task that evicts idle sessions."""
+    if SESSION_IDLE_TTL_SECONDS:
+        asyncio.create_task(evict_idle_sessions())
 
-# In-memory storage for MFA codes (keyed by email, works with Supabase auth)
-mfa_codes_db: Dict[str, List[Dict[str, Any]]] = {}
+# MFA and password reset codes (keyed by email, works with Supabase auth), see code_store.py
+auth_codes = create_code_store(CODE_STORE_BACKEND, CODE_STORE_PATH, CODE_MAX_ACTIVE_PER_EMAIL)
+MFA_CODE_TTL_SECONDS = 3 * 60
+RESET_CODE_TTL_SECONDS = 10 * 60
 
-# In-memory storage for password reset codes
-reset_codes_db: Dict[str, List[Dict[str, Any]]] = {}
+async def sweep_expired_codes():
+    """Periodically remove expired MFA and password reset codes."""
+    while True:
+        await asyncio.sleep(CODE_SWEEP_INTERVAL_SECONDS)
+        try:
+            removed = await run_blocking(auth_codes.sweep)
+            if removed:
+                print(f"[AUTH] Removed {removed} expired codes")
+        except Exception as e:
+            print(f"[WARN] Expired code sweep failed: {e}")
+
+@app.on_event("startup")
+async def start_code_sweeper():
+    """Start the background task that removes expired codes."""
+    asyncio.create_task(sweep_expired_codes())
 
 # Request/Response models
 class ChatRequest(BaseModel):
@@ -116,9 +203,11 @@ class ChatResponse(BaseModel):
     content: str
     sources: Optional[List[Dict[str, str]]] = None
     timestamp: str
+    cached: bool = False
 
 class QuizRequest(BaseModel):
     session_id: str
+    regenerate: bool = False
 
 class QuizQuestion(BaseModel):
     question: str
@@ -133,6 +222,7 @@ class QuizResponse(BaseModel):
 
 class FlashcardRequest(BaseModel):
     session_id: str
+    regenerate: bool = False
 
 class Flashcard(BaseModel):
     front: str
@@ -146,13 +236,49 @@ class GenerateImageRequest(BaseModel):
     session_id: str
 
 class GenerateImageResponse(BaseModel):
+    # Path of the image on this server (GET /api/images/{id})
     image_url: str
     prompt: str
     timestamp: str
+    cached: bool = False
 
-class UploadResponse(BaseModel):
+class UploadJobResponse(BaseModel):
+    job_id: str
     session_id: str
+    status: str
     message: str
+
+class UploadJobStatus(BaseModel):
+    job_id: str
+    session_id: str
+    filename: str
+    status: str
+    stage: str
+    progress: float
+    chunks_count: int
+    document_id: Optional[str] = None
+    message: Optional[str] = None
+    error: Optional[str] = None
+    error_status: Optional[int] = None
+
+class SessionStatusResponse(BaseModel):
+    session_id: str
+    chunks_count: int
+
+class SessionDocument(BaseModel):
+    document_id: Optional[str] = None
+    filename: Optional[str] = None
+    content_hash: Optional[str] = None
+    chunks_count: int
+
+class SessionDocumentsResponse(BaseModel):
+    session_id: str
+    documents: List[SessionDocument]
+
+class DeleteDocumentResponse(BaseModel):
+    session_id: str
+    document_id: str
+    removed_chunks: int
     chunks_count: int
 
 # User and MFA models
@@ -277,73 +403,319 @@ def parse_flashcards(flashcard_text: str) -> List[Dict]:
     
     return flashcards[:10]
 
-@app.post("/api/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
-    """Upload and process a PDF file. If session_id provided, add to existing vector store."""
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="File must be a PDF")
+def quiz_from_response(quiz_response: str) -> List[Dict]:
+    """Parse quiz questions from an LLM response, falling back to a regex; raises if fewer than 3."""
+    questions = parse_quiz(quiz_response)
     
-    # Use existing session ID or generate new one
-    if not session_id:
-        session_id = str(uuid.uuid4())
+    # If parsing failed or got too few questions, try a simpler approach
+    if len(questions) < 3:
+        # Fallback: Try to extract questions using regex
+        pattern = r'Q\d+:\s*(.+?)\nA\)\s*(.+?)\nB\)\s*(.+?)\nC\)\s*(.+?)\nD\)\s*(.+?)\nCorrect:\s*([A-D])'
+        matches = re.findall(pattern, quiz_response, re.DOTALL | re.IGNORECASE)
+        if matches:
+            questions = []
+            for i, match in enumerate(matches[:5], 1):
+                questions.append({
+                    'question': match[0].strip(),
+                    'a': match[1].strip(),
+                    'b': match[2].strip(),
+                    'c': match[3].strip(),
+                    'd': match[4].strip(),
+                    'correct': match[5].strip().upper()
+                })
+    
+    if not questions or len(questions) < 3:
+        raise ValueError(f"Failed to parse quiz. Got {len(questions) if questions else 0} questions. Response: {quiz_response[:200]}")
+    return questions
+
+def flashcards_from_response(response_text: str) -> List[Dict]:
+    """Parse flashcards from an LLM response, falling back to a regex; raises if fewer than 3."""
+    flashcards = parse_flashcards(response_text)
     
+    # If parsing failed or got too few cards, try a simpler approach
+    if len(flashcards) < 5:
+        # Fallback: Try to extract pairs from the response
+        # Look for Front: ... Back: ... patterns
+        pattern = r'Front:\s*(.+?)\s*Back:\s*(.+?)(?=Front:|$)'
+        matches = re.findall(pattern, response_text, re.DOTALL | re.IGNORECASE)
+        if matches:
+            flashcards = [{'front': f.strip(), 'back': b.strip()} for f, b in matches[:10]]
+    
+    if not flashcards or len(flashcards) < 3:
+        raise ValueError(f"Failed to parse flashcards. Got {len(flashcards) if flashcards else 0} cards. Response: {response_text[:200]}")
+    return flashcards
+
+def clean_title(name: str) -> str:
+    """Clean up a generated conversation name (remove quotes, extra spaces, etc.)."""
+    name = name.strip().strip('"').strip("'").strip()
+    if len(name) > 60:
+        name = name[:57] + "..."
+    return name
+
+def split_study_pack(response_text: str) -> Dict[str, str]:
+    """Split a batched study pack response into its TITLE, QUIZ and FLASHCARDS sections."""
+    sections = {}
+    markers = list(re.finditer(r'^\W*(TITLE|QUIZ|FLASHCARDS)\W*:?', response_text, re.MULTILINE | re.IGNORECASE))
+    for marker, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following is not None else len(response_text)
+        sections[marker.group(1).lower()] = response_text[marker.end():end].strip()
+    return sections
+
+# Chunks embedded per batch during ingestion (also the granularity of progress updates)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+def ingest_pdf(job: IngestJob, tmp_path: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+    """Extract, split, embed and index an uploaded PDF. Runs on an ingestion worker."""
+    session_id = job.session_id
+    # Every chunk of this PDF is tagged with its document id so it can be removed later
+    document_id = str(uuid.uuid4())
+    job.update(document_id=document_id)
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_path = tmp_file.name
-        
-        # Extract text from PDF
-        reader = PdfReader(tmp_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
+        # Identical PDFs get the same content hash, whichever session they are uploaded to
+        content_hash = hashlib.sha256()
+        with open(tmp_path, "rb") as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b""):
+                content_hash.update(block)
+        content_hash = content_hash.hexdigest()
         
+        # Extract text from PDF (page ranges are extracted in parallel for large files)
+        job.update(stage="extracting")
+        text, page_offsets = extract_pdf_text(
+            tmp_path,
+            on_page=lambda page_number, page_count: job.update(progress=0.4 * page_number / page_count),
+        )
+        # Title the PDF gives about itself (metadata, outline or first-page heading), for naming conversations
+        first_page_text = text[:page_offsets[1]] if len(page_offsets) > 1 else text
+        title = pdf_title(tmp_path, first_page_text)
+    finally:
         # Clean up temp file
         os.unlink(tmp_path)
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
-        
-        # Import ML libraries only when needed
-        from langchain_text_splitters import RecursiveCharacterTextSplitter
-        from langchain_community.embeddings import HuggingFaceEmbeddings
-        from langchain_community.vectorstores import FAISS
-        
-        # Split text into chunks with PDF name as metadata
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = splitter.split_text(text)
-        
-        # Create embeddings
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        
+    
+    if not text.strip():
+        raise IngestError("No text could be extracted from the PDF")
+    
+    # Import ML libraries only when needed
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_community.vectorstores import FAISS
+    
+    # Split text into chunks with PDF name and page number as metadata
+    job.update(stage="splitting", progress=0.4)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100, add_start_index=True)
+    documents = splitter.create_documents([text])
+    chunks = [doc.page_content for doc in documents]
+    metadatas = [
+        {
+            "source": job.filename,
+            "page": bisect.bisect_right(page_offsets, doc.metadata["start_index"]),
+            "document_id": document_id,
+            "content_hash": content_hash,
+        }
+        for doc in documents
+    ]
+    if title is not None:
+        for metadata in metadatas:
+            metadata["title"], metadata["title_source"] = title
+    ids = [f"{document_id}:{i}" for i in range(len(chunks))]
+    job.update(chunks_count=len(chunks))
+    
+    # Reuse the process-wide embedding model and only embed chunks not seen before
+    job.update(stage="embedding", progress=0.45)
+    embeddings = embedding_registry.get()
+    vectors = []
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        batch = chunks[start:start + EMBED_BATCH_SIZE]
+        vectors.extend(embedding_cache.embed_documents(embeddings, batch).tolist())
+        job.update(progress=0.45 + 0.45 * min(start + len(batch), len(chunks)) / len(chunks))
+    text_embeddings = list(zip(chunks, vectors))
+    
+    job.update(stage="indexing", progress=0.9)
+    with vector_stores.session_lock(session_id):
         # Check if vector store already exists for this session
         is_merging = session_id in vector_stores
         
         if is_merging:
-            # Add new PDF chunks to existing vector store
-            existing_vector_store = vector_stores[session_id]
-            new_vector_store = FAISS.from_texts(chunks, embedding=embeddings)
-            existing_vector_store.merge_from(new_vector_store)
-            total_chunks = len(chunks)
-            print(f"[MERGE] Added {total_chunks} chunks to existing session {session_id}")
+            # Append the new PDF's chunks in place; searches only wait while they are added
+            vector_stores.append(session_id, text_embeddings, metadatas, ids)
+            print(f"[MERGE] Added {len(chunks)} chunks to existing session {session_id}")
         else:
             # Create new FAISS vector store
-            vector_store = FAISS.from_texts(chunks, embedding=embeddings)
+            vector_store = FAISS.from_embeddings(text_embeddings, embedding=embeddings, metadatas=metadatas, ids=ids)
             vector_stores[session_id] = vector_store
-            chat_histories[session_id] = []
-            total_chunks = len(chunks)
-            print(f"[NEW] Created new session {session_id} with {total_chunks} chunks")
-        
-        return UploadResponse(
-            session_id=session_id,
-            message=f"PDF processed successfully. Combined with existing PDFs." if is_merging else "PDF processed successfully",
-            chunks_count=total_chunks
-        )
+            chat_histories[session_id] = ChatHistory()
+            print(f"[NEW] Created new session {session_id} with {len(chunks)} chunks")
+            sessions_created.inc()
+    documents_indexed.inc()
+    chunks_indexed.inc(len(chunks))
+    
+    # Large sessions move to an approximate index in the background
+    vector_stores.schedule_retier(session_id)
+    
+    # Title, quiz and flashcards are generated on the event loop once the PDF is searchable
+    if STUDY_PACK_PRECOMPUTE and loop is not None and os.getenv("GROQ_API_KEY"):
+        asyncio.run_coroutine_threadsafe(precompute_study_pack(session_id), loop)
+    
+    job.update(
+        message="PDF processed successfully. Combined with existing PDFs." if is_merging else "PDF processed successfully"
+    )
+
+@app.post("/api/upload", response_model=UploadJobResponse, status_code=202)
+async def upload_pdf(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+    """Queue a PDF for processing. If session_id provided, add to existing vector store."""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+    
+    # Use existing session ID or generate new one
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    elif not is_valid_session_id(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    
+    # Save uploaded file temporarily (the worker deletes it when done)
+    def save_upload() -> str:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+            shutil.copyfileobj(file.file, tmp_file)
+            return tmp_file.name
+    
+    try:
+        with timed("upload", "save"):
+            tmp_path = await asyncio.to_thread(save_upload)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        job = ingest_queue.submit(lambda job: ingest_pdf(job, tmp_path, loop), session_id, file.filename)
+    except IngestQueueFull:
+        os.unlink(tmp_path)
+        raise HTTPException(
+            status_code=503,
+            detail="Too many PDFs are being processed right now. Please try again shortly.",
+            headers={"Retry-After": "10"}
+        )
+    
+    return UploadJobResponse(
+        job_id=job.job_id,
+        session_id=session_id,
+        status=job.status,
+        message="PDF queued for processing"
+    )
+
+@app.get("/api/upload/{job_id}", response_model=UploadJobStatus)
+async def get_upload_status(job_id: str):
+    """Report the stage and progress of a queued PDF upload."""
+    job = ingest_queue.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return UploadJobStatus(**job)
+
+# Sessions whose history is being summarised
+summarizing_sessions: set = set()
+
+async def summarize_history(session_id: str, folded: List[tuple], summary: str):
+    """Fold the oldest turns of a session's history into its rolling summary."""
+    from langchain_core.messages import HumanMessage
+    
+    set_llm_caller(session_id, PRIORITY_BACKGROUND)
+    try:
+        response = await llm_scheduler.invoke(
+            [HumanMessage(content=summary_prompt(summary, folded))], temperature=0.2, max_tokens=CHAT_SUMMARY_TOKENS
+        )
+        new_summary = (response.content if hasattr(response, 'content') else str(response)).strip()
+        # Questions asked meanwhile are appended after the folded turns; anything else means start over
+        updated = await run_blocking(
+            chat_histories.update, session_id, lambda history: fold_summary(history, folded, new_summary)
+        )
+        if updated is None:
+            print(f"[CHAT] History of session {session_id} changed while summarising, summary discarded")
+            return
+        print(f"[CHAT] Folded {len(folded)} turns into the summary of session {session_id}")
+    except Exception as e:
+        # The turns stay in the history (capped) and are folded with the next batch
+        print(f"[WARN] Failed to summarise the history of session {session_id}: {e}")
+    finally:
+        summarizing_sessions.discard(session_id)
+
+async def save_turn(session_id: str, question: str, answer: str):
+    """Append a turn to a session's history, capped, and summarise older turns in the background."""
+    # Appended to the current history: a summary may have been folded in while the answer was generated
+    def append_turn(history: List[tuple]) -> List[tuple]:
+        return capped(ChatHistory([*history, (question, answer)], getattr(history, "summary", "")))
+    
+    # History reads and writes may load the session or write to disk, keep them off the event loop
+    chat_history = await run_blocking(chat_histories.update, session_id, append_turn)
+    if chat_history is None:
+        # The session was deleted meanwhile
+        return
+    folded = turns_to_summarize(chat_history)
+    if folded and session_id not in summarizing_sessions:
+        summarizing_sessions.add(session_id)
+        asyncio.create_task(summarize_history(session_id, folded, chat_history.summary))
+
+def format_sources(relevant_docs: List[Any]) -> List[Dict[str, str]]:
+    """Describe retrieved chunks as sources (one entry per PDF page)."""
+    sources = []
+    seen = set()
+    for doc in relevant_docs:
+        metadata = getattr(doc, 'metadata', {}) or {}
+        key = (metadata.get("source"), metadata.get("page"))
+        if key in seen or key[0] is None:
+            continue
+        seen.add(key)
+        title = f"{key[0]} - page {key[1]}" if key[1] else key[0]
+        sources.append({"title": title, "snippet": doc.page_content[:200]})
+    return sources
+
+def answer_scope(session_id: str, chat_history: List[tuple]) -> str:
+    """Answer cache scope of a question: the session's document set and the history sent with it."""
+    summary, turns = prompt_history(chat_history)
+    return f"{vector_stores.fingerprint(session_id)}:{history_key([(summary,)] + turns if summary else turns)}"
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+@app.get("/api/sessions/stats")
+async def session_stats():
+    """Report per-session memory usage and eviction counters."""
+    return vector_stores.stats()
 
+@app.get("/api/chat/cache")
+async def answer_cache_stats():
+    """Report hit rate and size of the semantic answer cache."""
+    return answer_cache.stats()
+
+@app.get("/api/sessions/{session_id}", response_model=SessionStatusResponse)
+async def get_session(session_id: str):
+    """Check whether a session's vector store is available, loading it from disk if needed."""
+    if session_id not in vector_stores:
+        raise HTTPException(status_code=404, detail="Session not found")
+    vector_store = await run_blocking(vector_stores.__getitem__, session_id)
+    return SessionStatusResponse(session_id=session_id, chunks_count=vector_store.index.ntotal)
+
+@app.get("/api/sessions/{session_id}/documents", response_model=SessionDocumentsResponse)
+async def list_session_documents(session_id: str):
+    """List the PDFs indexed in a session."""
+    if session_id not in vector_stores:
+        raise HTTPException(status_code=404, detail="Session not found")
+    documents = await run_blocking(vector_stores.documents, session_id)
+    return SessionDocumentsResponse(session_id=session_id, documents=documents)
+
+@app.delete("/api/sessions/{session_id}/documents/{document_id}", response_model=DeleteDocumentResponse)
+async def delete_session_document(session_id: str, document_id: str):
+    """Remove one PDF's chunks from a session without re-embedding the others."""
+    if session_id not in vector_stores:
+        raise HTTPException(status_code=404, detail="Session not found")
+    removed = await run_blocking(vector_stores.delete_document, session_id, document_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Document not found in this session")
+    remaining = vector_stores.get(session_id)
+    print(f"[DELETE] Removed document {document_id} ({removed} chunks) from session {session_id}")
+    return DeleteDocumentResponse(
+        session_id=session_id,
+        document_id=document_id,
+        removed_chunks=removed,
+        chunks_count=remaining.index.ntotal if remaining is not None else 0,
+    )
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -351,169 +723,386 @@ async def chat(request: ChatRequest):
     if request.session_id not in vector_stores:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
     
-    # Import ML libraries only when needed
-    from langchain_groq import ChatGroq
-    from langchain_classic.chains.retrieval_qa.base import RetrievalQA
-    
+    set_llm_caller(request.session_id)
     try:
-        vector_store = vector_stores[request.session_id]
-        chat_history = chat_histories.get(request.session_id, [])
+        vector_store = await run_blocking(vector_stores.__getitem__, request.session_id)
+        chat_history = await run_blocking(chat_histories.get, request.session_id, [])
         
         # Initialize LLM with Groq
         groq_api_key = os.getenv("GROQ_API_KEY")
         if not groq_api_key:
             raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
         
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant"
-        )
+        # The question vector is used for the answer cache and for retrieval
+        with timed("chat", "embed_query"):
+            question_vector = await run_blocking(vector_store.embedding_function.embed_query, request.question)
+        with timed("chat", "cache_lookup"):
+            scope = await run_blocking(answer_scope, request.session_id, chat_history)
+            cached = answer_cache.lookup(scope, question_vector)
         
-        # Use RAG to answer from all PDFs - increase k to search across multiple documents
-        retriever = vector_store.as_retriever(
-            search_kwargs={"k": 10}  # Increased to retrieve from multiple PDFs
-        )
-        
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=retriever,
-            chain_type="stuff",
-            return_source_documents=False
-        )
-        
-        history_text = "\n".join([f"Q: {q}\nA: {a}" for q, a in chat_history[-3:]])
-        instruction = (
-            "You are a helpful chatbot. Answer using the information found in the uploaded PDF documents. "
-            "Search across ALL available documents to provide a comprehensive answer. "
-            "Be clear, friendly, and helpful."
-        )
-        
-        if history_text:
-            final_question = f"{instruction}\n\nPrevious conversation:\n{history_text}\n\nCurrent question: {request.question}"
+        if cached is not None:
+            print(f"[CACHE] Reused answer for session {request.session_id} (similarity {cached['similarity']})")
+            answer, sources = cached["answer"], cached["sources"]
         else:
-            final_question = f"{instruction}\n\nQuestion: {request.question}"
-        
-        answer = qa_chain.run(final_question)
+            # Use RAG to answer from all PDFs - diverse chunks across documents, overlapping neighbours merged
+            with timed("chat", "retrieve"):
+                relevant_docs = await run_blocking(retrieve_context, vector_store, question_vector, k=10)
+            
+            # Sources only list the chunks that fitted in the prompt
+            with timed("chat", "prompt"):
+                messages, relevant_docs = build_chat_prompt(request.question, chat_history, relevant_docs)
+            with timed("chat", "llm"):
+                answer_obj = await llm_scheduler.invoke(messages, max_tokens=CHAT_ANSWER_TOKENS)
+            answer = answer_obj.content if hasattr(answer_obj, 'content') else str(answer_obj)
+            sources = format_sources(relevant_docs)
+            answer_cache.store(scope, request.question, question_vector, answer, sources)
         
         # Save to history
-        chat_history.append((request.question, answer))
-        chat_histories[request.session_id] = chat_history
+        await save_turn(request.session_id, request.question, answer)
         
         return ChatResponse(
             id=str(uuid.uuid4()),
             author="FasarliAI",
             content=answer,
-            sources=[],
-            timestamp=datetime.now().isoformat()
+            sources=sources,
+            timestamp=datetime.now().isoformat(),
+            cached=cached is not None
         )
+    except (HTTPException, LLMUnavailable):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get answer: {str(e)}")
 
-@app.post("/api/quiz", response_model=QuizResponse)
-async def generate_quiz(request: QuizRequest):
-    """Generate quiz questions from the PDF."""
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Handle chat questions, streaming sources and then answer tokens as server-sent events."""
     if request.session_id not in vector_stores:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
     
-    # Import ML libraries only when needed
-    from langchain_groq import ChatGroq
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
     
-    try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant",
-            temperature=0.5,  # Lower temperature for faster, more deterministic responses
-            max_tokens=1000  # Limit response length for faster generation
-        )
-        
-        # Optimize: Get fewer, more focused documents for faster processing
-        relevant_docs = vector_store.similarity_search("key concepts main ideas important information", k=2)
-        
-        # Aggressively limit context size for faster LLM processing
-        context_parts = []
-        total_length = 0
-        max_length = 1200  # Reduced to 1200 chars for much faster processing
-        
-        for doc in relevant_docs:
-            content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-            # Truncate each document to max 600 chars
-            truncated_content = content[:600] if len(content) > 600 else content
-            if total_length + len(truncated_content) > max_length:
-                remaining = max_length - total_length
-                if remaining > 50:
-                    context_parts.append(truncated_content[:remaining])
-                break
-            context_parts.append(truncated_content)
-            total_length += len(truncated_content)
-        
-        context = "\n\n".join(context_parts)
-        
-        # Optimize: Ultra-concise prompt for fastest generation
-        from langchain_core.messages import HumanMessage
-        
-        quiz_prompt = (
-            f"Create 5 multiple-choice questions. Format:\n"
-            f"Q1: [question]\n"
-            f"A) [option]\n"
-            f"B) [option]\n"
-            f"C) [option]\n"
-            f"D) [option]\n"
-            f"Correct: [A/B/C/D]\n\n"
-            f"{context}\n\n"
-            f"Output 5 questions in the format above."
-        )
-        
-        # Direct LLM call (faster than chain)
+    async def event_stream():
+        set_llm_caller(request.session_id)
         try:
-            messages = [HumanMessage(content=quiz_prompt)]
-            quiz_response_obj = llm.invoke(messages)
+            vector_store = await run_blocking(vector_stores.__getitem__, request.session_id)
+            chat_history = await run_blocking(chat_histories.get, request.session_id, [])
             
-            # Extract content from response
-            if hasattr(quiz_response_obj, 'content'):
-                quiz_response = quiz_response_obj.content
-            else:
-                quiz_response = str(quiz_response_obj)
+            with timed("chat_stream", "embed_query"):
+                question_vector = await run_blocking(vector_store.embedding_function.embed_query, request.question)
+            with timed("chat_stream", "cache_lookup"):
+                scope = await run_blocking(answer_scope, request.session_id, chat_history)
+                cached = answer_cache.lookup(scope, question_vector)
             
-            questions = parse_quiz(quiz_response)
+            if cached is not None:
+                print(f"[CACHE] Reused answer for session {request.session_id} (similarity {cached['similarity']})")
+                answer, sources = cached["answer"], cached["sources"]
+                yield sse_event("sources", sources)
+                yield sse_event("token", {"content": answer})
+            else:
+                with timed("chat_stream", "retrieve"):
+                    relevant_docs = await run_blocking(retrieve_context, vector_store, question_vector, k=10)
+                with timed("chat_stream", "prompt"):
+                    messages, relevant_docs = build_chat_prompt(request.question, chat_history, relevant_docs)
+                sources = format_sources(relevant_docs)
+                # Sources are known before generation starts, send them right away
+                yield sse_event("sources", sources)
+                
+                answer_parts = []
+                started = time.perf_counter()
+                async for chunk in llm_scheduler.stream(messages, max_tokens=CHAT_ANSWER_TOKENS):
+                    if chunk.content:
+                        if not answer_parts:
+                            observe_stage("chat_stream", "llm_first_token", time.perf_counter() - started)
+                        answer_parts.append(chunk.content)
+                        yield sse_event("token", {"content": chunk.content})
+                observe_stage("chat_stream", "llm", time.perf_counter() - started)
+                answer = "".join(answer_parts)
+                # Only complete answers are cached (a disconnect stops the generator before this point)
+                answer_cache.store(scope, request.question, question_vector, answer, sources)
             
-            # If parsing failed or got too few questions, try a simpler approach
-            if len(questions) < 3:
-                # Fallback: Try to extract questions using regex
-                pattern = r'Q\d+:\s*(.+?)\nA\)\s*(.+?)\nB\)\s*(.+?)\nC\)\s*(.+?)\nD\)\s*(.+?)\nCorrect:\s*([A-D])'
-                matches = re.findall(pattern, quiz_response, re.DOTALL | re.IGNORECASE)
-                if matches:
-                    questions = []
-                    for i, match in enumerate(matches[:5], 1):
-                        questions.append({
-                            'question': match[0].strip(),
-                            'a': match[1].strip(),
-                            'b': match[2].strip(),
-                            'c': match[3].strip(),
-                            'd': match[4].strip(),
-                            'correct': match[5].strip().upper()
-                        })
+            # Save to history once the full answer is known
+            await save_turn(request.session_id, request.question, answer)
             
-            if not questions or len(questions) < 3:
-                raise ValueError(f"Failed to parse quiz. Got {len(questions) if questions else 0} questions. Response: {quiz_response[:200]}")
-                
-        except Exception as parse_error:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to generate or parse quiz: {str(parse_error)}"
+            yield sse_event("done", jsonable_encoder(ChatResponse(
+                id=str(uuid.uuid4()),
+                author="FasarliAI",
+                content=answer,
+                sources=sources,
+                timestamp=datetime.now().isoformat(),
+                cached=cached is not None
+            )))
+        except LLMUnavailable as e:
+            yield sse_event("error", {"detail": str(e), "status": e.status_code, "retry_after": round(e.retry_after)})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Failed to get answer: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Context of quiz and flashcard prompts (about 1200 characters), at most 600 characters per passage
+GENERATION_CONTEXT_TOKENS = 300
+GENERATION_PASSAGE_TOKENS = 150
+STUDY_PACK_CONTEXT_TOKENS = 600
+
+async def key_passages(vector_store: Any, query: str, k: int, max_tokens: int = GENERATION_CONTEXT_TOKENS) -> str:
+    """Diverse passages on a query, trimmed to a token budget, as prompt context."""
+    query_vector = await run_blocking(vector_store.embedding_function.embed_query, query)
+    relevant_docs = await run_blocking(retrieve_context, vector_store, query_vector, k=k)
+    return "\n\n".join(trim_passages(relevant_docs, max_tokens, GENERATION_PASSAGE_TOKENS))
+
+async def quiz_questions(vector_store: Any) -> List[Dict]:
+    """Generate quiz questions from a session's key passages with one LLM call."""
+    if not os.getenv("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    # Small, diverse context for faster LLM processing
+    with timed("quiz", "retrieve"):
+        context = await key_passages(vector_store, "key concepts main ideas important information", k=3)
+    
+    # Optimize: Ultra-concise prompt for fastest generation
+    from langchain_core.messages import HumanMessage
+    
+    quiz_prompt = (
+        f"Create 5 multiple-choice questions. Format:\n"
+        f"Q1: [question]\n"
+        f"A) [option]\n"
+        f"B) [option]\n"
+        f"C) [option]\n"
+        f"D) [option]\n"
+        f"Correct: [A/B/C/D]\n\n"
+        f"{context}\n\n"
+        f"Output 5 questions in the format above."
+    )
+    
+    # Direct LLM call (faster than chain)
+    messages = [HumanMessage(content=quiz_prompt)]
+    # Lower temperature for more deterministic responses; limited response length for faster generation
+    with timed("quiz", "llm"):
+        quiz_response_obj = await llm_scheduler.invoke(messages, temperature=0.5, max_tokens=1000)
+    
+    # Extract content from response
+    if hasattr(quiz_response_obj, 'content'):
+        quiz_response = quiz_response_obj.content
+    else:
+        quiz_response = str(quiz_response_obj)
+    
+    with timed("quiz", "parse"):
+        return quiz_from_response(quiz_response)
+
+async def flashcard_list(vector_store: Any) -> List[Dict]:
+    """Generate flashcards from a session's key definitions with one LLM call."""
+    if not os.getenv("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    # Small, diverse context for faster LLM processing
+    with timed("flashcards", "retrieve"):
+        context = await key_passages(vector_store, "key concepts definitions main ideas", k=3)
+    
+    # Optimize: Ultra-concise prompt for fastest generation
+    from langchain_core.messages import HumanMessage
+    
+    flashcard_prompt = (
+        f"Create 10 flashcards. Format:\n"
+        f"Front: [concept]\n"
+        f"Back: [definition]\n\n"
+        f"{context}\n\n"
+        f"Output 10 flashcards in the format above."
+    )
+    
+    # Direct LLM call (faster than chain)
+    messages = [HumanMessage(content=flashcard_prompt)]
+    # Lower temperature for more deterministic responses; limited response length for faster generation
+    with timed("flashcards", "llm"):
+        flashcard_response = await llm_scheduler.invoke(messages, temperature=0.5, max_tokens=800)
+    
+    # Extract content from response
+    if hasattr(flashcard_response, 'content'):
+        response_text = flashcard_response.content
+    else:
+        response_text = str(flashcard_response)
+    
+    with timed("flashcards", "parse"):
+        return flashcards_from_response(response_text)
+
+async def conversation_title(vector_store: Any) -> str:
+    """Generate a short conversation title from a session's overview passages."""
+    if not os.getenv("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    # Get relevant content from PDF to understand what it's about
+    with timed("conversation_name", "retrieve"):
+        relevant_docs = await run_blocking(similarity_search, vector_store, "main topic subject title summary overview", k=3)
+    context = "\n\n".join([doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in relevant_docs])
+    
+    # Limit context size for faster processing
+    if len(context) > 1000:
+        context = context[:1000]
+    
+    prompt = f"""Based on the following PDF content, generate a short and clear conversation title (maximum 5-6 words). 
+The title should summarize what the PDF is about.
+
+PDF Content:
+{context}
+
+Generate only the title, nothing else. Make it concise and descriptive."""
+    
+    from langchain_core.messages import HumanMessage
+    messages = [HumanMessage(content=prompt)]
+    with timed("conversation_name", "llm"):
+        response_obj = await llm_scheduler.invoke(messages)
+    
+    name = response_obj.content if hasattr(response_obj, 'content') else str(response_obj)
+    return clean_title(name)
+
+async def batched_study_pack(vector_store: Any) -> Dict[str, Any]:
+    """Generate title, quiz and flashcards with one retrieval and one LLM call.
+
+    Artifacts whose section cannot be parsed are left out of the result.
+    """
+    # Import ML libraries only when needed
+    from langchain_core.messages import HumanMessage
+    
+    if not os.getenv("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    # One retrieval covering what the three separate prompts searched for
+    with timed("study_pack", "retrieve"):
+        context = await key_passages(
+            vector_store, "main topic overview key concepts definitions main ideas", k=4, max_tokens=STUDY_PACK_CONTEXT_TOKENS
+        )
+    
+    prompt = (
+        f"Create a study pack from the PDF content below, with exactly these three sections.\n\n"
+        f"TITLE: [short conversation title, maximum 5-6 words]\n\n"
+        f"QUIZ:\n"
+        f"Q1: [question]\n"
+        f"A) [option]\n"
+        f"B) [option]\n"
+        f"C) [option]\n"
+        f"D) [option]\n"
+        f"Correct: [A/B/C/D]\n"
+        f"(5 multiple-choice questions)\n\n"
+        f"FLASHCARDS:\n"
+        f"Front: [concept]\n"
+        f"Back: [definition]\n"
+        f"(10 flashcards)\n\n"
+        f"{context}\n\n"
+        f"Output the three sections in the format above."
+    )
+    # Quiz and flashcard budgets of the separate calls plus a title
+    with timed("study_pack", "llm"):
+        response_obj = await llm_scheduler.invoke([HumanMessage(content=prompt)], temperature=0.5, max_tokens=2000)
+    response_text = response_obj.content if hasattr(response_obj, 'content') else str(response_obj)
+    
+    sections = split_study_pack(response_text)
+    pack: Dict[str, Any] = {}
+    if sections.get("title"):
+        pack["title"] = clean_title(sections["title"].split("\n")[0])
+    for artifact, parse in (("quiz", quiz_from_response), ("flashcards", flashcards_from_response)):
+        try:
+            pack[artifact] = parse(sections.get(artifact, ""))
+        except ValueError as e:
+            print(f"[WARN] Study pack response had no usable {artifact}: {e}")
+    return pack
+
+# Study pack artifacts and the functions generating them
+STUDY_PACK_GENERATORS = {
+    "title": conversation_title,
+    "quiz": quiz_questions,
+    "flashcards": flashcard_list,
+}
+
+def local_session_title(session_id: str) -> Tuple[Optional[str], float]:
+    """Title worked out from a session's chunks without the LLM, and how confident it is."""
+    vector_store = vector_stores[session_id]
+    with reading(vector_store):
+        docstore_ids = itertools.islice(vector_store.index_to_docstore_id.values(), TITLE_SAMPLE_CHUNKS)
+        docs = [vector_store.docstore.search(docstore_id) for docstore_id in docstore_ids]
+    return local_title(docs)
+
+async def session_title(session_id: str, regenerate: bool = False, generated: Optional[str] = None) -> str:
+    """Conversation name: the local title when confident, otherwise the (cached) LLM title.
+
+    Asking to regenerate always goes to the LLM. generated is an LLM title already at hand.
+    """
+    with timed("conversation_name", "local_title"):
+        title, confidence = await run_blocking(local_session_title, session_id)
+    if title and not regenerate and (confidence >= TITLE_MIN_CONFIDENCE or not os.getenv("GROQ_API_KEY")):
+        return title
+    if generated:
+        return generated
+    try:
+        return await study_artifact(session_id, "title", regenerate)
+    except Exception as e:
+        if not title:
+            raise
+        print(f"[WARN] LLM title failed for session {session_id}, using local title: {e}")
+        return title
+
+async def study_artifact(session_id: str, artifact: str, regenerate: bool = False) -> Any:
+    """Serve a study pack artifact from the cache, generating it on a miss or when asked to."""
+    vector_store = await run_blocking(vector_stores.__getitem__, session_id)
+    key = await run_blocking(vector_stores.fingerprint, session_id)
+    generate = functools.partial(STUDY_PACK_GENERATORS[artifact], vector_store)
+    return await study_packs.get_or_generate(key, artifact, generate, regenerate=regenerate)
+
+async def complete_study_pack(session_id: str, regenerate: bool = False) -> Dict[str, Any]:
+    """Title, quiz and flashcards of a session: cached, or from one batched call.
+
+    Artifacts the batched call fails to produce are generated separately.
+    """
+    vector_store = await run_blocking(vector_stores.__getitem__, session_id)
+    key = await run_blocking(vector_stores.fingerprint, session_id)
+    pack = await study_packs.get_or_generate_pack(
+        key, functools.partial(batched_study_pack, vector_store), regenerate=regenerate
+    )
+    missing = [artifact for artifact in STUDY_PACK_GENERATORS if artifact not in pack]
+    if missing:
+        values = await asyncio.gather(*(
+            study_packs.get_or_generate(
+                key, artifact, functools.partial(STUDY_PACK_GENERATORS[artifact], vector_store), regenerate=regenerate
             )
-        
+            for artifact in missing
+        ))
+        pack.update(zip(missing, values))
+    return pack
+
+async def precompute_study_pack(session_id: str):
+    """Generate a session's title, quiz and flashcards in the background after an upload."""
+    # Users' own requests go first
+    set_llm_caller(session_id, PRIORITY_BACKGROUND)
+    try:
+        await complete_study_pack(session_id)
+    except KeyError:
+        # The session was deleted in the meantime
+        pass
+    except Exception as e:
+        print(f"[WARN] Could not precompute study pack for session {session_id}: {e}")
+
+@app.post("/api/quiz", response_model=QuizResponse)
+async def generate_quiz(request: QuizRequest):
+    """Generate quiz questions from the PDF (served from the study pack cache unless regenerate is set)."""
+    if request.session_id not in vector_stores:
+        raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
+    
+    set_llm_caller(request.session_id)
+    try:
+        questions = await study_artifact(request.session_id, "quiz", request.regenerate)
         return QuizResponse(questions=[QuizQuestion(**q) for q in questions])
+    except LLMUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate quiz: {str(e)}")
 
 class ConversationNameRequest(BaseModel):
     session_id: str
+    regenerate: bool = False
 
 class ConversationNameResponse(BaseModel):
     name: str
@@ -524,305 +1113,244 @@ async def generate_conversation_name(request: ConversationNameRequest):
     if request.session_id not in vector_stores:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session.")
     
-    # Import ML libraries only when needed
-    from langchain_groq import ChatGroq
-    
+    set_llm_caller(request.session_id)
     try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant"
-        )
-        
-        # Get relevant content from PDF to understand what it's about
-        relevant_docs = vector_store.similarity_search("main topic subject title summary overview", k=3)
-        context = "\n\n".join([doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in relevant_docs])
-        
-        # Limit context size for faster processing
-        if len(context) > 1000:
-            context = context[:1000]
-        
-        prompt = f"""Based on the following PDF content, generate a short and clear conversation title (maximum 5-6 words). 
-The title should summarize what the PDF is about.
-
-PDF Content:
-{context}
-
-Generate only the title, nothing else. Make it concise and descriptive."""
-        
-        from langchain_core.messages import HumanMessage
-        messages = [HumanMessage(content=prompt)]
-        response_obj = llm.invoke(messages)
-        
-        name = response_obj.content.strip() if hasattr(response_obj, 'content') else str(response_obj).strip()
-        
-        # Clean up the name (remove quotes, extra spaces, etc.)
-        name = name.strip('"').strip("'").strip()
-        if len(name) > 60:
-            name = name[:57] + "..."
-        
+        name = await session_title(request.session_id, request.regenerate)
         return ConversationNameResponse(name=name)
+    except LLMUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate conversation name: {str(e)}")
 
 @app.post("/api/flashcards", response_model=FlashcardResponse)
 async def generate_flashcards(request: FlashcardRequest):
-    """Generate flashcards from the PDF."""
+    """Generate flashcards from the PDF (served from the study pack cache unless regenerate is set)."""
     if request.session_id not in vector_stores:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
     
-    # Import ML libraries only when needed
-    from langchain_groq import ChatGroq
-    
+    set_llm_caller(request.session_id)
     try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant",
-            temperature=0.5,  # Lower temperature for faster, more deterministic responses
-            max_tokens=800  # Limit response length for faster generation
-        )
-        
-        # Optimize: Get fewer, more focused documents for faster processing
-        relevant_docs = vector_store.similarity_search("key concepts definitions main ideas", k=2)
-        
-        # Aggressively limit context size for faster LLM processing
-        context_parts = []
-        total_length = 0
-        max_length = 1200  # Reduced to 1200 chars for much faster processing
-        
-        for doc in relevant_docs:
-            content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-            # Truncate each document to max 600 chars
-            truncated_content = content[:600] if len(content) > 600 else content
-            if total_length + len(truncated_content) > max_length:
-                remaining = max_length - total_length
-                if remaining > 50:
-                    context_parts.append(truncated_content[:remaining])
-                break
-            context_parts.append(truncated_content)
-            total_length += len(truncated_content)
-        
-        context = "\n\n".join(context_parts)
-        
-        # Optimize: Ultra-concise prompt for fastest generation
-        from langchain_core.messages import HumanMessage
-        
-        flashcard_prompt = (
-            f"Create 10 flashcards. Format:\n"
-            f"Front: [concept]\n"
-            f"Back: [definition]\n\n"
-            f"{context}\n\n"
-            f"Output 10 flashcards in the format above."
-        )
-        
-        # Direct LLM call (faster than chain) with timeout handling
-        try:
-            messages = [HumanMessage(content=flashcard_prompt)]
-            flashcard_response = llm.invoke(messages)
-            
-            # Extract content from response
-            if hasattr(flashcard_response, 'content'):
-                response_text = flashcard_response.content
-            else:
-                response_text = str(flashcard_response)
-            
-            flashcards = parse_flashcards(response_text)
-            
-            # If parsing failed or got too few cards, try a simpler approach
-            if len(flashcards) < 5:
-                # Fallback: Try to extract pairs from the response
-                # Look for Front: ... Back: ... patterns
-                pattern = r'Front:\s*(.+?)\s*Back:\s*(.+?)(?=Front:|$)'
-                matches = re.findall(pattern, response_text, re.DOTALL | re.IGNORECASE)
-                if matches:
-                    flashcards = [{'front': f.strip(), 'back': b.strip()} for f, b in matches[:10]]
-            
-            if not flashcards or len(flashcards) < 3:
-                raise ValueError(f"Failed to parse flashcards. Got {len(flashcards) if flashcards else 0} cards. Response: {response_text[:200]}")
-                
-        except Exception as parse_error:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to generate or parse flashcards: {str(parse_error)}"
-            )
-        
+        flashcards = await study_artifact(request.session_id, "flashcards", request.regenerate)
         return FlashcardResponse(flashcards=[Flashcard(**fc) for fc in flashcards])
+    except LLMUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate flashcards: {str(e)}")
 
+class StudyPackRequest(BaseModel):
+    session_id: str
+    regenerate: bool = False
+
+class StudyPackResponse(BaseModel):
+    title: ConversationNameResponse
+    quiz: QuizResponse
+    flashcards: FlashcardResponse
+
+@app.post("/api/study-pack", response_model=StudyPackResponse)
+async def generate_study_pack(request: StudyPackRequest):
+    """Generate the conversation name, quiz and flashcards together with one retrieval and one LLM call."""
+    if request.session_id not in vector_stores:
+        raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
+    
+    set_llm_caller(request.session_id)
+    try:
+        pack = await complete_study_pack(request.session_id, request.regenerate)
+        return StudyPackResponse(
+            title=ConversationNameResponse(name=await session_title(request.session_id, generated=pack["title"])),
+            quiz=QuizResponse(questions=[QuizQuestion(**q) for q in pack["quiz"]]),
+            flashcards=FlashcardResponse(flashcards=[Flashcard(**fc) for fc in pack["flashcards"]]),
+        )
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate study pack: {str(e)}")
+
+@app.get("/api/study-pack/stats")
+async def study_pack_stats():
+    """Report hit rate and generation counters of the study pack cache."""
+    return study_packs.stats()
+
+@app.exception_handler(LLMUnavailable)
+async def llm_unavailable(request, exc: LLMUnavailable):
+    """Tell clients an LLM call was not admitted (429 rate limited, 503 overloaded) and when to retry."""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+@app.get("/api/llm/stats")
+async def llm_stats():
+    """Report LLM admission: queue depth per priority class, rejections and rate limit usage."""
+    return llm_scheduler.stats()
+
 @app.get("/api/health")
 async def health():
     """Health check endpoint."""
     return {"status": "ok"}
 
-# Image Generation Endpoint (FREE - Using Simple REST API)
-@app.post("/api/generate-image", response_model=GenerateImageResponse)
-async def generate_image(request: GenerateImageRequest):
-    """Generate an image based on a prompt using a simple REST API (FREE for testing)."""
+@app.get("/api/embeddings")
+async def embeddings_status():
+    """Report load time and memory usage of the shared embedding models and cache hit rates."""
+    return {**embedding_registry.stats(), "cache": embedding_cache.stats()}
+
+async def enhance_image_prompt(session_id: str, prompt: str) -> str:
+    """Rewrite an image prompt using the session's PDF context (one LLM call); the prompt itself on failure."""
+    if session_id not in vector_stores:
+        return prompt
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        return prompt
     try:
-        import requests
-        import base64
-        from io import BytesIO
-        
-        # Use context from PDF if available
-        enhanced_prompt = request.prompt
+        vector_store = await run_blocking(vector_stores.__getitem__, session_id)
+        # Get relevant context from PDF
+        relevant_docs = await run_blocking(similarity_search, vector_store, prompt, k=2)
+        context = "\n".join([doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in relevant_docs[:2]])
+        if not context:
+            return prompt
         
-        # If session has PDF content, try to enhance the prompt
-        if request.session_id in vector_stores:
-            try:
-                from langchain_groq import ChatGroq
-                
-                vector_store = vector_stores[request.session_id]
-                # Get relevant context from PDF
-                relevant_docs = vector_store.similarity_search(request.prompt, k=2)
-                context = "\n".join([doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in relevant_docs[:2]])
-                
-                if context:
-                    # Use LLM to create a better image prompt based on PDF context
-                    groq_api_key = os.getenv("GROQ_API_KEY")
-                    if groq_api_key:
-                        llm = ChatGroq(
-                            api_key=groq_api_key,
-                            model_name="llama-3.1-8b-instant",
-                            temperature=0.7
-                        )
-                        
-                        prompt_enhancement = f"""Based on this PDF content, create a detailed image generation prompt for: "{request.prompt}"
+        # Use LLM to create a better image prompt based on PDF context
+        prompt_enhancement = f"""Based on this PDF content, create a detailed image generation prompt for: "{prompt}"
 
 PDF Context:
 {context[:500]}
 
 Create a detailed, visual description suitable for image generation. Be specific about style, colors, and composition. Return only the prompt, nothing else."""
-                        
-                        enhanced_prompt = llm.invoke(prompt_enhancement).content if hasattr(llm.invoke(prompt_enhancement), 'content') else str(llm.invoke(prompt_enhancement))
-                        enhanced_prompt = enhanced_prompt.strip().strip('"').strip("'")
-            except Exception as e:
-                print(f"[WARN] Could not enhance prompt with PDF context: {e}")
-                # Use original prompt if enhancement fails
-                pass
-        
-        # Use a simple free image generation API
-        # Try multiple free APIs as fallback
-        import time
         
-        # Option 1: Use a simple placeholder service that generates images
-        # For now, let's use a very simple approach with a free service
-        try:
-            # Use Hugging Face Spaces API (free, no auth needed for public models)
-            # This is a direct approach that should work
-            hf_space_url = "https://huggingface.co/api/spaces"
-            
-            # Actually, let's use a simpler direct approach
-            # Use Pollinations API - completely free, no auth
-            api_url = "https://image.pollinations.ai/prompt/" + requests.utils.quote(enhanced_prompt)
-            
-            # Add parameters
-            params = {
-                'width': 512,
-                'height': 512,
-                'model': 'flux',
-                'nologo': 'true'
-            }
-            
-            response = requests.get(api_url, params=params, timeout=60, stream=True)
-            
-            if response.status_code == 200:
-                image_bytes = response.content
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"API error ({response.status_code}): Failed to generate image"
-                )
-        except requests.exceptions.Timeout:
-            raise HTTPException(status_code=504, detail="Image generation timed out. Please try again.")
-        except requests.exceptions.RequestException as req_error:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to connect to image generation service: {str(req_error)}"
-            )
-        
-        # Convert to base64 data URL for frontend
+        enhancement_obj = await llm_scheduler.invoke(prompt_enhancement, temperature=0.7)
+        enhanced_prompt = enhancement_obj.content if hasattr(enhancement_obj, 'content') else str(enhancement_obj)
+        return enhanced_prompt.strip().strip('"').strip("'") or prompt
+    except Exception as e:
+        # Use original prompt if enhancement fails
+        print(f"[WARN] Could not enhance prompt with PDF context: {e}")
+        return prompt
+
+# Image Generation Endpoint (free providers, see image_client.py)
+@app.post("/api/generate-image", response_model=GenerateImageResponse)
+async def generate_image(request: GenerateImageRequest):
+    """Generate an image for a prompt, enriched with the session's PDF context when available.
+
+    Returns the image's path on this server; repeated requests are served from the image cache.
+    """
+    set_llm_caller(request.session_id)
+    model = ",".join(provider.name for provider in image_client.providers)
+    # The same prompt over the same PDFs gets the same image, without enhancing it again
+    documents = ""
+    if request.session_id in vector_stores:
         try:
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            image_url = f"data:image/png;base64,{image_base64}"
-        except Exception as base64_error:
-            print(f"[ERROR] Error encoding image to base64: {base64_error}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error encoding image: {str(base64_error)}"
-            )
-        
+            documents = await run_blocking(vector_stores.fingerprint, request.session_id)
+        except KeyError:
+            pass
+    request_key = image_id(request.prompt, IMAGE_WIDTH, IMAGE_HEIGHT, f"{model}/{documents}")
+    with timed("image", "cache_lookup"):
+        cached = await run_blocking(image_cache.cached_request, request_key)
+    if cached is not None:
+        cached_id, enhanced_prompt = cached
         return GenerateImageResponse(
-            image_url=image_url,
+            image_url=f"/api/images/{cached_id}",
             prompt=enhanced_prompt,
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            cached=True
         )
-        
-    except ImportError as import_err:
-        import traceback
-        print(f"[ERROR] Import error: {import_err}")
-        print(f"[ERROR] Traceback: {traceback.format_exc()}")
-        raise HTTPException(
-            status_code=500, 
-            detail=f"Required library not installed: {str(import_err)}. Install with: pip install requests"
-        )
-    except HTTPException:
-        # Re-raise HTTPException as is (already properly formatted)
-        raise
-    except Exception as e:
-        import traceback
-        error_str = str(e) if e else "Unknown error"
-        error_traceback = traceback.format_exc()
-        
-        print(f"[ERROR] Image generation failed: {error_str}")
-        print(f"[ERROR] Full traceback:\n{error_traceback}")
-        
-        # Handle timeout errors
-        if "timeout" in error_str.lower() or "timed out" in error_str.lower():
+    
+    with timed("image", "enhance_prompt"):
+        enhanced_prompt = await enhance_image_prompt(request.session_id, request.prompt)
+    enhanced_id = image_id(enhanced_prompt, IMAGE_WIDTH, IMAGE_HEIGHT, model)
+    
+    try:
+        with timed("image", "generate"):
+            await image_cache.get_or_generate(
+                enhanced_id,
+                lambda image_file: image_client.generate(enhanced_prompt, image_file, IMAGE_WIDTH, IMAGE_HEIGHT),
+            )
+    except ImageGenerationFailed as e:
+        print(f"[ERROR] Image generation failed: {e}")
+        if e.timed_out:
             raise HTTPException(status_code=504, detail="Image generation timed out. Please try again.")
-        
-        # Provide detailed error message
-        if error_str:
-            error_detail = f"Failed to generate image: {error_str[:300]}"
-        else:
-            error_detail = "Failed to generate image: Unknown error occurred. Check backend logs for details."
-        
-        raise HTTPException(status_code=500, detail=error_detail)
+        raise HTTPException(status_code=502, detail=f"Failed to generate image: {str(e)[:300]}")
+    
+    image_cache.remember_request(request_key, enhanced_id, enhanced_prompt)
+    return GenerateImageResponse(
+        image_url=f"/api/images/{enhanced_id}",
+        prompt=enhanced_prompt,
+        timestamp=datetime.now().isoformat()
+    )
+
+registry.collect(
+    "cache_lookups_total", "counter", "Cache lookups by cache and result.",
+    lambda: cache_samples({
+        "answer": answer_cache, "embedding": embedding_cache, "image": image_cache, "study_pack": study_packs,
+    }),
+)
+registry.collect(
+    "resident_sessions", "gauge", "Sessions loaded in this process.",
+    lambda: [("", {}, vector_stores.resident_count())],
+)
+registry.collect(
+    "session_memory_bytes", "gauge", "Estimated memory held by resident sessions.",
+    lambda: [("", {}, vector_stores.memory_bytes())],
+)
+registry.collect(
+    "session_evictions_total", "counter", "Sessions evicted from memory, by reason.",
+    lambda: [("", {"reason": reason}, count) for reason, count in vector_stores.evictions.items()],
+)
+registry.collect(
+    "llm_queued", "gauge", "LLM calls waiting for admission.",
+    lambda: [("", {"priority": name}, count) for name, count in llm_scheduler.stats()["queued"].items()],
+)
+registry.collect(
+    "llm_rejected_total", "counter", "LLM calls rejected by the scheduler.",
+    lambda: [
+        ("", {"reason": "rate_limited"}, llm_scheduler.rejected_rate_limited),
+        ("", {"reason": "overloaded"}, llm_scheduler.rejected_overloaded),
+        ("", {"reason": "expired"}, llm_scheduler.expired),
+    ],
+)
+
+@app.get("/api/metrics")
+async def metrics():
+    """Expose pipeline latencies and counters in Prometheus text format."""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/mail/stats")
+async def mail_stats():
+    """Report the outgoing email queue and delivery outcomes."""
+    return mailer.stats()
+
+@app.get("/api/images/stats")
+async def image_stats():
+    """Report per-provider outcomes of image generation and image cache usage."""
+    return {**image_client.stats(), "cache": image_cache.stats()}
+
+@app.get("/api/images/{image_id}")
+async def get_image(image_id: str, if_none_match: Optional[str] = Header(default=None)):
+    """Serve a generated image (supports ETag revalidation and range requests)."""
+    path = await run_blocking(image_cache.path, image_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # An id always names the same bytes, so the id is a strong ETag and the image never goes stale
+    headers = {"ETag": f'"{image_id}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match and (if_none_match.strip() == "*" or f'"{image_id}"' in if_none_match):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=image_cache.content_type(path), headers=headers)
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close the pooled image provider connections."""
+    await image_client.aclose()
 
 # Password Reset Endpoints
 @app.post("/api/users/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest):
     """Send password reset code to user's email"""
     import random
-    from datetime import timedelta
     
-    # Generate 6-digit reset code
+    # Generate 6-digit reset code, valid for 10 minutes
     code = str(random.randint(100000, 999999))
-    expires_at = datetime.utcnow() + timedelta(minutes=10)  # 10 minutes for password reset
-    
-    # Store reset code
-    if request.email not in reset_codes_db:
-        reset_codes_db[request.email] = []
+    await run_blocking(auth_codes.issue, "reset", request.email, code, RESET_CODE_TTL_SECONDS)
     
-    reset_codes_db[request.email].append({
-        'code': code,
-        'expires_at': expires_at,
-        'is_used': False
-    })
-    
-    # Send code by email
-    await send_mfa_email(
+    # Queue the code email; the response doesn't wait for it to be sent
+    send_mfa_email(
         request.email, 
         code, 
         "Password Reset Code"
@@ -836,22 +1364,11 @@ async def forgot_password(request: ForgotPasswordRequest):
 @app.post("/api/users/verify-reset-code")
 def verify_reset_code(request: VerifyResetCodeRequest):
     """Verify password reset code"""
-    user_codes = reset_codes_db.get(request.email, [])
-    
-    # Find valid code
-    valid_code = None
-    for reset in user_codes:
-        if (reset['code'] == request.code and 
-            not reset['is_used'] and 
-            datetime.utcnow() <= reset['expires_at']):
-            valid_code = reset
-            break
-    
-    if not valid_code:
-        expired = any(reset['code'] == request.code and datetime.utcnow() > reset['expires_at'] 
-                     for reset in user_codes)
-        if expired:
-            raise HTTPException(status_code=400, detail="Reset code expired")
+    # The code stays valid for the reset itself
+    status = auth_codes.check("reset", request.email, request.code)
+    if status == CODE_EXPIRED:
+        raise HTTPException(status_code=400, detail="Reset code expired")
+    if status != CODE_VALID:
         raise HTTPException(status_code=400, detail="Invalid reset code")
     
     return {
@@ -862,25 +1379,13 @@ def verify_reset_code(request: VerifyResetCodeRequest):
 @app.post("/api/users/reset-password")
 async def reset_password(request: ResetPasswordRequest):
     """Reset password with verified code and update in Supabase"""
-    user_codes = reset_codes_db.get(request.email, [])
-    
-    # Find valid code
-    valid_code = None
-    for reset in user_codes:
-        if (reset['code'] == request.code and 
-            not reset['is_used'] and 
-            datetime.utcnow() <= reset['expires_at']):
-            valid_code = reset
-            break
-    
-    if not valid_code:
+    # Consuming the code removes it, so it cannot be used twice
+    status = await run_blocking(auth_codes.check, "reset", request.email, request.code, consume=True)
+    if status != CODE_VALID:
         raise HTTPException(status_code=400, detail="Invalid or expired reset code")
     
-    # Mark code as used
-    valid_code['is_used'] = True
-    
-    # Send confirmation email
-    await send_mfa_email(
+    # Queue confirmation email
+    send_mfa_email(
         request.email,
         f"Your password has been successfully reset. If you didn't make this change, please contact support immediately.",
         "Password Reset Confirmation"
@@ -906,27 +1411,16 @@ def change_password(request: ChangePasswordRequest):
 async def login_user(login: LoginRequest):
     """Verify user exists in Supabase and send MFA code via email"""
     import random
-    from datetime import timedelta
     
     # Note: User authentication is handled by Supabase on frontend
     # This endpoint only generates and sends MFA code
     
-    # Generate 6-digit MFA code
+    # Generate 6-digit MFA code, valid for 3 minutes
     code = str(random.randint(100000, 999999))
-    expires_at = datetime.utcnow() + timedelta(minutes=3)
-    
-    # Store MFA code temporarily (keyed by email)
-    if login.email not in mfa_codes_db:
-        mfa_codes_db[login.email] = []
+    await run_blocking(auth_codes.issue, "mfa", login.email, code, MFA_CODE_TTL_SECONDS)
     
-    mfa_codes_db[login.email].append({
-        'code': code,
-        'expires_at': expires_at,
-        'is_used': False
-    })
-    
-    # Send code by email
-    await send_mfa_email(login.email, code, "Your Login Verification Code")
+    # Queue the code email; the response doesn't wait for it to be sent
+    send_mfa_email(login.email, code, "Your Login Verification Code")
     
     return {
         "message": "MFA code sent to your email",
@@ -940,29 +1434,13 @@ class MFAVerifyRequest(BaseModel):
 @app.post("/api/users/verify-code")
 def verify_user_code(verify_request: MFAVerifyRequest):
     """Verify MFA code for user login"""
-    # Get user's MFA codes (keyed by email)
-    user_codes = mfa_codes_db.get(verify_request.email, [])
-    
-    # Find valid code
-    valid_code = None
-    for mfa in user_codes:
-        if (mfa['code'] == verify_request.code and 
-            not mfa['is_used'] and 
-            datetime.utcnow() <= mfa['expires_at']):
-            valid_code = mfa
-            break
-    
-    if not valid_code:
-        # Check if code exists but expired
-        expired = any(mfa['code'] == verify_request.code and datetime.utcnow() > mfa['expires_at'] 
-                     for mfa in user_codes)
-        if expired:
-            raise HTTPException(status_code=400, detail="Code expired")
+    # A valid code is consumed by the check
+    status = auth_codes.check("mfa", verify_request.email, verify_request.code, consume=True)
+    if status == CODE_EXPIRED:
+        raise HTTPException(status_code=400, detail="Code expired")
+    if status != CODE_VALID:
         raise HTTPException(status_code=400, detail="Invalid code")
     
-    # Mark code as used
-    valid_code['is_used'] = True
-    
     return {
         "message": "MFA verification successful",
         "email": verify_request.email
@@ -0,0 +1,226 @@
+"""
+Request pipeline metrics in Prometheus text format.
+
+Every stage of the upload, chat, quiz, flashcard, conversation naming, study
+pack and image pipelines is timed into one histogram,
+fasarliai_stage_seconds{pipeline, stage}. The whole HTTP request is the stage
+"request", a whole PDF ingestion the stage "total". Counters record sessions,
+documents, chunks and LLM tokens. Figures other modules already count (cache
+hits, resident sessions) are read from them when /api/metrics is scraped, so
+they cost nothing per request.
+
+Recording is a bucket lookup and three additions under a lock, cheap enough for
+every request. The registry is per process: with several workers, each serves
+its own figures (scrape them all, or aggregate by instance).
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# METRICS CONFIG
+# Stage latency buckets in seconds, from a cache lookup to a long PDF upload
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRIC_PREFIX = "fasarliai_"
+
+# (name, labels, value) of a sample produced by a collector
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process plus collectors reading figures kept elsewhere."""
+
+    def __init__(self):
+        self._metrics: List[object] = []
+        # (name, type, description, callback returning samples)
+        self._collectors: List[Tuple[str, str, str, Callable[[], List[Sample]]]] = []
+
+    def counter(self, name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, description, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        metric = Histogram(name, description, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, name: str, kind: str, description: str, callback: Callable[[], List[Sample]]) -> None:
+        """Add a metric whose samples are read when the metrics are scraped."""
+        self._collectors.append((METRIC_PREFIX + name, kind, description, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, kind, description, callback in self._collectors:
+            try:
+                samples = callback()
+            except Exception as e:
+                print(f"[WARN] Metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                if value is None:
+                    continue
+                label_text = _labels(list(labels), list(labels.values()))
+                lines.append(f"{name}{suffix}{label_text} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "stage_seconds", "Time spent in each stage of a request pipeline.", ("pipeline", "stage")
+)
+sessions_created = registry.counter("sessions_created_total", "Sessions created by a first PDF upload.")
+documents_indexed = registry.counter("documents_indexed_total", "PDFs indexed into a session.")
+chunks_indexed = registry.counter("chunks_indexed_total", "Chunks embedded and indexed.")
+llm_tokens = registry.counter(
+    "llm_tokens_total", "LLM tokens used, as reported by the provider or estimated.", ("kind", "priority")
+)
+llm_calls = registry.counter("llm_calls_total", "LLM calls by outcome.", ("outcome", "priority"))
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, pipeline=pipeline, stage=stage)
+
+
+@contextmanager
+def timed(pipeline: str, stage: str) -> Iterator[None]:
+    """Time the enclosed block (awaits included) as one stage of a pipeline."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, pipeline=pipeline, stage=stage)
+
+
+class RequestTimer:
+    """ASGI middleware timing whole requests to the given paths as the "request" stage of their pipeline.
+
+    A streamed response is timed until its last body chunk is sent.
+    """
+
+    def __init__(self, app, routes: Dict[str, str]):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        pipeline = self.routes.get(scope.get("path")) if scope["type"] == "http" else None
+        if pipeline is None:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        done = False
+
+        async def timed_send(message):
+            nonlocal done
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not done:
+                done = True
+                stage_seconds.observe(time.perf_counter() - start, pipeline=pipeline, stage="request")
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not done:
+                # Client gone or the app failed before finishing the response
+                stage_seconds.observe(time.perf_counter() - start, pipeline=pipeline, stage="request_aborted")
+
+
+def cache_samples(caches: Dict[str, object]) -> List[Sample]:
+    """Hit and miss counts of caches that count them as hits and misses attributes."""
+    samples: List[Sample] = []
+    for name, cache in caches.items():
+        samples.append(("", {"cache": name, "result": "hit"}, getattr(cache, "hits", None)))
+        samples.append(("", {"cache": name, "result": "miss"}, getattr(cache, "misses", None)))
+    return samples
+
+
+def render_metrics() -> str:
+    return registry.render()
+
@@ -0,0 +1,240 @@
+"""
+Parallel, page-streaming PDF text extraction.
+
+Large PDFs are split into page ranges that are extracted in a shared process
+pool and yielded back in page order as soon as each range is ready. Every page
+gets a time limit, enforced with SIGALRM inside the worker, so a single
+malformed page cannot stall an upload. A worker that still hangs past its
+range's limit is killed and the pool replaced; ranges lost with a crashed or
+recycled pool are extracted once more in the new one.
+
+Small PDFs are extracted in the calling thread, where starting or queueing for
+a worker would cost more than the extraction. SIGALRM is not available there,
+so their pages run without the per-page limit.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# PDF EXTRACTION CONFIG
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "10"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Below this many pages starting worker processes costs more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# How often a range waiting behind other uploads is checked for having started
+_QUEUED_POLL_SECONDS = 0.5
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+class PageTimeout(Exception):
+    pass
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+
+def _can_use_alarm() -> bool:
+    # Timers are delivered to the main thread only, and not at all on Windows
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+def _extract_range(path: str, start: int, end: int, page_timeout: float) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) of a PDF. Returns (1-based page number, text) pairs."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    use_alarm = page_timeout > 0 and _can_use_alarm()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    pages = []
+    try:
+        for index in range(start, end):
+            try:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+                text = reader.pages[index].extract_text() or ""
+            except PageTimeout:
+                print(f"[WARN] Page {index + 1} of {os.path.basename(path)} timed out after {page_timeout}s, skipping")
+                text = ""
+            except Exception as e:
+                print(f"[WARN] Could not extract page {index + 1} of {os.path.basename(path)}: {e}")
+                text = ""
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            pages.append((index + 1, text))
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+    return pages
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # Spawn rather than fork: the parent holds torch and tokenizer threads
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+        return pool
+
+
+def _kill_workers(pool: ProcessPoolExecutor) -> bool:
+    """Kill a pool's worker processes; False if this Python gives no way to reach them."""
+    kill_workers = getattr(pool, "kill_workers", None)
+    if kill_workers is not None:
+        # Python 3.14+
+        kill_workers()
+        return True
+    # Older versions only keep the processes in a private attribute, which may change or go away
+    processes = getattr(pool, "_processes", ())
+    if processes is None:
+        # Broken or shut down already: its workers are gone
+        return True
+    if not isinstance(processes, dict):
+        return False
+    for process in list(processes.values()):
+        process.kill()
+    return True
+
+
+def _recycle_pool(workers: int, pool: ProcessPoolExecutor) -> None:
+    """Kill a pool's worker processes; the next submission starts a new pool."""
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    if _kill_workers(pool):
+        pool.shutdown(wait=False)
+    else:
+        # Queued ranges are cancelled and run again in the new pool; a hung worker exits once its page does
+        print("[WARN] Cannot kill PDF extraction workers on this Python version, shutting the pool down instead")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(workers: int, path: str, start: int, end: int,
+            page_timeout: float) -> Tuple[ProcessPoolExecutor, Future]:
+    pool = _get_pool(workers)
+    try:
+        return pool, pool.submit(_extract_range, path, start, end, page_timeout)
+    except (BrokenProcessPool, RuntimeError):
+        # Another upload broke or recycled the pool between _get_pool and submit
+        _recycle_pool(workers, pool)
+        pool = _get_pool(workers)
+        return pool, pool.submit(_extract_range, path, start, end, page_timeout)
+
+
+def _range_result(future: Future, limit: Optional[float]) -> List[Tuple[int, str]]:
+    """Wait for a range; FutureTimeoutError once it has been running for longer than limit."""
+    if limit is None:
+        return future.result()
+    deadline = None
+    while True:
+        if deadline is None and future.running():
+            # Only time spent in a worker counts, not time queued behind other uploads
+            deadline = time.monotonic() + limit
+        timeout = _QUEUED_POLL_SECONDS if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+
+
+def shutdown_pools() -> None:
+    """Stop all extraction worker processes."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False)
+
+
+def count_pages(path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def iter_pdf_pages(path: str, workers: int = None, page_timeout: float = None,
+                   page_count: int = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) for every page of a PDF, in page order."""
+    workers = workers or PDF_EXTRACT_WORKERS
+    page_timeout = PDF_PAGE_TIMEOUT if page_timeout is None else page_timeout
+    if page_count is None:
+        page_count = count_pages(path)
+
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        yield from _extract_range(path, 0, page_count, page_timeout)
+        return
+
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    tasks = [_submit(workers, path, start, end, page_timeout) for start, end in ranges]
+
+    def resubmit(first: int) -> None:
+        # Ranges from `first` on that did not finish in a dead pool run again in its replacement
+        for number in range(first, len(ranges)):
+            future = tasks[number][1]
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                tasks[number] = _submit(workers, path, *ranges[number], page_timeout)
+
+    retried = set()
+    try:
+        for number, (start, end) in enumerate(ranges):
+            while True:
+                pool, future = tasks[number]
+                try:
+                    # Workers enforce the per-page limit themselves; this only catches hung workers
+                    pages = _range_result(future, page_timeout * (end - start) + 5 if page_timeout > 0 else None)
+                except FutureTimeoutError:
+                    print(f"[WARN] Pages {start + 1}-{end} of {os.path.basename(path)} timed out, "
+                          f"skipping them and replacing the hung worker")
+                    _recycle_pool(workers, pool)
+                    resubmit(number + 1)
+                    pages = [(index + 1, "") for index in range(start, end)]
+                except (BrokenProcessPool, CancelledError):
+                    # A worker died (e.g. out of memory) or another upload recycled the pool
+                    _recycle_pool(workers, pool)
+                    if number in retried:
+                        print(f"[WARN] PDF extraction pool crashed twice on pages {start + 1}-{end} "
+                              f"of {os.path.basename(path)}, skipping them")
+                        resubmit(number + 1)
+                        pages = [(index + 1, "") for index in range(start, end)]
+                    else:
+                        print(f"[WARN] PDF extraction pool crashed, extracting pages {start + 1}-{end} again")
+                        retried.add(number)
+                        resubmit(number)
+                        continue
+                break
+            yield from pages
+    finally:
+        for _, future in tasks:
+            future.cancel()
+
+
+def extract_pdf_text(path: str, workers: int = None, page_timeout: float = None,
+                     on_page: Optional[Callable[[int, int], None]] = None) -> Tuple[str, List[int]]:
+    """
+    Extract the full text of a PDF.
+    Returns the text and the character offset at which each page starts.
+    on_page(page_number, page_count) is called as each page arrives.
+    """
+    page_count = count_pages(path)
+    parts = []
+    page_offsets = []
+    offset = 0
+    for page_number, text in iter_pdf_pages(path, workers=workers, page_timeout=page_timeout, page_count=page_count):
+        page_offsets.append(offset)
+        parts.append(text)
+        offset += len(text)
+        if on_page is not None:
+            on_page(page_number, page_count)
+    return "".join(parts), page_offsets
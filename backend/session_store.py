@@ -0,0 +1,919 @@
+"""
+Per-session FAISS vector stores persisted to local disk.
+
+Each session is saved under VECTOR_STORE_DIR/<session_id>/ in the same layout as
+LangChain's FAISS.save_local (index.faiss + index.pkl) plus a small meta.json
+and the session's chat history. Sessions are loaded lazily on first access,
+memory-mapping the FAISS index where possible, so a restarted process can resume
+a conversation without re-embedding. With VECTOR_STORE_MMAP the chunk texts are
+also written to chunks.bin and read through a memory map (chunk_store.py).
+
+Resident sessions are bounded by a memory budget and an idle TTL. The least
+recently used sessions are evicted first: with persistence on they stay on disk
+and are reloaded transparently on the next request, otherwise they are dropped.
+
+Uploads append their chunks to the published store in place (append()):
+searches take the session's read/write lock for reading (reading()) and only
+wait while vectors and documents are added, not while the session is written.
+Document removal and index rebuilds change a private copy of the session
+(writable()) and save() swaps it in, so searches running meanwhile keep reading
+the previous index and docstore.
+
+With SESSION_BACKEND=shared several worker processes (uvicorn --workers N, or
+containers mounting the same volume) serve sessions from one directory: writes
+take a per-session file lock and bump a version stamp, and every worker checks
+the stamp before using its resident copy. SESSION_BACKEND=local keeps sessions
+private to one process, which is what tests and single-worker setups use.
+"""
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the local backend is available
+    fcntl = None
+
+from chunk_store import CHUNKS_FILE, DOCUMENT_OVERHEAD_BYTES, MappedDocstore
+from embeddings import embedding_registry, DEFAULT_EMBEDDING_MODEL
+from vector_index import (
+    VECTOR_COMPRESSION, bytes_per_vector, configure_search, desired_compression, index_compression,
+    index_tier, rebuild_index, schedule_rebuild, supports_removal, target_layout, vector_bytes
+)
+
+# VECTOR STORE CONFIG
+VECTOR_STORE_DIR = Path(os.getenv("VECTOR_STORE_DIR", str(Path(__file__).parent / "data" / "vector_stores")))
+VECTOR_STORE_PERSIST = os.getenv("VECTOR_STORE_PERSIST", "true").lower() == "true"
+VECTOR_STORE_MMAP = os.getenv("VECTOR_STORE_MMAP", "true").lower() == "true"
+# Memory budget for resident sessions (indexes, docstores and chat histories)
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "1024"))
+# Sessions idle for longer than this are evicted from memory (0 disables)
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+# "local" (sessions private to one process) or "shared" (several workers share VECTOR_STORE_DIR)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "local").lower()
+
+# Session ids end up in file paths, so only allow uuid-like values
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def is_valid_session_id(session_id: str) -> bool:
+    return bool(session_id) and bool(SESSION_ID_PATTERN.match(session_id))
+
+
+def copy_store(store: Any, **attributes: Any) -> Any:
+    """Shallow copy of a FAISS store with some of its attributes replaced."""
+    copied = copy.copy(store)
+    for name, value in attributes.items():
+        setattr(copied, name, value)
+    return copied
+
+
+def copy_docstore(docstore: Any) -> Any:
+    """A docstore that can be added to and deleted from without changing the original."""
+    if isinstance(docstore, MappedDocstore):
+        return docstore.copy()
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    return InMemoryDocstore(dict(docstore._dict))
+
+
+class _ReadWriteLock:
+    """Many readers or one writer; a waiting writer holds off new readers. Not re-entrant."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+def reading(store: Any) -> Any:
+    """Context in which a session store can be searched while an upload appends to it in place."""
+    lock = getattr(store, "read_write_lock", None)
+    return lock.read() if lock is not None else contextlib.nullcontext()
+
+
+def estimate_store_bytes(store: Any, mapped: bool = False) -> int:
+    """Approximate heap size of a FAISS store: vectors plus docstore text (memory-mapped parts excluded)."""
+    index = store.index
+    total = index.ntotal * vector_bytes(index, mapped)[0]
+    if isinstance(store.docstore, MappedDocstore):
+        return total + store.docstore.resident_bytes()
+    for doc in getattr(store.docstore, "_dict", {}).values():
+        total += len(doc.page_content) + DOCUMENT_OVERHEAD_BYTES
+    return total
+
+
+class ChatHistory(list):
+    """A session's recent (question, answer) turns plus a summary of the turns before them."""
+
+    def __init__(self, turns: Iterable[tuple] = (), summary: str = ""):
+        super().__init__(turns)
+        self.summary = summary
+
+
+def estimate_history_bytes(history: List[tuple]) -> int:
+    summary = getattr(history, "summary", "")
+    return sum(len(question) + len(answer) + 100 for question, answer in history) + len(summary)
+
+
+class SessionHistories:
+    """Dict-like view of chat histories; they live and are evicted with their session."""
+
+    def __init__(self, store: "SessionIndexStore"):
+        self._store = store
+
+    def get(self, session_id: str, default: Optional[List[tuple]] = None) -> Optional[List[tuple]]:
+        return self._store.get_history(session_id, default)
+
+    def __getitem__(self, session_id: str) -> List[tuple]:
+        history = self._store.get_history(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        return history
+
+    def __setitem__(self, session_id: str, history: List[tuple]) -> None:
+        self._store.set_history(session_id, history)
+
+    def update(self, session_id: str, update: Callable[[List[tuple]], Optional[List[tuple]]]) -> Optional[List[tuple]]:
+        return self._store.update_history(session_id, update)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._store.get_history(session_id) is not None
+
+
+class SessionIndexStore:
+    """Dict-like map of session id -> FAISS store, backed by a directory on disk."""
+
+    backend = "local"
+
+    def __init__(self, root: Path, persist: bool = True, use_mmap: bool = True,
+                 memory_budget_bytes: int = 0, idle_ttl: int = 0):
+        self.root = Path(root)
+        self.persist = persist
+        self.use_mmap = use_mmap
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_ttl = idle_ttl
+        # Least recently used first
+        self._stores: "OrderedDict[str, Any]" = OrderedDict()
+        self._histories: Dict[str, List[tuple]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._history_sizes: Dict[str, int] = {}
+        self._last_access: Dict[str, float] = {}
+        # Sessions whose index is a read-only memory map and must be copied before writing
+        self._mapped: set = set()
+        # Document-set fingerprints with the store and chunk count they were computed from
+        self._fingerprints: Dict[str, Tuple[Any, int, str]] = {}
+        self._lock = threading.RLock()
+        self._session_locks: Dict[str, Any] = {}
+        self._read_write_locks: Dict[str, _ReadWriteLock] = {}
+        self._history_locks: Dict[str, Any] = {}
+        self.evictions = {"memory": 0, "idle": 0}
+        self.dropped = 0
+        self.loads = 0
+        self.histories = SessionHistories(self)
+        if self.persist:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    def _session_path(self, session_id: str) -> Path:
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return self.root / session_id
+
+    def _on_disk(self, session_id: str) -> bool:
+        if not self.persist or not is_valid_session_id(session_id):
+            return False
+        path = self._session_path(session_id)
+        return (path / "index.faiss").exists() and (path / "index.pkl").exists()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._stores or self._on_disk(session_id)
+
+    def __getitem__(self, session_id: str) -> Any:
+        with self._lock:
+            if session_id not in self._stores:
+                if not self._on_disk(session_id):
+                    raise KeyError(session_id)
+                store, history, mapped = self._load(session_id)
+                store.read_write_lock = self.read_write_lock(session_id)
+                self._stores[session_id] = store
+                if mapped:
+                    self._mapped.add(session_id)
+                self._histories[session_id] = history
+                self._account(session_id)
+                self._account_history(session_id)
+            self._touch(session_id)
+            return self._stores[session_id]
+
+    def __setitem__(self, session_id: str, store: Any) -> None:
+        with self.session_lock(session_id):
+            self.save(session_id, store)
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def session_lock(self, session_id: str) -> Any:
+        """Lock serialising writes (uploads, merges) to one session."""
+        with self._lock:
+            if session_id not in self._session_locks:
+                self._session_locks[session_id] = threading.RLock()
+            return self._session_locks[session_id]
+
+    def history_lock(self, session_id: str) -> Any:
+        """Short lock serialising history writes with each other and with the swap of a saved session."""
+        with self._lock:
+            if session_id not in self._history_locks:
+                self._history_locks[session_id] = threading.RLock()
+            return self._history_locks[session_id]
+
+    def read_write_lock(self, session_id: str) -> _ReadWriteLock:
+        """Lock between searches of the published store (read) and appends to it in place (write)."""
+        with self._lock:
+            if session_id not in self._read_write_locks:
+                self._read_write_locks[session_id] = _ReadWriteLock()
+            return self._read_write_locks[session_id]
+
+    def append(self, session_id: str, text_embeddings: List[Tuple[str, List[float]]],
+               metadatas: List[Dict[str, Any]], ids: List[str]) -> Any:
+        """Add chunks to a session's published store in place and save it; returns the store.
+
+        Searches wait only while the vectors and documents are added. Callers hold
+        the session lock.
+        """
+        store = self[session_id]
+        with self._lock:
+            mapped = session_id in self._mapped
+        index = None
+        if mapped:
+            # A mapped index is a read-only view of the saved file: read it once to write the grown one
+            index, _ = self._read_index(session_id, mapped=False)
+        with self.read_write_lock(session_id).write():
+            if index is not None:
+                store.index = index
+            store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        try:
+            self.save(session_id, store)
+        except BaseException:
+            # The resident store is ahead of the disk copy; reload the saved one next time
+            with self._lock:
+                self._forget(session_id)
+            raise
+        return self.get(session_id)
+
+    def writable(self, session_id: str) -> Any:
+        """Return a private copy of the session store that documents can be removed from.
+
+        Searches keep using the published store while the copy is changed;
+        save() swaps the copy in. Callers hold the session lock.
+        """
+        import faiss
+
+        with self._lock:
+            store = self[session_id]
+            mapped = session_id in self._mapped
+        if mapped:
+            # Mapped indexes are views of the saved file and cannot grow; read a private copy
+            index, _ = self._read_index(session_id, mapped=False)
+        else:
+            index = configure_search(faiss.clone_index(store.index))
+        return copy_store(
+            store,
+            index=index,
+            docstore=copy_docstore(store.docstore),
+            index_to_docstore_id=dict(store.index_to_docstore_id),
+        )
+
+    def documents(self, session_id: str) -> List[Dict[str, Any]]:
+        """Documents indexed in a session, in upload order, with their chunk counts."""
+        return self._documents(self[session_id])
+
+    @staticmethod
+    def _documents(store: Any) -> List[Dict[str, Any]]:
+        with reading(store):
+            metadatas = [
+                store.docstore.search(docstore_id).metadata for docstore_id in store.index_to_docstore_id.values()
+            ]
+        documents: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        for metadata in metadatas:
+            # Sessions indexed before documents had ids are grouped by file name
+            key = metadata.get("document_id") or ("", metadata.get("source"))
+            if key not in documents:
+                documents[key] = {
+                    "document_id": metadata.get("document_id"),
+                    "filename": metadata.get("source"),
+                    "content_hash": metadata.get("content_hash"),
+                    "chunks_count": 0,
+                }
+            documents[key]["chunks_count"] += 1
+        return list(documents.values())
+
+    def fingerprint(self, session_id: str) -> str:
+        """Hash of a session's document set; sessions built from the same PDFs share it."""
+        store = self[session_id]
+        chunks = store.index.ntotal
+        with self._lock:
+            cached = self._fingerprints.get(session_id)
+            if cached is not None and cached[0] is store and cached[1] == chunks:
+                return cached[2]
+        # Uploads grow the published store in place, so the cache is keyed on its size as well
+        # PDFs indexed before content hashes were recorded only match within their own session
+        parts = sorted(
+            document["content_hash"] or f"{session_id}/{document['document_id'] or document['filename']}"
+            for document in self._documents(store)
+        )
+        embedding_model = getattr(store.embedding_function, "model_name", DEFAULT_EMBEDDING_MODEL)
+        fingerprint = hashlib.sha256(json.dumps([embedding_model, parts]).encode("utf-8")).hexdigest()
+        with self._lock:
+            if self._stores.get(session_id) is store and store.index.ntotal == chunks:
+                self._fingerprints[session_id] = (store, chunks, fingerprint)
+        return fingerprint
+
+    def delete_document(self, session_id: str, document_id: str) -> int:
+        """Remove one document's chunks from a session; returns how many were removed.
+
+        Removing the last document deletes the session.
+        """
+        with self.session_lock(session_id):
+            store = self.writable(session_id)
+            ids = [
+                docstore_id for docstore_id in store.index_to_docstore_id.values()
+                if store.docstore.search(docstore_id).metadata.get("document_id") == document_id
+            ]
+            if not ids:
+                return 0
+            if len(ids) == store.index.ntotal:
+                self.delete(session_id)
+                return len(ids)
+            if not supports_removal(store.index):
+                # Drop back to a plain flat index; it is rebuilt in the background if still large or compressed
+                store.index = rebuild_index(store.index, "flat")
+            store.delete(ids)
+            self.save(session_id, store)
+        self.schedule_retier(session_id)
+        return len(ids)
+
+    def schedule_retier(self, session_id: str) -> bool:
+        """Queue a background rebuild if the session has outgrown its index type."""
+        store = self.get(session_id)
+        if store is None or target_layout(store.index) is None:
+            return False
+        return schedule_rebuild(f"{self.root}/{session_id}", lambda: self.retier(session_id))
+
+    def retier(self, session_id: str) -> Optional[str]:
+        """Rebuild the session index in the layout its size and VECTOR_COMPRESSION call for.
+
+        Returns the new tier, or None if nothing had to change.
+        """
+        with self.session_lock(session_id):
+            store = self.get(session_id)
+            if store is None:
+                return None
+            layout = target_layout(store.index)
+            if layout is None:
+                return None
+            started = time.perf_counter()
+            previous = f"{index_tier(store.index)}/{index_compression(store.index)}"
+            previous_bytes = bytes_per_vector(store.index)
+            # Searches keep using the old index until the new one is swapped in
+            store = copy_store(store, index=rebuild_index(store.index, *layout))
+            self.save(session_id, store)
+            elapsed = time.perf_counter() - started
+            print(f"[INDEX] Rebuilt session {session_id} index {previous} -> {layout[0]}/{layout[1]} "
+                  f"({store.index.ntotal} chunks, {previous_bytes} -> "
+                  f"{bytes_per_vector(store.index)} vector bytes/chunk, {elapsed:.1f} s)")
+            return layout[0]
+
+    def get_history(self, session_id: str, default: Optional[List[tuple]] = None) -> Optional[List[tuple]]:
+        with self._lock:
+            if session_id not in self._histories and session_id in self:
+                # Loading the session brings its history with it
+                self[session_id]
+            history = self._histories.get(session_id)
+            return history if history is not None else default
+
+    def set_history(self, session_id: str, history: List[tuple]) -> None:
+        self.update_history(session_id, lambda current: history)
+
+    def update_history(self, session_id: str,
+                       update: Callable[[List[tuple]], Optional[List[tuple]]]) -> Optional[List[tuple]]:
+        """Replace a session's history with update(current history), atomically with other history writes.
+
+        update returns the new history, or None to keep the current one. Returns
+        the history stored, or None if nothing was.
+        """
+        if self.get(session_id) is None:
+            # History without a vector store is not kept
+            return None
+        # Not the session lock: uploads and index rebuilds hold that one for a long time
+        with self.history_lock(session_id):
+            history = update(self.get_history(session_id, ChatHistory()))
+            if history is None:
+                return None
+            self._put_history(session_id, history)
+        return history
+
+    def _put_history(self, session_id: str, history: List[tuple]) -> None:
+        """Keep and write a session's history; callers hold its history lock."""
+        with self._lock:
+            if session_id in self._stores:
+                self._histories[session_id] = history
+                self._account_history(session_id)
+        if self.persist:
+            try:
+                self._write_history(self._session_path(session_id), history)
+            except FileNotFoundError:
+                # The session was deleted meanwhile
+                pass
+
+    def save(self, session_id: str, store: Any = None) -> None:
+        """Write the session to disk, replacing any previous copy, and publish store.
+
+        store is a modified copy from writable(), the published store grown by
+        append(), or a new store; readers of a copy keep the previously published
+        store until it is swapped in here. Callers hold the session lock.
+        """
+        if store is None:
+            with self._lock:
+                store = self._stores[session_id]
+        mapped = False
+        if self.persist:
+            # Written without the store lock, so other sessions are served meanwhile
+            docstore = self._write(session_id, store)
+            if self.use_mmap:
+                # Serve from the saved files so vectors and texts live in the page cache instead of the heap
+                index, mapped = self._read_index(session_id, mapped=True)
+                store = copy_store(store, index=index, docstore=docstore)
+        store.read_write_lock = self.read_write_lock(session_id)
+        with self._lock:
+            self._stores[session_id] = store
+            if session_id not in self._histories:
+                # New, or evicted while a caller was modifying its copy
+                self._histories[session_id] = (
+                    self._read_history(self._session_path(session_id)) if self.persist else ChatHistory()
+                )
+                self._account_history(session_id)
+            if mapped:
+                self._mapped.add(session_id)
+            else:
+                self._mapped.discard(session_id)
+            self._touch(session_id)
+            self._fingerprints.pop(session_id, None)
+            self._account(session_id)
+
+    def _write(self, session_id: str, store: Any) -> Any:
+        """Write the session to its directory; returns the docstore that was pickled."""
+        import faiss
+
+        path = self._session_path(session_id)
+        tmp_path = self.root / f".{session_id}.tmp-{uuid.uuid4().hex[:8]}"
+        tmp_path.mkdir()
+        # Same files as FAISS.save_local, except that texts may go to a chunks file
+        faiss.write_index(store.index, str(tmp_path / "index.faiss"))
+        docstore = store.docstore
+        documents = ((docstore_id, docstore.search(docstore_id)) for docstore_id in store.index_to_docstore_id.values())
+        if self.use_mmap:
+            docstore = MappedDocstore.write(tmp_path / CHUNKS_FILE, documents)
+        elif isinstance(docstore, MappedDocstore):
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+            docstore = InMemoryDocstore(dict(documents))
+        with open(tmp_path / "index.pkl", "wb") as pkl_file:
+            pickle.dump((docstore, store.index_to_docstore_id), pkl_file)
+        embedding_model = getattr(store.embedding_function, "model_name", DEFAULT_EMBEDDING_MODEL)
+        with open(tmp_path / "meta.json", "w") as meta_file:
+            json.dump({
+                "embedding_model": embedding_model,
+                "chunks_count": store.index.ntotal,
+                "saved_at": time.time(),
+            }, meta_file)
+
+        # Swap directories so readers never see a half-written session; history written meanwhile is not lost
+        old_path = None
+        with self.history_lock(session_id):
+            with self._lock:
+                history = self._histories.get(session_id)
+            if history is None:
+                # Not resident (new, or evicted meanwhile): keep the saved history
+                history = self._read_history(path) if path.exists() else ChatHistory()
+            self._write_history(tmp_path, history)
+            if path.exists():
+                old_path = self.root / f".{session_id}.old-{uuid.uuid4().hex[:8]}"
+                os.replace(path, old_path)
+            os.replace(tmp_path, path)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+        if isinstance(docstore, MappedDocstore):
+            docstore.attach(path / CHUNKS_FILE)
+        return docstore
+
+    @staticmethod
+    def _write_history(path: Path, history: List[tuple]) -> None:
+        tmp_file = path / "history.json.tmp"
+        turns = [list(turn) for turn in history]
+        summary = getattr(history, "summary", "")
+        with open(tmp_file, "w") as history_file:
+            json.dump({"summary": summary, "turns": turns} if summary else turns, history_file)
+        os.replace(tmp_file, path / "history.json")
+
+    @staticmethod
+    def _read_history(path: Path) -> ChatHistory:
+        if not (path / "history.json").exists():
+            return ChatHistory()
+        with open(path / "history.json") as history_file:
+            saved = json.load(history_file)
+        # A plain list of turns until the history has a summary
+        if isinstance(saved, dict):
+            return ChatHistory((tuple(turn) for turn in saved["turns"]), saved.get("summary", ""))
+        return ChatHistory(tuple(turn) for turn in saved)
+
+    def _read_index(self, session_id: str, mapped: bool) -> Tuple[Any, bool]:
+        """Read a session's saved index, memory-mapped (read-only) or as a private copy.
+
+        Returns the index and whether it is memory-mapped.
+        """
+        import faiss
+
+        index_file = str(self._session_path(session_id) / "index.faiss")
+        if mapped:
+            # IO_FLAG_MMAP_IFC maps flat codes without copying them (IO_FLAG_MMAP copies them to the heap)
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            try:
+                return configure_search(faiss.read_index(index_file, mmap_flag | faiss.IO_FLAG_READ_ONLY)), True
+            except RuntimeError as e:
+                # Not every index type supports memory mapping
+                print(f"[WARN] Could not memory-map index for session {session_id}: {e}")
+        return configure_search(faiss.read_index(index_file)), False
+
+    def _load(self, session_id: str):
+        # Import ML libraries only when needed
+        from langchain_community.vectorstores import FAISS
+
+        path = self._session_path(session_id)
+        started = time.perf_counter()
+
+        meta = {}
+        if (path / "meta.json").exists():
+            with open(path / "meta.json") as meta_file:
+                meta = json.load(meta_file)
+
+        index, mapped = self._read_index(session_id, mapped=self.use_mmap)
+
+        # The docstore is written by our own _write, never by clients
+        with open(path / "index.pkl", "rb") as pkl_file:
+            docstore, index_to_docstore_id = pickle.load(pkl_file)
+        if isinstance(docstore, MappedDocstore):
+            docstore.attach(path / CHUNKS_FILE)
+
+        history = self._read_history(path)
+
+        store = FAISS(
+            embedding_function=embedding_registry.get(meta.get("embedding_model")),
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
+        self.loads += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"[LOAD] Loaded session {session_id} from disk ({index.ntotal} chunks, {elapsed_ms:.1f} ms)")
+        return store, history, mapped
+
+    def _touch(self, session_id: str) -> None:
+        self._stores.move_to_end(session_id)
+        self._last_access[session_id] = time.time()
+
+    def _account(self, session_id: str) -> None:
+        self._sizes[session_id] = estimate_store_bytes(self._stores[session_id], session_id in self._mapped)
+        self._enforce_budget(keep=session_id)
+
+    def _account_history(self, session_id: str) -> None:
+        self._history_sizes[session_id] = estimate_history_bytes(self._histories.get(session_id, []))
+        self._enforce_budget(keep=session_id)
+
+    def session_bytes(self, session_id: str) -> int:
+        return self._sizes.get(session_id, 0) + self._history_sizes.get(session_id, 0)
+
+    def _enforce_budget(self, keep: str) -> None:
+        if not self.memory_budget_bytes:
+            return
+        while self.memory_bytes() > self.memory_budget_bytes:
+            victim = next((sid for sid in self._stores if sid != keep), None)
+            if victim is None:
+                break
+            self._evict(victim, reason="memory")
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        size = self.session_bytes(session_id)
+        self._forget(session_id)
+        self.evictions[reason] += 1
+        if self.persist:
+            # Everything is written on change, so the disk copy is already current
+            print(f"[EVICT] Spilled session {session_id} to disk ({reason}, {size / 1024:.0f} KB)")
+        else:
+            self.dropped += 1
+            print(f"[EVICT] Dropped session {session_id} ({reason}, {size / 1024:.0f} KB)")
+
+    def evict_idle(self) -> int:
+        """Evict sessions that have not been used within the idle TTL."""
+        if not self.idle_ttl:
+            return 0
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            idle = [sid for sid in self._stores if self._last_access.get(sid, 0) < cutoff]
+            for session_id in idle:
+                self._evict(session_id, reason="idle")
+        return len(idle)
+
+    def _forget(self, session_id: str) -> None:
+        self._stores.pop(session_id, None)
+        self._histories.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+        self._history_sizes.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        self._mapped.discard(session_id)
+        self._fingerprints.pop(session_id, None)
+
+    def memory_bytes(self) -> int:
+        return sum(self._sizes.values()) + sum(self._history_sizes.values())
+
+    def resident_count(self) -> int:
+        return len(self._stores)
+
+    def stats(self) -> Dict[str, Any]:
+        """Memory accounting per resident session and eviction counters."""
+        now = time.time()
+        with self._lock:
+            sessions = [
+                {
+                    "session_id": session_id,
+                    "bytes": self.session_bytes(session_id),
+                    "chunks": store.index.ntotal,
+                    "index_type": index_tier(store.index),
+                    "compression": index_compression(store.index),
+                    "vector_bytes_per_chunk": bytes_per_vector(store.index),
+                    "heap_vector_bytes_per_chunk": vector_bytes(store.index, session_id in self._mapped)[0],
+                    "mapped_vector_bytes_per_chunk": vector_bytes(store.index, session_id in self._mapped)[1],
+                    "uncompressed_vector_bytes_per_chunk": store.index.d * 4,
+                    "bytes_per_chunk": self.session_bytes(session_id) // max(1, store.index.ntotal),
+                    "history_turns": len(self._histories.get(session_id, [])),
+                    "idle_seconds": round(now - self._last_access.get(session_id, now), 1),
+                    "memory_mapped": session_id in self._mapped,
+                }
+                for session_id, store in reversed(self._stores.items())
+            ]
+            return {
+                "backend": self.backend,
+                "pid": os.getpid(),
+                "resident_sessions": len(sessions),
+                "memory_bytes": self.memory_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "idle_ttl_seconds": self.idle_ttl,
+                "vector_compression": VECTOR_COMPRESSION,
+                "persist": self.persist,
+                "evictions": dict(self.evictions),
+                "dropped": self.dropped,
+                "loads": self.loads,
+                "sessions": sessions,
+            }
+
+    def delete(self, session_id: str) -> None:
+        """Forget a session in memory and on disk."""
+        with self.session_lock(session_id):
+            with self._lock:
+                self._forget(session_id)
+            if self.persist and is_valid_session_id(session_id):
+                shutil.rmtree(self._session_path(session_id), ignore_errors=True)
+
+
+class _SessionFileLock:
+    """Exclusive lock on a file, re-entrant within a thread and shared across processes."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "_SessionFileLock":
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+class SharedSessionIndexStore(SessionIndexStore):
+    """Session store shared by several workers through one (possibly network) directory.
+
+    Index writes happen under an exclusive per-session file lock, history writes
+    under a second, short-lived one, and every write records a new version stamp
+    (index token, history token). Before a resident session is used
+    its stamp is compared with the one on disk: a new index reloads the session, a
+    new history only reloads history.json, and a missing session is dropped.
+    """
+
+    backend = "shared"
+
+    def __init__(self, root: Path, use_mmap: bool = True, memory_budget_bytes: int = 0, idle_ttl: int = 0):
+        if fcntl is None:
+            raise RuntimeError("SESSION_BACKEND=shared needs POSIX file locks (fcntl)")
+        super().__init__(root, persist=True, use_mmap=use_mmap,
+                         memory_budget_bytes=memory_budget_bytes, idle_ttl=idle_ttl)
+        self._sync_root = self.root / ".sync"
+        self._sync_root.mkdir(parents=True, exist_ok=True)
+        self._versions: Dict[str, Optional[Tuple[str, str]]] = {}
+        self.refreshes = {"index": 0, "history": 0, "deleted": 0}
+
+    def _version_path(self, session_id: str) -> Path:
+        return self._sync_root / f"{session_id}.version"
+
+    def _read_version(self, session_id: str) -> Optional[Tuple[str, str]]:
+        try:
+            with open(self._version_path(session_id)) as version_file:
+                index_token, history_token = version_file.read().split()
+            return index_token, history_token
+        except (OSError, ValueError):
+            # Sessions written before the shared backend was enabled have no stamp
+            return None
+
+    def _stamp(self, session_id: str, index: bool = False, history: bool = False) -> None:
+        """Record a new version of the session's index and/or history."""
+        # Index and history writers stamp under different session locks, both under this one
+        with self.history_lock(session_id):
+            index_token, history_token = self._read_version(session_id) or ("-", "-")
+            if index:
+                index_token = uuid.uuid4().hex
+            if history:
+                history_token = uuid.uuid4().hex
+            tmp_file = self._sync_root / f".{session_id}.version.{uuid.uuid4().hex[:8]}"
+            with open(tmp_file, "w") as version_file:
+                version_file.write(f"{index_token} {history_token}")
+            os.replace(tmp_file, self._version_path(session_id))
+            with self._lock:
+                self._versions[session_id] = (index_token, history_token)
+
+    def session_lock(self, session_id: str) -> _SessionFileLock:
+        path = self._session_path(session_id)
+        with self._lock:
+            if session_id not in self._session_locks:
+                self._session_locks[session_id] = _SessionFileLock(self._sync_root / f"{path.name}.lock")
+            return self._session_locks[session_id]
+
+    def history_lock(self, session_id: str) -> _SessionFileLock:
+        # Only held to write history.json or swap the session directory, never while an index is built
+        path = self._session_path(session_id)
+        with self._lock:
+            if session_id not in self._history_locks:
+                self._history_locks[session_id] = _SessionFileLock(self._sync_root / f"{path.name}.history.lock")
+            return self._history_locks[session_id]
+
+    def __contains__(self, session_id: str) -> bool:
+        # Another worker may have created or deleted the session
+        return self._on_disk(session_id)
+
+    def __getitem__(self, session_id: str) -> Any:
+        with self._lock:
+            if session_id in self._stores:
+                self._refresh(session_id)
+            return super().__getitem__(session_id)
+
+    def get_history(self, session_id: str, default: Optional[List[tuple]] = None) -> Optional[List[tuple]]:
+        with self._lock:
+            if session_id in self._stores:
+                self._refresh(session_id)
+            return super().get_history(session_id, default)
+
+    def _refresh(self, session_id: str) -> None:
+        """Bring a resident session up to date with changes made by other workers."""
+        if not self._on_disk(session_id):
+            self._forget(session_id)
+            self.refreshes["deleted"] += 1
+            return
+        version = self._read_version(session_id)
+        cached = self._versions.get(session_id)
+        if version == cached:
+            return
+        if version is None or cached is None or version[0] != cached[0]:
+            # The index changed: drop the resident copy so it is reloaded
+            self._forget(session_id)
+            self.refreshes["index"] += 1
+            return
+        self._histories[session_id] = self._read_history(self._session_path(session_id))
+        self._versions[session_id] = version
+        self._account_history(session_id)
+        self.refreshes["history"] += 1
+
+    def _load(self, session_id: str):
+        # Read the stamp first: a write racing with the load only causes an extra reload
+        version = self._read_version(session_id)
+        loaded = super()._load(session_id)
+        self._versions[session_id] = version
+        return loaded
+
+    def save(self, session_id: str, store: Any = None) -> None:
+        with self.session_lock(session_id):
+            super().save(session_id, store)
+            self._stamp(session_id, index=True)
+
+    def _put_history(self, session_id: str, history: List[tuple]) -> None:
+        super()._put_history(session_id, history)
+        if session_id in self._stores:
+            self._stamp(session_id, history=True)
+
+    def _forget(self, session_id: str) -> None:
+        super()._forget(session_id)
+        self._versions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["refreshes"] = dict(self.refreshes)
+        return stats
+
+    def delete(self, session_id: str) -> None:
+        with self.session_lock(session_id):
+            super().delete(session_id)
+            if is_valid_session_id(session_id):
+                try:
+                    os.unlink(self._version_path(session_id))
+                except FileNotFoundError:
+                    pass
+
+
+def create_session_store(backend: str, root: Path, persist: bool = True, use_mmap: bool = True,
+                         memory_budget_bytes: int = 0, idle_ttl: int = 0) -> SessionIndexStore:
+    """Build the session store selected by SESSION_BACKEND."""
+    # Fail at startup on a bad VECTOR_COMPRESSION rather than on the first rebuild
+    compression = desired_compression(0)
+    if compression != "none" and not (persist and use_mmap):
+        print("[WARN] VECTOR_COMPRESSION without a persisted, memory-mapped store keeps the "
+              "re-ranking vectors in memory; expect little saving")
+    if backend == "shared":
+        if not persist:
+            raise ValueError("SESSION_BACKEND=shared requires VECTOR_STORE_PERSIST=true")
+        return SharedSessionIndexStore(root, use_mmap=use_mmap,
+                                       memory_budget_bytes=memory_budget_bytes, idle_ttl=idle_ttl)
+    if backend == "local":
+        return SessionIndexStore(root, persist=persist, use_mmap=use_mmap,
+                                 memory_budget_bytes=memory_budget_bytes, idle_ttl=idle_ttl)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend!r} (expected 'local' or 'shared')")
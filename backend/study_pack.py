@@ -0,0 +1,223 @@
+"""
+Study pack cache: quiz, flashcards and conversation title per document set.
+
+These artifacts depend only on the uploaded PDFs, so they are generated once per
+document set and stored on disk under STUDY_PACK_DIR. The key is the session's
+document fingerprint (content hashes of its PDFs), so sessions that share PDFs
+share a pack, and uploading or removing a PDF produces a new key.
+
+A whole pack can be generated in one batched LLM call; artifacts can also be
+generated one at a time. With STUDY_PACK_PRECOMPUTE the pack is generated in
+the background right after ingestion, so the quiz, flashcards and title
+requests are cache reads. A request that arrives while its artifact is being
+generated waits for that generation instead of starting another one. Clients
+can still ask for regeneration, which replaces the stored artifact.
+
+The packs on disk are listed in memory, least recently written first, from one
+directory scan at startup; pruning drops the oldest without listing the
+directory again.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from concurrency import run_blocking
+
+# STUDY PACK CONFIG
+STUDY_PACK_PRECOMPUTE = os.getenv("STUDY_PACK_PRECOMPUTE", "true").lower() == "true"
+STUDY_PACK_DIR = Path(os.getenv("STUDY_PACK_DIR", str(Path(__file__).parent / "data" / "study_packs")))
+# Packs kept on disk (least recently generated are removed first)
+STUDY_PACK_MAX_ENTRIES = int(os.getenv("STUDY_PACK_MAX_ENTRIES", "1000"))
+# Packs kept in memory in front of the disk copies
+STUDY_PACK_MEMORY_ENTRIES = 128
+
+ARTIFACTS = ("title", "quiz", "flashcards")
+# Pending-generation key of a batched generation of the whole pack
+_WHOLE_PACK = "*"
+
+
+class StudyPackCache:
+    """Generated study artifacts keyed by document fingerprint, in memory and on disk."""
+
+    def __init__(self, root: Path, max_entries: int):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        # Most recently used last
+        self._packs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Generations in flight, only touched from the event loop
+        self._pending: Dict[Tuple[str, str], "asyncio.Future"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        # Keys of the packs on disk, least recently written first
+        self._files: "OrderedDict[str, None]" = OrderedDict()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        packs = []
+        for path in self.root.glob("*.json"):
+            try:
+                packs.append((path.stat().st_mtime, path.stem))
+            except OSError:
+                continue
+        for _, key in sorted(packs):
+            self._files[key] = None
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def _read(self, key: str) -> Dict[str, Any]:
+        if key in self._packs:
+            self._packs.move_to_end(key)
+            return self._packs[key]
+        try:
+            with open(self._path(key)) as pack_file:
+                pack = json.load(pack_file)
+        except (OSError, ValueError):
+            pack = {}
+        if pack:
+            self._remember(key, pack)
+            # Written by another worker sharing the directory
+            self._files.setdefault(key, None)
+        return pack
+
+    def _remember(self, key: str, pack: Dict[str, Any]) -> None:
+        self._packs[key] = pack
+        self._packs.move_to_end(key)
+        while len(self._packs) > STUDY_PACK_MEMORY_ENTRIES:
+            self._packs.popitem(last=False)
+
+    def get(self, key: str, artifact: str) -> Optional[Any]:
+        """Cached artifact for a document set, or None."""
+        with self._lock:
+            entry = self._read(key).get(artifact)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["value"]
+
+    def get_pack(self, key: str) -> Dict[str, Any]:
+        """Cached artifacts of a document set (possibly only some of them)."""
+        with self._lock:
+            pack = self._read(key)
+        found = {artifact: pack[artifact]["value"] for artifact in ARTIFACTS if artifact in pack}
+        self.hits += len(found)
+        self.misses += len(ARTIFACTS) - len(found)
+        return found
+
+    def put(self, key: str, artifact: str, value: Any) -> None:
+        with self._lock:
+            pack = dict(self._read(key))
+            pack[artifact] = {"value": value, "generated_at": time.time()}
+            # Other workers may share the directory: write a new file and swap it in
+            tmp_file = self.root / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_file, "w") as pack_file:
+                json.dump(pack, pack_file)
+            os.replace(tmp_file, self._path(key))
+            self._remember(key, pack)
+            self._files[key] = None
+            self._files.move_to_end(key)
+            self._prune()
+
+    def _prune(self) -> None:
+        while len(self._files) > self.max_entries:
+            key, _ = self._files.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            self._packs.pop(key, None)
+
+    async def get_or_generate(self, key: str, artifact: str, generate: Callable[[], Awaitable[Any]],
+                              regenerate: bool = False) -> Any:
+        """Return the cached artifact, generating (and storing) it if missing or regeneration is requested."""
+        batch = self._pending.get((key, _WHOLE_PACK))
+        if batch is not None and not regenerate:
+            # A batched generation is producing this artifact already
+            try:
+                generated = await asyncio.shield(batch)
+            except Exception:
+                generated = {}
+            if artifact in generated:
+                return generated[artifact]
+        if (key, artifact) not in self._pending and not regenerate:
+            value = await run_blocking(self.get, key, artifact)
+            if value is not None:
+                return value
+        # Another request may have started the generation while the disk was checked
+        pending = self._pending.get((key, artifact))
+        if pending is None:
+            pending = asyncio.ensure_future(self._generate(key, artifact, generate))
+            self._pending[(key, artifact)] = pending
+            pending.add_done_callback(lambda _: self._pending.pop((key, artifact), None))
+        # A disconnecting client must not cancel a generation other requests are waiting for
+        return await asyncio.shield(pending)
+
+    async def _generate(self, key: str, artifact: str, generate: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            value = await generate()
+        except Exception:
+            self.failures += 1
+            raise
+        await run_blocking(self.put, key, artifact, value)
+        self.generated += 1
+        print(f"[STUDY] Generated {artifact} for documents {key[:12]} ({time.perf_counter() - started:.1f} s)")
+        return value
+
+    async def get_or_generate_pack(self, key: str, generate: Callable[[], Awaitable[Dict[str, Any]]],
+                                   regenerate: bool = False) -> Dict[str, Any]:
+        """Return the cached pack, filling it with one batched generation if anything is missing.
+
+        The result lacks the artifacts the batched generation could not produce.
+        """
+        cached: Dict[str, Any] = {}
+        if not regenerate:
+            cached = await run_blocking(self.get_pack, key)
+            if len(cached) == len(ARTIFACTS):
+                return cached
+        pending = self._pending.get((key, _WHOLE_PACK))
+        if pending is None:
+            pending = asyncio.ensure_future(self._generate_pack(key, generate))
+            self._pending[(key, _WHOLE_PACK)] = pending
+            pending.add_done_callback(lambda _: self._pending.pop((key, _WHOLE_PACK), None))
+        generated = await asyncio.shield(pending)
+        return {**cached, **generated}
+
+    async def _generate_pack(self, key: str, generate: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            generated = await generate()
+        except Exception:
+            self.failures += 1
+            raise
+        for artifact, value in generated.items():
+            await run_blocking(self.put, key, artifact, value)
+        self.generated += len(generated)
+        print(f"[STUDY] Generated {', '.join(generated) or 'nothing'} for documents {key[:12]} "
+              f"in one call ({time.perf_counter() - started:.1f} s)")
+        return generated
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "precompute": STUDY_PACK_PRECOMPUTE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "generated": self.generated,
+            "failures": self.failures,
+            "pending": len(self._pending),
+            "entries": len(self._files),
+            "max_entries": self.max_entries,
+        }
+
+
+study_packs = StudyPackCache(STUDY_PACK_DIR, STUDY_PACK_MAX_ENTRIES)
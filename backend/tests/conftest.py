@@ -0,0 +1,14 @@
+"""
+Tests for the backend modules, run from the backend directory:
+
+    python -m pytest tests
+
+They run against local stubs (an httpx mock transport, in-memory mail sinks,
+fake provider calls for the LLM scheduler) and need neither network access nor
+API keys.
+"""
+import sys
+from pathlib import Path
+
+# The backend is a flat set of modules, imported the way main.py imports them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from code_store import CODE_EXPIRED, CODE_INVALID, CODE_VALID, MemoryCodeStore, SQLiteCodeStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    """Each backend, keeping at most two codes per email and expired codes until the next sweep."""
+    if request.param == "memory":
+        return MemoryCodeStore(max_active=2, retention=0)
+    return SQLiteCodeStore(tmp_path / "codes.sqlite3", max_active=2, retention=0)
+
+
+def test_a_code_is_valid_until_consumed_and_then_invalid(store):
+    store.issue("mfa", "ada@example.com", "123456", ttl_seconds=60)
+    assert store.check("mfa", "ada@example.com", "123456") == CODE_VALID
+    assert store.check("mfa", "ada@example.com", "123456", consume=True) == CODE_VALID
+    # A second consume (a replayed form, a double click) must fail
+    assert store.check("mfa", "ada@example.com", "123456", consume=True) == CODE_INVALID
+    assert store.check("mfa", "ada@example.com", "123456") == CODE_INVALID
+
+
+def test_codes_are_scoped_to_purpose_and_email(store):
+    store.issue("mfa", "ada@example.com", "123456", ttl_seconds=60)
+    assert store.check("reset", "ada@example.com", "123456") == CODE_INVALID
+    assert store.check("mfa", "bob@example.com", "123456") == CODE_INVALID
+    assert store.check("mfa", "ada@example.com", "654321") == CODE_INVALID
+
+
+def test_an_expired_code_is_reported_as_expired_until_swept(store):
+    store.issue("mfa", "ada@example.com", "123456", ttl_seconds=-1)
+    assert store.check("mfa", "ada@example.com", "123456") == CODE_EXPIRED
+    # Consuming does not make an expired code valid, nor remove it
+    assert store.check("mfa", "ada@example.com", "123456", consume=True) == CODE_EXPIRED
+    assert store.check("mfa", "ada@example.com", "123456") == CODE_EXPIRED
+
+    assert store.sweep() == 1
+    assert store.check("mfa", "ada@example.com", "123456") == CODE_INVALID
+    assert store.stats()["swept"] == 1
+
+
+def test_a_sweep_keeps_codes_that_have_not_expired(store):
+    store.issue("mfa", "ada@example.com", "111111", ttl_seconds=60)
+    store.issue("mfa", "bob@example.com", "222222", ttl_seconds=-1)
+    assert store.sweep() == 1
+    assert store.check("mfa", "ada@example.com", "111111") == CODE_VALID
+
+
+def test_issuing_past_the_cap_drops_the_oldest_code(store):
+    for code in ("111111", "222222", "333333"):
+        store.issue("mfa", "ada@example.com", code, ttl_seconds=60)
+    assert store.check("mfa", "ada@example.com", "111111") == CODE_INVALID
+    assert store.check("mfa", "ada@example.com", "222222") == CODE_VALID
+    assert store.check("mfa", "ada@example.com", "333333") == CODE_VALID
+    assert store.stats()["codes"] == 2
+
+
+def test_only_one_of_concurrent_consumers_gets_the_code(store):
+    store.issue("mfa", "ada@example.com", "123456", ttl_seconds=60)
+    consumers = 8
+    start = threading.Barrier(consumers)
+    outcomes = []
+
+    def consume():
+        start.wait()
+        outcomes.append(store.check("mfa", "ada@example.com", "123456", consume=True))
+
+    threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outcomes.count(CODE_VALID) == 1
+    assert outcomes.count(CODE_INVALID) == consumers - 1
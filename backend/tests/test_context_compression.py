@@ -0,0 +1,83 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from chat_prompt import count_tokens
+from context_compression import MIN_PASSAGE_TOKENS, merge_neighbours, mmr_select, trim_passages
+
+
+def chunk(text, page=1, source="notes.pdf"):
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_mmr_picks_the_most_relevant_chunk_first_and_skips_duplicates():
+    query = np.array([1.0, 0.0, 0.0])
+    vectors = np.array([
+        [0.8, 0.6, 0.0],  # relevant
+        [0.8, 0.6, 0.0],  # the same chunk again (a PDF uploaded twice)
+        [1.0, 0.0, 0.0],  # most relevant
+        [0.5, 0.0, 0.9],  # less relevant, about something else
+    ])
+    picked = mmr_select(query, vectors, k=4)
+    assert picked[0] == 2
+    # Only one of the two identical chunks is used, however many are asked for
+    assert len({0, 1} & set(picked)) == 1
+    assert sorted(picked) in ([0, 2, 3], [1, 2, 3])
+
+
+def test_mmr_returns_nothing_for_no_candidates_or_k_zero():
+    query = np.array([1.0, 0.0])
+    assert mmr_select(query, np.zeros((0, 2)), k=3) == []
+    assert mmr_select(query, np.array([[1.0, 0.0]]), k=0) == []
+
+
+def test_consecutive_chunks_of_a_page_merge_with_their_overlap_kept_once():
+    overlap = "the mitochondria is the powerhouse of the cell"
+    first = chunk(f"Chapter two covers cell biology and {overlap}")
+    second = chunk(f"{overlap}, producing most of its energy")
+    merged = merge_neighbours(["doc:4", "doc:5"], [first, second])
+    assert len(merged) == 1
+    assert merged[0].page_content == f"Chapter two covers cell biology and {overlap}, producing most of its energy"
+    assert merged[0].metadata["merged_chunks"] == 2
+
+
+def test_duplicate_chunk_ids_are_not_merged_into_each_other():
+    doc = chunk("Photosynthesis turns light into chemical energy.")
+    merged = merge_neighbours(["doc:3", "doc:3"], [doc, doc])
+    assert [passage.page_content for passage in merged] == [doc.page_content] * 2
+    assert all("merged_chunks" not in passage.metadata for passage in merged)
+
+
+def test_neighbours_on_different_pages_or_documents_stay_apart():
+    ids = ["a:1", "a:2", "b:3", "a:3"]
+    docs = [chunk("end of page one", page=1), chunk("start of page two", page=2),
+            chunk("other document", source="other.pdf"), chunk("more of page two", page=2)]
+    merged = merge_neighbours(ids, docs)
+    texts = [passage.page_content for passage in merged]
+    # a:1 and a:2 are consecutive but on different pages; b:3 belongs to another document
+    assert texts == ["end of page one", "start of page two\nmore of page two", "other document"]
+    assert [passage.metadata["page"] for passage in merged] == [1, 2, 1]
+
+
+def test_passages_keep_the_rank_of_their_best_chunk():
+    ids = ["doc:9", "other:1", "doc:8"]
+    docs = [chunk("ninth"), chunk("elsewhere", source="other.pdf"), chunk("eighth")]
+    merged = merge_neighbours(ids, docs)
+    # doc:8 and doc:9 merge in document order but rank first, as doc:9 did
+    assert [passage.page_content for passage in merged] == ["eighth\nninth", "elsewhere"]
+
+
+def test_trim_keeps_rank_order_within_the_budget():
+    docs = [chunk("first " * 20), chunk("second " * 20), chunk("third " * 20)]
+    budget = count_tokens(docs[0].page_content) + count_tokens(docs[1].page_content)
+    parts = trim_passages(docs, budget)
+    assert parts == [docs[0].page_content, docs[1].page_content]
+
+
+def test_a_budget_smaller_than_one_chunk_shortens_it_or_leaves_it_out():
+    doc = chunk("word " * 200)
+    parts = trim_passages([doc], MIN_PASSAGE_TOKENS + 10)
+    assert len(parts) == 1
+    assert count_tokens(parts[0]) <= MIN_PASSAGE_TOKENS + 10 + 2
+    assert parts[0].endswith(" ...")
+    # Too little room for a useful piece of the passage: nothing is sent
+    assert trim_passages([doc], MIN_PASSAGE_TOKENS - 1) == []
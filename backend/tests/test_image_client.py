@@ -0,0 +1,130 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+
+from image_client import ImageClient, ImageGenerationFailed
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"p" * 5000
+
+
+def make_client(monkeypatch, handler, providers=("first", "second"), max_bytes=1024 * 1024, timeout=5.0):
+    """ImageClient over the given providers, all answered by handler(provider name, request)."""
+    for name in providers:
+        monkeypatch.setenv(f"IMAGE_PROVIDER_{name.upper()}_URL", f"http://{name}.test/prompt/{{prompt}}")
+        monkeypatch.setenv(f"IMAGE_PROVIDER_{name.upper()}_TIMEOUT", str(timeout))
+    client = ImageClient(list(providers), max_bytes, 4)
+
+    async def route(request: httpx.Request) -> httpx.Response:
+        return await handler(request.url.host.split(".")[0], request)
+
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(route))
+    return client
+
+
+def generate(client, prompt="a cat"):
+    async def run():
+        image_file = io.BytesIO()
+        try:
+            size, content_type, provider = await client.generate(prompt, image_file, 64, 64)
+            return size, content_type, provider, image_file.getvalue()
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def image_response(body=PNG, **headers):
+    return httpx.Response(200, headers={"content-type": "image/png", **headers}, content=body)
+
+
+class Chunks(httpx.AsyncByteStream):
+    """Response body sent in pieces, without a content-length."""
+
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_first_provider_that_answers_wins(monkeypatch):
+    calls = []
+
+    async def handler(provider, request):
+        calls.append(provider)
+        assert request.url.raw_path == b"/prompt/a%20cat"
+        return image_response()
+
+    size, content_type, provider, written = generate(make_client(monkeypatch, handler))
+    assert (size, content_type, provider) == (len(PNG), "image/png", "first")
+    assert written == PNG
+    assert calls == ["first"]
+
+
+def test_failed_provider_falls_through_to_the_next(monkeypatch):
+    async def handler(provider, request):
+        if provider == "first":
+            return httpx.Response(503)
+        return image_response()
+
+    client = make_client(monkeypatch, handler)
+    _, _, provider, written = generate(client)
+    assert provider == "second"
+    assert written == PNG
+    stats = {entry["name"]: entry for entry in client.stats()["providers"]}
+    assert stats["first"]["failed"] == 1 and stats["second"]["ok"] == 1
+
+
+def test_body_streams_into_the_file_and_a_broken_stream_leaves_nothing_behind(monkeypatch):
+    class Broken(Chunks):
+        async def __aiter__(self):
+            yield b"half an image"
+            raise httpx.ReadError("connection reset")
+
+    async def handler(provider, request):
+        if provider == "first":
+            return httpx.Response(200, headers={"content-type": "image/png"}, stream=Broken())
+        return image_response()
+
+    size, _, provider, written = generate(make_client(monkeypatch, handler))
+    # The second provider's image replaces the first one's partial output entirely
+    assert provider == "second"
+    assert size == len(PNG)
+    assert written == PNG
+
+
+def test_oversized_images_are_rejected(monkeypatch):
+    async def handler(provider, request):
+        if provider == "first":
+            # Announced size over the cap
+            return image_response(b"x" * 10, **{"content-length": "4096"})
+        # No content-length: caught while streaming
+        return httpx.Response(200, headers={"content-type": "image/png"}, stream=Chunks(b"y" * 600, b"y" * 600))
+
+    with pytest.raises(ImageGenerationFailed) as failure:
+        generate(make_client(monkeypatch, handler, max_bytes=1000))
+    assert [str(error) for error in failure.value.errors] == ["first: image too large", "second: image too large"]
+    assert not failure.value.timed_out
+
+
+def test_non_images_are_rejected(monkeypatch):
+    async def handler(provider, request):
+        return httpx.Response(200, headers={"content-type": "text/html; charset=utf-8"}, content=b"<html>")
+
+    with pytest.raises(ImageGenerationFailed, match="unexpected content type text/html"):
+        generate(make_client(monkeypatch, handler, providers=("first",)))
+
+
+def test_provider_timeout_bounds_the_whole_request(monkeypatch):
+    async def handler(provider, request):
+        await asyncio.sleep(5)
+        return image_response()
+
+    client = make_client(monkeypatch, handler, providers=("first",), timeout=0.05)
+    with pytest.raises(ImageGenerationFailed) as failure:
+        generate(client)
+    assert failure.value.timed_out
+    assert client.stats()["providers"][0]["timed_out"] == 1
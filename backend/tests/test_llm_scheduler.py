@@ -0,0 +1,238 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_scheduler import (
+    PRIORITY_BACKGROUND, LLMOverloaded, LLMRateLimited, LLMScheduler, set_llm_caller,
+)
+
+
+class Reply:
+    def __init__(self, content="ok", total_tokens=5):
+        self.content = content
+        self.usage_metadata = {"input_tokens": total_tokens - 2, "output_tokens": 2, "total_tokens": total_tokens}
+
+
+class ProviderRateLimit(Exception):
+    """What the Groq client raises for an HTTP 429."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: str):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}})()
+
+
+class StubLLM:
+    """Chat model stand-in: records who called when, optionally fails or waits for a gate."""
+
+    def __init__(self):
+        self.started = []
+        self.errors = []
+        self.gate = None
+
+    async def ainvoke(self, messages):
+        self.started.append((messages, time.monotonic()))
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.gate is not None:
+            await self.gate.wait()
+        return Reply()
+
+    async def astream(self, messages):
+        self.started.append((messages, time.monotonic()))
+        if self.errors:
+            raise self.errors.pop(0)
+        for piece in ("Hello", " there"):
+            yield Reply(piece)
+
+
+def scheduler(requests_per_minute=0, tokens_per_minute=0, concurrency=4, queue_limit=50):
+    """A scheduler on the running loop whose calls all go to one StubLLM."""
+    llm_scheduler = LLMScheduler(requests_per_minute, tokens_per_minute, concurrency, queue_limit)
+    llm_scheduler._ensure_running()
+    llm = StubLLM()
+    llm_scheduler.client = lambda temperature=None, max_tokens=None: llm
+    return llm_scheduler, llm
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_calls_run_and_report_usage():
+    async def main():
+        llm_scheduler, llm = scheduler()
+        reply = await llm_scheduler.invoke("hello", max_tokens=20)
+        return llm_scheduler, reply
+
+    llm_scheduler, reply = asyncio.run(main())
+    assert reply.content == "ok"
+    stats = llm_scheduler.stats()
+    assert (stats["granted"], stats["in_flight"], stats["tokens_used"]) == (1, 0, 5)
+
+
+def test_token_reservation_is_the_expected_answer_and_reconciled_with_usage():
+    async def main():
+        llm_scheduler, _ = scheduler(tokens_per_minute=6000)
+        # 400 characters of prompt (100 tokens) and a 2000-token answer budget
+        await llm_scheduler.invoke("x" * 400, max_tokens=2000)
+        return llm_scheduler
+
+    llm_scheduler = asyncio.run(main())
+    stats = llm_scheduler.stats()
+    assert stats["tokens_reserved"] == 100 + stats["expected_output_tokens"]
+    # The stub reports 5 tokens: only those stay taken from the bucket
+    assert 6000 - 5 <= llm_scheduler._tokens.level + 1e-6
+
+
+def test_calls_beyond_the_request_bucket_are_rejected_up_front():
+    async def main():
+        # Two requests a minute: the bucket holds two, the third would wait ~30 s
+        llm_scheduler, _ = scheduler(requests_per_minute=2)
+        await llm_scheduler.invoke("one")
+        await llm_scheduler.invoke("two")
+        with pytest.raises(LLMRateLimited) as rejected:
+            await llm_scheduler.invoke("three")
+        return llm_scheduler, rejected.value
+
+    llm_scheduler, rejected = asyncio.run(main())
+    assert rejected.status_code == 429
+    assert 20 < rejected.retry_after <= 30
+    assert llm_scheduler.rejected_rate_limited == 1
+
+
+def test_concurrency_is_capped_and_a_full_queue_is_rejected():
+    async def main():
+        llm_scheduler, llm = scheduler(concurrency=1, queue_limit=2)
+        llm.gate = asyncio.Event()
+        calls = [asyncio.create_task(llm_scheduler.invoke("call 0"))]
+        await settle()
+        # One call running, two waiting: the queue is full
+        calls += [asyncio.create_task(llm_scheduler.invoke(f"call {n}")) for n in (1, 2)]
+        await settle()
+        assert len(llm.started) == 1 and llm_scheduler.in_flight == 1
+        with pytest.raises(LLMOverloaded):
+            await llm_scheduler.invoke("one too many")
+        llm.gate.set()
+        await asyncio.gather(*calls)
+        return llm_scheduler, llm
+
+    llm_scheduler, llm = asyncio.run(main())
+    assert [messages for messages, _ in llm.started] == ["call 0", "call 1", "call 2"]
+    assert (llm_scheduler.in_flight, llm_scheduler.rejected_overloaded) == (0, 1)
+
+
+def test_interactive_calls_go_first_and_callers_take_turns():
+    async def main():
+        llm_scheduler, llm = scheduler(concurrency=1)
+        llm.gate = asyncio.Event()
+
+        async def call(caller, messages, priority=0):
+            set_llm_caller(caller, priority)
+            await llm_scheduler.invoke(messages)
+
+        first = asyncio.create_task(call("a", "a1"))
+        await settle()
+        waiting = [
+            asyncio.create_task(call("bg", "bg1", PRIORITY_BACKGROUND)),
+            asyncio.create_task(call("a", "a2")),
+            asyncio.create_task(call("a", "a3")),
+            asyncio.create_task(call("b", "b1")),
+        ]
+        await settle()
+        llm.gate.set()
+        await asyncio.gather(first, *waiting)
+        return [messages for messages, _ in llm.started]
+
+    assert asyncio.run(main()) == ["a1", "a2", "b1", "a3", "bg1"]
+
+
+def test_a_cancelled_waiter_gives_up_its_place():
+    async def main():
+        llm_scheduler, llm = scheduler(concurrency=1)
+        llm.gate = asyncio.Event()
+        running = asyncio.create_task(llm_scheduler.invoke("running"))
+        await settle()
+        queued = asyncio.create_task(llm_scheduler.invoke("queued"))
+        await settle()
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        llm.gate.set()
+        await running
+        return llm_scheduler, llm
+
+    llm_scheduler, llm = asyncio.run(main())
+    assert [messages for messages, _ in llm.started] == ["running"]
+    assert llm_scheduler.stats()["queued"] == {"interactive": 0, "background": 0}
+    assert llm_scheduler.in_flight == 0
+
+
+def test_a_slot_granted_as_the_caller_is_cancelled_is_given_back():
+    async def main():
+        # Concurrency 0: the dispatcher grants nothing, the test grants the slot itself
+        llm_scheduler, _ = scheduler(concurrency=0)
+        call = asyncio.create_task(llm_scheduler.invoke("hello"))
+        await settle()
+        waiter = llm_scheduler._next_waiter()
+        llm_scheduler._pop(waiter.priority, waiter.caller)
+        llm_scheduler.in_flight += 1
+        waiter.future.set_result(None)
+        call.cancel()
+        try:
+            await call
+        except asyncio.CancelledError:
+            pass
+        return llm_scheduler
+
+    # Whether the call still runs or is cancelled depends on the Python version; the slot comes back either way
+    assert asyncio.run(main()).in_flight == 0
+
+
+def test_a_provider_429_pauses_every_call_and_is_retried():
+    async def main():
+        llm_scheduler, llm = scheduler()
+        llm.errors.append(ProviderRateLimit("0.5"))
+        started = time.monotonic()
+        first = asyncio.create_task(llm_scheduler.invoke("limited"))
+        await settle()
+        # Arrives during the pause and has to wait for it too
+        second = asyncio.create_task(llm_scheduler.invoke("during pause"))
+        await asyncio.gather(first, second)
+        return llm_scheduler, llm, started
+
+    llm_scheduler, llm, started = asyncio.run(main())
+    assert llm_scheduler.provider_rate_limits == 1
+    # The retry keeps its place ahead of the call that arrived during the pause
+    assert [messages for messages, _ in llm.started] == ["limited", "limited", "during pause"]
+    assert all(at - started >= 0.5 for _, at in llm.started[1:])
+    assert llm_scheduler.in_flight == 0
+
+
+def test_a_429_that_outlasts_the_wait_is_reported_to_the_caller():
+    async def main():
+        llm_scheduler, llm = scheduler()
+        llm.errors.append(ProviderRateLimit("60"))
+        with pytest.raises(LLMRateLimited) as rejected:
+            await llm_scheduler.invoke("limited")
+        return llm_scheduler, rejected.value
+
+    llm_scheduler, rejected = asyncio.run(main())
+    assert rejected.retry_after == 60
+    assert llm_scheduler.stats()["paused_for_seconds"] > 50
+    assert llm_scheduler.in_flight == 0
+
+
+def test_streams_retry_a_429_before_the_first_chunk():
+    async def main():
+        llm_scheduler, llm = scheduler()
+        llm.errors.append(ProviderRateLimit("0.1"))
+        chunks = [chunk.content async for chunk in llm_scheduler.stream("hello")]
+        return llm_scheduler, chunks
+
+    llm_scheduler, chunks = asyncio.run(main())
+    assert chunks == ["Hello", " there"]
+    assert (llm_scheduler.provider_rate_limits, llm_scheduler.in_flight) == (1, 0)
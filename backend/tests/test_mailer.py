@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+import pytest
+
+import mailer
+from mailer import BrevoSink, Mailer, PermanentMailError
+
+TEMPLATE = "<p>Your code is {{ params.code }}</p>"
+OTHER_TEMPLATE = "<p>Reset with {{ params.code }}</p>"
+
+
+class StubSink:
+    """Records every provider call; fail(emails) decides whether a call raises."""
+
+    name = "stub"
+
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = fail
+
+    def send(self, emails):
+        self.calls.append([email.to for email in emails])
+        if self.fail is not None:
+            error = self.fail(emails)
+            if error is not None:
+                raise error
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(mailer, "MAIL_BATCH_WAIT_SECONDS", 0.02)
+
+
+def run(sink, send, settled, max_attempts=3):
+    """Start a mailer, queue emails with send(m), wait until settled(m) holds, then stop it."""
+
+    async def main():
+        m = Mailer(sink, 100, 1, 50, max_attempts)
+        m.start()
+        send(m)
+        deadline = time.monotonic() + 5
+        while not settled(m) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await m.stop(1)
+        return m
+
+    return asyncio.run(main())
+
+
+def queue(m, *addresses, template=TEMPLATE):
+    return [m.send(address, "Your code", template, {"code": "123456"}) for address in addresses]
+
+
+def test_emails_sharing_a_template_go_out_in_one_call():
+    sink = StubSink()
+    m = run(sink, lambda m: (queue(m, "a@x.io", "b@x.io"), queue(m, "c@x.io", template=OTHER_TEMPLATE)),
+            settled=lambda m: m.sent == 3)
+    assert sorted(sink.calls) == [["a@x.io", "b@x.io"], ["c@x.io"]]
+    assert (m.sent, m.batches, m.failed) == (3, 2, 0)
+
+
+def test_transient_failures_are_retried():
+    outcomes = iter([ConnectionError("reset"), ConnectionError("reset"), None])
+    sink = StubSink(fail=lambda emails: next(outcomes))
+    m = run(sink, lambda m: queue(m, "a@x.io"), settled=lambda m: m.sent == 1)
+    assert sink.calls == [["a@x.io"]] * 3
+    assert (m.sent, m.retried, m.failed) == (1, 2, 0)
+
+
+def test_retries_stop_after_max_attempts():
+    sink = StubSink(fail=lambda emails: ConnectionError("down"))
+    m = run(sink, lambda m: queue(m, "a@x.io"), max_attempts=3, settled=lambda m: m.failed == 1)
+    assert len(sink.calls) == 3
+    assert (m.sent, m.retried, m.failed) == (0, 2, 1)
+    assert m.last_error == "ConnectionError: down"
+
+
+def test_permanent_errors_are_not_retried():
+    sink = StubSink(fail=lambda emails: PermanentMailError("HTTP 400"))
+    m = run(sink, lambda m: queue(m, "a@x.io"), settled=lambda m: m.failed == 1)
+    assert sink.calls == [["a@x.io"]]
+    assert (m.retried, m.failed) == (0, 1)
+
+
+def test_a_rejected_batch_is_resent_one_email_at_a_time():
+    def reject_bad(emails):
+        if any(email.to.startswith("bad") for email in emails):
+            return PermanentMailError("HTTP 400 invalid recipient")
+        return None
+
+    sink = StubSink(fail=reject_bad)
+    m = run(sink, lambda m: queue(m, "a@x.io", "bad@x.io", "c@x.io"), settled=lambda m: m.sent + m.failed == 3)
+    assert sink.calls == [["a@x.io", "bad@x.io", "c@x.io"], ["a@x.io"], ["bad@x.io"], ["c@x.io"]]
+    assert (m.sent, m.failed, m.retried) == (2, 1, 0)
+
+
+def test_a_transient_failure_while_resending_alone_is_still_retried():
+    attempts = {"b@x.io": 0}
+
+    def fail(emails):
+        if len(emails) > 1:
+            return PermanentMailError("HTTP 400")
+        if emails[0].to == "b@x.io":
+            attempts["b@x.io"] += 1
+            return ConnectionError("reset") if attempts["b@x.io"] == 1 else None
+        return None
+
+    sink = StubSink(fail=fail)
+    m = run(sink, lambda m: queue(m, "a@x.io", "b@x.io"), settled=lambda m: m.sent == 2)
+    assert (m.sent, m.failed, m.retried) == (2, 0, 1)
+
+
+def test_invalid_addresses_are_refused_before_queueing():
+    sink = StubSink()
+    results = []
+    m = run(sink, lambda m: results.extend(queue(m, "not-an-email", "a@b", "two@@x.io", "sp ace@x.io", "ok@x.io")),
+            settled=lambda m: m.sent == 1)
+    assert results == [False, False, False, False, True]
+    assert sink.calls == [["ok@x.io"]]
+    assert m.rejected == 4
+
+
+def test_a_full_queue_drops_new_emails():
+    async def main():
+        m = Mailer(StubSink(), 2, 1, 50, 3)
+        # Not started: nothing drains the queue
+        m._queue = asyncio.Queue(maxsize=2)
+        m._tasks = [asyncio.get_running_loop().create_future()]
+        return m, queue(m, "a@x.io", "b@x.io", "c@x.io")
+
+    m, results = asyncio.run(main())
+    assert results == [True, True, False]
+    assert m.dropped == 1
+
+
+def test_brevo_batches_use_message_versions_and_map_client_errors():
+    sib_api_v3_sdk = pytest.importorskip("sib_api_v3_sdk")
+    from sib_api_v3_sdk.rest import ApiException
+
+    sent = []
+
+    class StubApi:
+        status = None
+
+        def send_transac_email(self, message):
+            sent.append(message)
+            if self.status is not None:
+                raise ApiException(status=self.status, reason="stub")
+
+    sink = BrevoSink.__new__(BrevoSink)
+    sink._api = StubApi()
+    sink._sender = {"email": "noreply@x.io", "name": "Test"}
+    emails = [mailer.Email(to, "Your code", TEMPLATE, {"code": to[0]}) for to in ("a@x.io", "b@x.io")]
+
+    sink.send(emails)
+    assert isinstance(sent[0], sib_api_v3_sdk.SendSmtpEmail)
+    assert [version.to for version in sent[0].message_versions] == [[{"email": "a@x.io"}], [{"email": "b@x.io"}]]
+    assert [version.params for version in sent[0].message_versions] == [{"code": "a"}, {"code": "b"}]
+
+    sink._api.status = 400
+    with pytest.raises(PermanentMailError):
+        sink.send(emails[:1])
+    sink._api.status = 429
+    with pytest.raises(ApiException):
+        sink.send(emails[:1])
+    sink._api.status = 502
+    with pytest.raises(ApiException):
+        sink.send(emails[:1])
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from embeddings import embedding_registry
+from session_store import create_session_store
+
+DIMENSION = 16
+
+
+class StubEmbeddings(Embeddings):
+    """Random vectors, so sessions can be built and reloaded without loading a model."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return np.random.default_rng(abs(hash(text))).random(DIMENSION).tolist()
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    # Reloaded sessions look their model up by the name saved in meta.json
+    return embedding_registry.register("stub-embeddings", StubEmbeddings())
+
+
+def session(embeddings, session_id, chunks=50):
+    rng = np.random.default_rng(len(session_id) + chunks)
+    texts = [f"{session_id} chunk {n}" for n in range(chunks)]
+    return FAISS.from_embeddings(
+        [(text, rng.random(DIMENSION).tolist()) for text in texts],
+        embedding=embeddings,
+        metadatas=[{"source": f"{session_id}.pdf", "page": n // 10} for n in range(chunks)],
+        ids=[f"{session_id}-doc:{n}" for n in range(chunks)],
+    )
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_a_session_reloads_from_disk_with_the_same_chunks(tmp_path, embeddings, use_mmap):
+    store = create_session_store("local", tmp_path, persist=True, use_mmap=use_mmap)
+    store["s1"] = session(embeddings, "s1")
+    store.set_history("s1", [("What is this?", "A test.")])
+    saved = store["s1"]
+    ids = dict(saved.index_to_docstore_id)
+
+    # A restarted process: nothing resident, everything read back from the session directory
+    reloaded = create_session_store("local", tmp_path, persist=True, use_mmap=use_mmap)
+    restored = reloaded["s1"]
+    assert restored.index.ntotal == saved.index.ntotal == 50
+    assert restored.index_to_docstore_id == ids
+    assert restored.docstore.search("s1-doc:7").page_content == "s1 chunk 7"
+    assert reloaded.get_history("s1") == [("What is this?", "A test.")]
+    assert reloaded.loads == 1
+
+
+def test_the_least_recently_used_session_is_evicted_past_the_memory_budget(tmp_path, embeddings):
+    store = create_session_store("local", tmp_path, persist=True, use_mmap=False)
+    store["s1"] = session(embeddings, "s1")
+    # Room for two sessions of this size, not three
+    store.memory_budget_bytes = int(store.session_bytes("s1") * 2.5)
+    store["s2"] = session(embeddings, "s2")
+    store["s1"]
+    store["s3"] = session(embeddings, "s3")
+
+    assert store.evictions == {"memory": 1, "idle": 0}
+    assert store.resident_count() == 2
+    assert store.memory_bytes() <= store.memory_budget_bytes
+    stats = store.stats()
+    assert "s2" not in {entry["session_id"] for entry in stats["sessions"]}
+
+    # Evicted sessions spill to disk and come back on the next request
+    assert "s2" in store
+    assert store["s2"].index.ntotal == 50
+    assert store.loads == 1
+    assert store.evictions["memory"] == 2
+
+
+def test_sessions_idle_past_the_ttl_are_evicted(tmp_path, embeddings):
+    store = create_session_store("local", tmp_path, persist=True, use_mmap=False, idle_ttl=60)
+    store["idle"] = session(embeddings, "idle")
+    store["busy"] = session(embeddings, "busy")
+    store._last_access["idle"] -= 120
+
+    assert store.evict_idle() == 1
+    assert store.evictions == {"memory": 0, "idle": 1}
+    assert store.resident_count() == 1
+    assert store["idle"].index.ntotal == 50
+
+
+def test_without_persistence_an_evicted_session_is_gone(tmp_path, embeddings):
+    store = create_session_store("local", tmp_path, persist=False, idle_ttl=60)
+    store["s1"] = session(embeddings, "s1")
+    store._last_access["s1"] -= 120
+
+    assert store.evict_idle() == 1
+    assert "s1" not in store
+    assert store.dropped == 1
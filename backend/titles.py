@@ -0,0 +1,146 @@
+"""
+Extractive conversation titles.
+
+Conversations are named after their PDFs. Most PDFs already carry a usable title
+in their metadata, their outline or the first lines of the first page, and
+keyphrases of the chunks describe the rest, so titles are worked out locally in
+milliseconds. Every local title has a confidence; the LLM is only asked when the
+best local title is below TITLE_MIN_CONFIDENCE.
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, List, Optional, Tuple
+
+# TITLE CONFIG
+# Local titles at or above this confidence are used without an LLM call (0 never calls the LLM, above 1 always does)
+TITLE_MIN_CONFIDENCE = float(os.getenv("TITLE_MIN_CONFIDENCE", "0.6"))
+# Chunks of a session scanned for keyphrases (from its first document onwards)
+TITLE_SAMPLE_CHUNKS = 200
+MAX_TITLE_LENGTH = 60
+
+# How much each kind of local title can be trusted
+SOURCE_CONFIDENCE = {"metadata": 0.9, "outline": 0.75, "heading": 0.65, "keyphrases": 0.4}
+
+STOPWORDS = set("""
+a about above after again against all also an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just may me might more most must my no nor not now of off on once only
+or other our ours out over own same she should so some such than that the their theirs them then there these
+they this those through to too under until up very was we were what when where which while who whom why will
+with would you your yours chapter section page figure table example however therefore thus using used use
+le la les un une des du de et en est que qui dans pour par sur au aux avec ce ces cette son sa ses sont pas plus
+ou mais nous vous ils elles leur leurs comme tout tous aussi être avoir fait peut entre chapitre partie
+""".split())
+
+# Titles document producers leave in metadata that say nothing about the content
+_PLACEHOLDER_TITLE = re.compile(r"^(untitled|sans titre|document\s*\d*|presentation\s*\d*|slide\s*\d+|title|none)$", re.I)
+_FILE_NAME = re.compile(r"^[\w\-. ]+\.(pdf|docx?|pptx?|odt|tex|txt|rtf)$", re.I)
+
+
+def _clean(title: str) -> str:
+    title = re.sub(r"\s+", " ", title).strip()
+    title = re.sub(r"^Microsoft (Word|PowerPoint) - ", "", title)
+    title = re.sub(r"\.(pdf|docx?|pptx?|odt|tex)$", "", title, flags=re.I)
+    title = title.strip(" \"'-_:;,.")
+    if len(title) > MAX_TITLE_LENGTH:
+        title = title[:MAX_TITLE_LENGTH - 3].rstrip() + "..."
+    return title
+
+
+def _plausible(title: Optional[str]) -> bool:
+    if not title:
+        return False
+    title = title.strip()
+    if _PLACEHOLDER_TITLE.match(title) or _FILE_NAME.match(title):
+        return False
+    words = title.split()
+    if not 1 <= len(words) <= 15 or len(title) > 150:
+        return False
+    # Needs real words, not codes like "DOC-2021-0042"
+    return len(re.findall(r"[^\W\d_]{3,}", title)) >= 1 and "_" not in title
+
+
+def first_page_heading(text: str) -> Optional[str]:
+    """A heading-like line among the first lines of a page, if there is one."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines[:8]:
+        words = line.split()
+        if not re.search(r"[^\W\d_]{3,}", line) or "@" in line or "http" in line.lower():
+            # Page numbers, dates, author emails and links
+            continue
+        if not 2 <= len(words) <= 12 or line.endswith((".", ",", ";")):
+            continue
+        capitalised = sum(1 for word in words if word[:1].isupper() or not word[:1].isalpha())
+        if line.isupper() or capitalised / len(words) >= 0.6:
+            return _clean(line)
+    return None
+
+
+def pdf_title(path: str, first_page_text: str) -> Optional[Tuple[str, str]]:
+    """Best title a PDF gives about itself, as (title, source) with source metadata, outline or heading."""
+    try:
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        metadata_title = reader.metadata.title if reader.metadata else None
+        if _plausible(metadata_title) and _clean(metadata_title):
+            return _clean(metadata_title), "metadata"
+        # A single top-level outline entry is usually the document title (several are chapters)
+        roots = [item for item in reader.outline if not isinstance(item, list)]
+        if len(roots) == 1 and _plausible(getattr(roots[0], "title", None)):
+            return _clean(roots[0].title), "outline"
+    except Exception as e:
+        print(f"[WARN] Could not read PDF metadata of {os.path.basename(path)}: {e}")
+    heading = first_page_heading(first_page_text)
+    if heading:
+        return heading, "heading"
+    return None
+
+
+def keyphrase_title(texts: List[str], max_words: int = 6) -> Optional[str]:
+    """Title made of the most characteristic words and word pairs of the chunks (TF-IDF over chunks)."""
+    term_counts: Counter = Counter()
+    chunk_counts: Counter = Counter()
+    for text in texts:
+        words = re.findall(r"[^\W\d_]{3,}", text.lower())
+        terms = [word for word in words if word not in STOPWORDS]
+        terms += [f"{a} {b}" for a, b in zip(words, words[1:]) if a not in STOPWORDS and b not in STOPWORDS and a != b]
+        counts = Counter(terms)
+        term_counts.update(counts)
+        chunk_counts.update(counts.keys())
+    if not term_counts:
+        return None
+
+    chunks = len(texts)
+    scores = {
+        # Word pairs are more descriptive than single words
+        term: count * math.log(1 + chunks / chunk_counts[term]) * (1.5 if " " in term else 1.0)
+        for term, count in term_counts.items()
+        if count >= 2
+    }
+    phrases: List[str] = []
+    words_used: set = set()
+    for term in sorted(scores, key=scores.get, reverse=True):
+        words = set(term.split())
+        # "Cellular Respiration, Respiration Rate" repeats itself
+        if words & words_used:
+            continue
+        if len(words_used) + len(words) > max_words:
+            break
+        phrases.append(term)
+        words_used |= words
+        if len(phrases) == 3:
+            break
+    return _clean(", ".join(phrase.title() for phrase in phrases)) if phrases else None
+
+
+def local_title(chunks: List[Any]) -> Tuple[Optional[str], float]:
+    """Best local title for a session's chunks (in upload order) and its confidence."""
+    for chunk in chunks:
+        metadata = getattr(chunk, "metadata", None) or {}
+        if metadata.get("title"):
+            return metadata["title"], SOURCE_CONFIDENCE.get(metadata.get("title_source"), 0.5)
+    title = keyphrase_title([chunk.page_content for chunk in chunks])
+    return title, SOURCE_CONFIDENCE["keyphrases"] if title else 0.0
@@ -0,0 +1,335 @@
+"""
+FAISS index tiering by session size, with optional vector compression.
+
+Small sessions keep an exact flat index. Once a session grows past
+ANN_MIN_CHUNKS it is rebuilt in the background as an approximate index (HNSW by
+default, or IVF), and IVF indexes are retrained when the session has grown
+enough that their coarse clustering is too small for it. Search-time knobs
+(efSearch, nprobe) are applied whenever an index is built or loaded.
+
+With VECTOR_COMPRESSION=sq8 (int8 scalar quantization, 4x smaller) or pq
+(product quantization, 32x smaller) the index searches compressed codes and
+re-ranks the best VECTOR_RERANK_FACTOR * k candidates against the exact float32
+vectors. Those are kept in the same index file and memory-mapped, so only the
+rows being re-ranked are paged in.
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# ANN INDEX CONFIG
+# Sessions with at least this many chunks are moved to an approximate index (0 disables)
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "20000"))
+# "hnsw" or "ivf"
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "hnsw").lower()
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "80"))
+ANN_HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+ANN_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "16"))
+# Retrain an IVF index once the ideal number of lists is this many times what it was trained with
+ANN_IVF_RETRAIN_FACTOR = float(os.getenv("ANN_IVF_RETRAIN_FACTOR", "2"))
+
+# "none", "sq8" (int8 scalar quantization) or "pq" (product quantization)
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none").lower()
+# Candidates re-ranked with exact vectors per result (0 disables re-ranking)
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+# PQ sub-quantizers (bytes per vector); 48 splits a 384-dim MiniLM vector into 8-dim pieces
+VECTOR_PQ_M = int(os.getenv("VECTOR_PQ_M", "48"))
+# Smaller sessions use sq8 instead of pq, PQ codebooks need enough training points
+VECTOR_PQ_MIN_CHUNKS = int(os.getenv("VECTOR_PQ_MIN_CHUNKS", "10000"))
+
+# FAISS needs at least ~39 training points per list
+IVF_TRAINING_POINTS_PER_LIST = 64
+# Vectors sampled to train quantizers (at least this many, when available)
+TRAINING_SAMPLE_SIZE = 16384
+COMPRESSIONS = ("none", "sq8", "pq")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_scheduled: Set[str] = set()
+_lock = threading.Lock()
+
+
+def _base_index(index: Any) -> Any:
+    """The searching part of an index, below any exact re-ranking layer.
+
+    Returns a non-owning view: the caller must keep the original index alive.
+    """
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.downcast_index(index.base_index)
+    return index
+
+
+def has_rerank(index: Any) -> bool:
+    import faiss
+
+    return isinstance(faiss.downcast_index(index), faiss.IndexRefine)
+
+
+def index_tier(index: Any) -> str:
+    """Tier of an index: "flat", "hnsw" or "ivf"."""
+    import faiss
+
+    index = _base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_compression(index: Any) -> str:
+    """Vector encoding of an index: "none", "sq8" or "pq"."""
+    import faiss
+
+    index = _base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "none"
+
+
+def desired_compression(ntotal: int, compression: Optional[str] = None) -> str:
+    compression = compression or VECTOR_COMPRESSION
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown VECTOR_COMPRESSION: {compression!r} (expected one of {', '.join(COMPRESSIONS)})")
+    if compression == "pq" and ntotal < VECTOR_PQ_MIN_CHUNKS:
+        return "sq8"
+    return compression
+
+
+def ideal_nlist(ntotal: int) -> int:
+    """Number of IVF lists for a collection of this size (about 4 * sqrt(n))."""
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // IVF_TRAINING_POINTS_PER_LIST))
+
+
+def target_layout(index: Any, min_chunks: Optional[int] = None, kind: Optional[str] = None,
+                  compression: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """The (tier, compression) an index should be rebuilt as, or None if it is fine as it is."""
+    min_chunks = ANN_MIN_CHUNKS if min_chunks is None else min_chunks
+    kind = kind or ANN_INDEX_TYPE
+    ntotal = index.ntotal
+    if ntotal == 0:
+        return None
+    wanted_compression = desired_compression(ntotal, compression)
+    current = index_tier(index)
+    wanted_kind = current
+    if current == "flat" and min_chunks and ntotal >= min_chunks:
+        wanted_kind = kind
+        if wanted_compression == "pq" and wanted_kind == "hnsw":
+            # HNSW graphs built on PQ distances lose too much recall, IVF-PQ holds up much better
+            wanted_kind = "ivf"
+    elif current == "ivf" and ideal_nlist(ntotal) >= _base_index(index).nlist * ANN_IVF_RETRAIN_FACTOR:
+        # Retrain: the coarse clustering is too small for the session now
+        return "ivf", wanted_compression
+    wanted_rerank = wanted_compression != "none" and VECTOR_RERANK_FACTOR > 0
+    if (wanted_kind, wanted_compression, wanted_rerank) == (current, index_compression(index), has_rerank(index)):
+        return None
+    return wanted_kind, wanted_compression
+
+
+def reconstruct_vectors(index: Any) -> np.ndarray:
+    """All vectors stored in an index, in row order."""
+    import faiss
+
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if has_rerank(index):
+        # The re-ranking layer holds the exact vectors
+        index = faiss.downcast_index(index)
+        return index.refine_index.reconstruct_n(0, index.ntotal)
+    # IVF indexes reconstruct through the direct map configure_search built
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def reconstruct_rows(index: Any, rows: Sequence[int]) -> np.ndarray:
+    """Vectors of some rows of an index (exact ones when the index keeps them for re-ranking).
+
+    Only reads the index, so it is safe on one that other threads are searching.
+    """
+    import faiss
+
+    if not rows:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if has_rerank(index):
+        index = faiss.downcast_index(index).refine_index
+    return np.vstack([index.reconstruct(int(row)) for row in rows])
+
+
+def configure_search(index: Any) -> Any:
+    """Apply the configured search-time parameters to an index.
+
+    Called on every index that is built, loaded or copied, before anything
+    searches it. IVF indexes also get their direct map here: reconstructing
+    rows needs one, and building it later would modify an index other threads
+    are searching.
+    """
+    import faiss
+
+    base = _base_index(index)
+    tier = index_tier(index)
+    if tier == "hnsw":
+        base.hnsw.efSearch = ANN_HNSW_EF_SEARCH
+    elif tier == "ivf":
+        base.nprobe = ANN_IVF_NPROBE
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.no():
+            ivf.make_direct_map()
+    if has_rerank(index):
+        faiss.downcast_index(index).k_factor = max(1, VECTOR_RERANK_FACTOR)
+    return index
+
+
+def _pq_m(dimension: int) -> int:
+    # The number of sub-quantizers must divide the dimension
+    m = max(1, min(VECTOR_PQ_M, dimension))
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors: np.ndarray, kind: str, metric: Optional[int] = None,
+                compression: str = "none", rerank: Optional[bool] = None) -> Any:
+    """Build a "flat", "hnsw" or "ivf" index over the given vectors (row order is kept).
+
+    Compressed indexes get an exact re-ranking layer unless rerank is False.
+    """
+    import faiss
+
+    metric = faiss.METRIC_L2 if metric is None else metric
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    sq8 = faiss.ScalarQuantizer.QT_8bit
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown vector compression: {compression!r}")
+    if kind == "hnsw":
+        if compression == "sq8":
+            index = faiss.IndexHNSWSQ(dimension, sq8, ANN_HNSW_M, metric)
+        elif compression == "pq":
+            index = faiss.IndexHNSWPQ(dimension, _pq_m(dimension), ANN_HNSW_M, 8, metric)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, ANN_HNSW_M, metric)
+        index.hnsw.efConstruction = ANN_HNSW_EF_CONSTRUCTION
+    elif kind == "ivf":
+        nlist = ideal_nlist(len(vectors))
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if compression == "sq8":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, sq8, metric)
+        elif compression == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_m(dimension), 8, metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+    elif kind == "flat":
+        if compression == "sq8":
+            index = faiss.IndexScalarQuantizer(dimension, sq8, metric)
+        elif compression == "pq":
+            index = faiss.IndexPQ(dimension, _pq_m(dimension), 8, metric)
+        else:
+            index = faiss.IndexFlat(dimension, metric)
+    else:
+        raise ValueError(f"Unknown index type: {kind!r}")
+
+    if not index.is_trained:
+        # Training on a sample is as good as training on everything and much faster
+        nlist = ideal_nlist(len(vectors)) if kind == "ivf" else 0
+        sample_size = min(len(vectors), max(TRAINING_SAMPLE_SIZE, nlist * IVF_TRAINING_POINTS_PER_LIST))
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        index.train(sample)
+
+    if rerank is None:
+        rerank = VECTOR_RERANK_FACTOR > 0
+    if compression != "none" and rerank:
+        index = faiss.IndexRefineFlat(index)
+    index.add(vectors)
+    return configure_search(index)
+
+
+def rebuild_index(index: Any, kind: str, compression: str = "none", rerank: Optional[bool] = None) -> Any:
+    """Copy an index's vectors into a new index of another layout."""
+    return build_index(reconstruct_vectors(index), kind, metric=index.metric_type,
+                       compression=compression, rerank=rerank)
+
+
+def supports_removal(index: Any) -> bool:
+    """Whether rows can be removed in place with later rows shifting down.
+
+    HNSW graphs cannot drop nodes, IVF removal keeps the original ids (which
+    would break the row -> docstore id mapping of the LangChain store) and the
+    re-ranking layer does not implement removal at all.
+    """
+    return index_tier(index) == "flat" and not has_rerank(index)
+
+
+def vector_bytes(index: Any, mapped: bool = False) -> Tuple[int, int]:
+    """Approximate (heap, memory-mapped) bytes per vector of an index.
+
+    Codes, exact re-ranking vectors included, stay in the index file when it is
+    memory-mapped and are paged in as they are searched; HNSW graph links are
+    always read onto the heap, as is the IVF direct map.
+    """
+    import faiss
+
+    base = _base_index(index)
+    links = 0
+    if index_tier(index) == "hnsw":
+        # Stored vectors plus 2 * M neighbour ids on the base level (upper levels are small)
+        codes = faiss.downcast_index(base.storage).sa_code_size()
+        links = base.hnsw.nb_neighbors(0) * 4 + 16
+    else:
+        try:
+            codes = base.sa_code_size()
+        except RuntimeError:
+            codes = base.d * 4
+        if index_tier(index) == "ivf":
+            # The direct map configure_search builds: one 64-bit list position per vector
+            links = 8
+    if has_rerank(index):
+        codes += index.d * 4
+    return (links, codes) if mapped else (links + codes, 0)
+
+
+def bytes_per_vector(index: Any) -> int:
+    """Approximate bytes per vector wherever they are kept (heap or memory map), HNSW links included."""
+    return sum(vector_bytes(index))
+
+
+def schedule_rebuild(key: str, rebuild: Callable[[], None]) -> bool:
+    """Run a rebuild on the background thread unless one is already queued for this key."""
+    global _executor
+    with _lock:
+        if key in _scheduled:
+            return False
+        _scheduled.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-rebuild")
+        executor = _executor
+
+    def run() -> None:
+        try:
+            rebuild()
+        except Exception as e:
+            print(f"[ERROR] Index rebuild for {key} failed: {e}")
+        finally:
+            with _lock:
+                _scheduled.discard(key)
+
+    executor.submit(run)
+    return True
+
+
+def shutdown_rebuilds() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+        _scheduled.clear()
+    if executor is not None:
+        executor.shutdown(wait=False)
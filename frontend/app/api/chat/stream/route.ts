@@ -0,0 +1,151 @@
+import { NextRequest, NextResponse } from 'next/server'
+import { getAuthenticatedUser } from '@/lib/supabase/server-auth'
+import { createChatMessageServer } from '@/lib/supabase/database-server'
+
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
+
+/**
+ * POST /api/chat/stream
+ *
+ * Proxies streaming chat requests to FastAPI backend as server-sent events
+ * (sources, token..., done | error) and saves both messages once the answer is complete
+ *
+ * Expected request body:
+ * {
+ *   message: string
+ *   sessionId: string
+ *   conversationId?: string
+ * }
+ */
+export async function POST(request: NextRequest) {
+  try {
+    // Check authentication
+    const user = await getAuthenticatedUser(request)
+    if (!user) {
+      return NextResponse.json(
+        { error: 'Unauthorized. Please sign in to send messages.' },
+        { status: 401 }
+      )
+    }
+
+    const body = await request.json()
+    const { message, sessionId, conversationId } = body
+
+    if (!message) {
+      return NextResponse.json(
+        { error: 'Message is required' },
+        { status: 400 }
+      )
+    }
+
+    if (!sessionId) {
+      return NextResponse.json(
+        { error: 'Session ID is required. Please upload a PDF first.' },
+        { status: 400 }
+      )
+    }
+
+    let response
+    try {
+      response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          question: message,
+          session_id: sessionId,
+          conversation_id: conversationId,
+        }),
+        signal: request.signal,
+      })
+    } catch (fetchError: any) {
+      if (fetchError.code === 'ECONNREFUSED' || fetchError.code === 'ECONNRESET') {
+        return NextResponse.json(
+          { error: 'Cannot connect to backend server. Please make sure the FastAPI server is running.' },
+          { status: 503 }
+        )
+      }
+      throw fetchError
+    }
+
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
+      return NextResponse.json(
+        { error: error.detail || 'Failed to process message' },
+        { status: response.status }
+      )
+    }
+
+    // Pass events through untouched while watching for the final "done" event
+    const decoder = new TextDecoder()
+    let buffered = ''
+    let finalAnswer: any = null
+
+    const collectEvents = (text: string) => {
+      buffered += text
+      let boundary = buffered.indexOf('\n\n')
+      while (boundary !== -1) {
+        const rawEvent = buffered.slice(0, boundary)
+        buffered = buffered.slice(boundary + 2)
+        if (rawEvent.startsWith('event: done')) {
+          const dataLine = rawEvent.split('\n').find((line) => line.startsWith('data: '))
+          if (dataLine) {
+            finalAnswer = JSON.parse(dataLine.slice(6))
+          }
+        }
+        boundary = buffered.indexOf('\n\n')
+      }
+    }
+
+    const passThrough = new TransformStream<Uint8Array, Uint8Array>({
+      transform(chunk, controller) {
+        controller.enqueue(chunk)
+        collectEvents(decoder.decode(chunk, { stream: true }))
+      },
+      async flush() {
+        if (!conversationId || !finalAnswer) {
+          return
+        }
+        // Save user message and assistant response to database
+        await createChatMessageServer(
+          request,
+          conversationId,
+          user.id,
+          'user',
+          message
+        ).catch(err => console.error('Error saving user message:', err))
+        await createChatMessageServer(
+          request,
+          conversationId,
+          user.id,
+          'assistant',
+          finalAnswer.content,
+          finalAnswer.sources || null
+        ).catch(err => console.error('Error saving assistant message:', err))
+      },
+    })
+
+    return new Response(response.body.pipeThrough(passThrough), {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+      },
+    })
+  } catch (error: any) {
+    console.error('Chat stream API error:', error)
+
+    if (error.message?.includes('ECONNREFUSED') || error.message?.includes('ECONNRESET')) {
+      return NextResponse.json(
+        { error: 'Backend server is not running. Please start the FastAPI server.' },
+        { status: 503 }
+      )
+    }
+
+    return NextResponse.json(
+      { error: error.message || 'Failed to process message' },
+      { status: 500 }
+    )
+  }
+}
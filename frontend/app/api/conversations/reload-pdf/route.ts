@@ -10,6 +10,9 @@ const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
  * 
  * Reloads a PDF from Supabase Storage and processes it in the backend
  * to recreate the vector store for quiz/flashcards functionality
+ *
+ * A saved session is returned right away (200); otherwise the PDF is queued and
+ * the ingestion job id is returned (202) for the browser to poll at /api/upload/[jobId].
  */
 export async function POST(request: NextRequest) {
   try {
@@ -31,6 +34,26 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ error: 'PDF not found' }, { status: 404 })
     }
 
+    // Reuse the persisted vector store if the backend still has it (no re-embedding needed)
+    if (pdf.vector_store_session_id) {
+      try {
+        const sessionResponse = await fetch(
+          `${BACKEND_URL}/api/sessions/${encodeURIComponent(pdf.vector_store_session_id)}`,
+          { signal: AbortSignal.timeout(10000) }
+        )
+        if (sessionResponse.ok) {
+          const sessionData = await sessionResponse.json()
+          return NextResponse.json({
+            session_id: sessionData.session_id,
+            chunks_count: sessionData.chunks_count,
+            message: 'PDF session restored from saved index',
+          })
+        }
+      } catch (sessionError) {
+        console.error('Error checking saved session, reprocessing PDF:', sessionError)
+      }
+    }
+
     if (!pdf.storage_path) {
       return NextResponse.json({ error: 'PDF not stored in Supabase Storage' }, { status: 404 })
     }
@@ -53,7 +76,7 @@ export async function POST(request: NextRequest) {
 
     // Forward to FastAPI backend for processing
     const controller = new AbortController()
-    const timeoutId = setTimeout(() => controller.abort(), 120000) // 2 minute timeout
+    const timeoutId = setTimeout(() => controller.abort(), 60000) // 1 minute timeout (the PDF is only queued here)
 
     try {
       const response = await fetch(`${BACKEND_URL}/api/upload`, {
@@ -62,9 +85,8 @@ export async function POST(request: NextRequest) {
         signal: controller.signal,
       })
 
-      clearTimeout(timeoutId)
-
       if (!response.ok) {
+        clearTimeout(timeoutId)
         const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
         return NextResponse.json(
           { error: error.detail || 'Failed to process PDF' },
@@ -72,20 +94,23 @@ export async function POST(request: NextRequest) {
         )
       }
 
-      const data = await response.json()
+      // The backend queues the PDF and returns a job id; the browser polls it
+      const queued = await response.json()
+      clearTimeout(timeoutId)
 
-      // Update PDF with new session ID
-      if (pdf.id && data.session_id) {
+      // Update PDF with new session ID (a failed job leaves no session, so the next load queues it again)
+      if (pdf.id && queued.session_id) {
         await updatePDFServer(request, pdf.id, {
-          vector_store_session_id: data.session_id,
+          vector_store_session_id: queued.session_id,
         })
       }
 
       return NextResponse.json({
-        session_id: data.session_id,
-        chunks_count: data.chunks_count,
-        message: 'PDF reloaded and processed successfully',
-      })
+        job_id: queued.job_id,
+        session_id: queued.session_id,
+        status: queued.status,
+        message: 'PDF queued for processing',
+      }, { status: 202 })
     } catch (fetchError: any) {
       clearTimeout(timeoutId)
       
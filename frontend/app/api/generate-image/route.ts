@@ -75,17 +75,22 @@ export async function POST(request: NextRequest) {
       )
     }
 
-    // Backend returns image as base64 data URL
-    const imageDataUrl = data.image_url
+    // Backend returns the path of the cached image (GET /api/images/{id} on the backend)
+    const imagePath: string = data.image_url
     
-    // Convert base64 data URL to blob and upload to Supabase Storage
-    let storedImageUrl = imageDataUrl // Fallback to base64 if upload fails
+    // Upload the image to Supabase Storage; until then it is served through /api/images/{id} here
+    let storedImageUrl = imagePath
     
-    if (imageDataUrl && imageDataUrl.startsWith('data:image')) {
+    if (imagePath && imagePath.startsWith('/api/images/')) {
       try {
-        // Extract base64 data from data URL
-        const base64Data = imageDataUrl.split(',')[1]
-        const imageBuffer = Buffer.from(base64Data, 'base64')
+        const imageResponse = await fetch(`${BACKEND_URL}${imagePath}`, {
+          signal: AbortSignal.timeout(30000),
+        })
+        if (!imageResponse.ok) {
+          throw new Error(`Backend returned ${imageResponse.status} for ${imagePath}`)
+        }
+        const contentType = imageResponse.headers.get('content-type') || 'image/png'
+        const imageBuffer = Buffer.from(await imageResponse.arrayBuffer())
         
         // Create Supabase client
         const supabase = createServerClient(
@@ -105,13 +110,14 @@ export async function POST(request: NextRequest) {
         
         // Generate unique filename
         const timestamp = Date.now()
-        const fileName = `${user.id}/${timestamp}-generated.png`
+        const extension = contentType.split('/')[1]?.replace('jpeg', 'jpg') || 'png'
+        const fileName = `${user.id}/${timestamp}-generated.${extension}`
         
         // Upload to Supabase Storage
         const { data: uploadData, error: uploadError } = await supabase.storage
           .from('generated-images')
           .upload(fileName, imageBuffer, {
-            contentType: 'image/png',
+            contentType,
             upsert: true,
           })
         
@@ -142,11 +148,11 @@ export async function POST(request: NextRequest) {
           }
         } else {
           console.error('Error uploading image to storage:', uploadError)
-          // Continue with base64 URL if upload fails
+          // Continue with the backend image URL if upload fails
         }
       } catch (storageError) {
         console.error('Error processing image for storage:', storageError)
-        // Continue with base64 URL if processing fails
+        // Continue with the backend image URL if processing fails
       }
     }
 
@@ -0,0 +1,52 @@
+import { NextRequest, NextResponse } from 'next/server'
+
+const BACKEND_URL = process.env.BACKEND_URL || process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8000'
+
+// Headers passed through in both directions so ETag revalidation and range requests keep working
+const REQUEST_HEADERS = ['if-none-match', 'range', 'if-range']
+const RESPONSE_HEADERS = ['content-type', 'content-length', 'content-range', 'accept-ranges', 'etag', 'cache-control', 'last-modified']
+
+/**
+ * GET /api/images/[id]
+ * Serve a generated image from the backend image cache
+ */
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  const { id } = await params
+  if (!/^[0-9a-f]{32}$/.test(id)) {
+    return NextResponse.json({ error: 'Image not found' }, { status: 404 })
+  }
+
+  const headers: Record<string, string> = {}
+  for (const name of REQUEST_HEADERS) {
+    const value = request.headers.get(name)
+    if (value) headers[name] = value
+  }
+
+  let response
+  try {
+    response = await fetch(`${BACKEND_URL}/api/images/${id}`, {
+      headers,
+      signal: AbortSignal.timeout(30000),
+    })
+  } catch (fetchError: any) {
+    console.error('Error fetching image from backend:', fetchError)
+    return NextResponse.json(
+      { error: 'Failed to connect to backend. Make sure the backend is running.' },
+      { status: 503 }
+    )
+  }
+
+  const responseHeaders = new Headers()
+  for (const name of RESPONSE_HEADERS) {
+    const value = response.headers.get(name)
+    if (value) responseHeaders.set(name, value)
+  }
+  // Stream the body instead of buffering the image
+  return new NextResponse(response.status === 304 ? null : response.body, {
+    status: response.status,
+    headers: responseHeaders,
+  })
+}
@@ -9,6 +9,7 @@ const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
  * Expected request body:
  * {
  *   sessionId: string
+ *   regenerate?: boolean  // ignore the cached study pack and generate again
  * }
  * 
  * Expected response:
@@ -26,7 +27,7 @@ const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json()
-    const { sessionId } = body
+    const { sessionId, regenerate } = body
 
     if (!sessionId) {
       return NextResponse.json(
@@ -48,6 +49,7 @@ export async function POST(request: NextRequest) {
         },
         body: JSON.stringify({
           session_id: sessionId,
+          regenerate: Boolean(regenerate),
         }),
         signal: controller.signal,
       })
@@ -0,0 +1,105 @@
+import { NextRequest, NextResponse } from 'next/server'
+import { IngestJobStatus } from '@/lib/ingest'
+import { getAuthenticatedUser } from '@/lib/supabase/server-auth'
+import { createChatMessageServer, updatePDFServer } from '@/lib/supabase/database-server'
+
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
+
+async function fetchJob(jobId: string): Promise<Response> {
+  return fetch(`${BACKEND_URL}/api/upload/${encodeURIComponent(jobId)}`, {
+    signal: AbortSignal.timeout(10000),
+  })
+}
+
+function backendError(error: any) {
+  if (error.name === 'AbortError' || error.name === 'TimeoutError') {
+    return NextResponse.json({ error: 'The backend did not answer in time' }, { status: 504 })
+  }
+  return NextResponse.json(
+    { error: 'Cannot connect to backend server. Please make sure the FastAPI server is running.' },
+    { status: 503 }
+  )
+}
+
+/**
+ * GET /api/upload/[jobId]
+ *
+ * Status of a PDF ingestion job, polled by the browser until it is done or failed
+ */
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ jobId: string }> }
+) {
+  const user = await getAuthenticatedUser(request)
+  if (!user) {
+    return NextResponse.json({ error: 'Unauthorized' }, { status: 401 })
+  }
+
+  const { jobId } = await params
+  try {
+    const response = await fetchJob(jobId)
+    const data = await response.json().catch(() => ({ detail: 'Unknown error' }))
+    if (!response.ok) {
+      return NextResponse.json({ error: data.detail || 'Failed to get upload status' }, { status: response.status })
+    }
+    return NextResponse.json(data)
+  } catch (error: any) {
+    return backendError(error)
+  }
+}
+
+/**
+ * POST /api/upload/[jobId]
+ *
+ * Records a finished ingestion job in the database: the PDF's chunk count and
+ * the conversation's "PDF processed" system message
+ */
+export async function POST(
+  request: NextRequest,
+  { params }: { params: Promise<{ jobId: string }> }
+) {
+  const user = await getAuthenticatedUser(request)
+  if (!user) {
+    return NextResponse.json({ error: 'Unauthorized' }, { status: 401 })
+  }
+
+  const { jobId } = await params
+  const { conversationId, pdfId } = await request.json()
+  if (!conversationId) {
+    return NextResponse.json({ error: 'Conversation ID is required' }, { status: 400 })
+  }
+
+  let job: IngestJobStatus
+  try {
+    const response = await fetchJob(jobId)
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
+      return NextResponse.json({ error: error.detail || 'Failed to get upload status' }, { status: response.status })
+    }
+    job = await response.json()
+  } catch (error: any) {
+    return backendError(error)
+  }
+
+  if (job.status !== 'done') {
+    return NextResponse.json({ error: `Upload is ${job.status}, not done` }, { status: 409 })
+  }
+
+  if (pdfId) {
+    const { error: pdfError } = await updatePDFServer(request, pdfId, { chunks_count: job.chunks_count })
+    if (pdfError) {
+      console.error('Error saving PDF chunk count:', pdfError)
+    }
+  }
+
+  const systemMessage = `PDF "${job.filename}" uploaded and processed successfully. You can now ask questions about the document.`
+  await createChatMessageServer(
+    request,
+    conversationId,
+    user.id,
+    'system',
+    systemMessage
+  ).catch((err: any) => console.error('Error saving system message:', err))
+
+  return NextResponse.json({ ...job, conversation_id: conversationId })
+}
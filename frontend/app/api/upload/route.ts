@@ -1,6 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server'
 import { getAuthenticatedUser } from '@/lib/supabase/server-auth'
-import { createConversationServer, createPDFServer, createChatMessageServer, updateConversationServer } from '@/lib/supabase/database-server'
+import { createConversationServer, createPDFServer, updateConversationServer } from '@/lib/supabase/database-server'
 import { uploadPDFToStorage } from '@/lib/supabase/storage'
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
@@ -10,6 +10,9 @@ const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
  * 
  * Handles PDF file uploads and forwards to FastAPI backend
  * Also creates a conversation and saves PDF metadata to database
+ *
+ * Returns 202 with the backend's ingestion job id as soon as the PDF is queued;
+ * the browser polls /api/upload/[jobId] and posts there once the job is done.
  */
 export async function POST(request: NextRequest) {
   try {
@@ -60,7 +63,7 @@ export async function POST(request: NextRequest) {
     }
 
     const controller = new AbortController()
-    const timeoutId = setTimeout(() => controller.abort(), 120000) // 2 minute timeout
+    const timeoutId = setTimeout(() => controller.abort(), 60000) // 1 minute timeout (the PDF is only queued here)
 
     try {
       const response = await fetch(`${BACKEND_URL}/api/upload`, {
@@ -69,9 +72,8 @@ export async function POST(request: NextRequest) {
         signal: controller.signal,
       })
 
-      clearTimeout(timeoutId)
-
       if (!response.ok) {
+        clearTimeout(timeoutId)
         const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
         return NextResponse.json(
           { error: error.detail || 'Failed to upload PDF' },
@@ -79,7 +81,9 @@ export async function POST(request: NextRequest) {
         )
       }
 
+      // The backend queues the PDF and returns a job id; the browser polls it
       const data = await response.json()
+      clearTimeout(timeoutId)
       
       // Upload PDF to Supabase Storage
       let storagePath: string | null = null
@@ -140,8 +144,9 @@ export async function POST(request: NextRequest) {
         return NextResponse.json({
           ...data,
           conversation_id: null,
+          pdf_id: null,
           warning: dbError.message || 'PDF uploaded but failed to save to database',
-        }, { status: 200 })
+        }, { status: 202 })
       }
 
       // Upload PDF to Supabase Storage
@@ -160,15 +165,16 @@ export async function POST(request: NextRequest) {
         }
       }
 
-      // Save PDF metadata to database
+      // Save PDF metadata to database; the chunk count and system message are added when the job is done
+      let pdfId: string | null = null
       if (conversation) {
-        const { error: pdfError } = await createPDFServer(
+        const { data: pdf, error: pdfError } = await createPDFServer(
           request,
           conversation.id,
           user.id,
           file.name,
           file.size,
-          data.chunks_count || null,
+          null,
           data.session_id || null,
           storagePath
         )
@@ -176,22 +182,14 @@ export async function POST(request: NextRequest) {
         if (pdfError) {
           console.error('Error saving PDF:', pdfError)
         }
-
-        // Save system message to database
-        const systemMessage = `PDF "${file.name}" uploaded and processed successfully. You can now ask questions about the document.`
-        await createChatMessageServer(
-          request,
-          conversation.id,
-          user.id,
-          'system',
-          systemMessage
-        ).catch((err: any) => console.error('Error saving system message:', err))
+        pdfId = pdf?.id || null
       }
 
       return NextResponse.json({
         ...data,
         conversation_id: conversation?.id || null,
-      })
+        pdf_id: pdfId,
+      }, { status: 202 })
     } catch (fetchError: any) {
       clearTimeout(timeoutId)
       
@@ -9,6 +9,7 @@ import { MessageBubble } from './message-bubble'
 import { useSession } from '@/contexts/session-context'
 import { useAuth } from '@/contexts/auth-context'
 import { getUser } from '@/lib/supabase/database'
+import { waitForIngestJob } from '@/lib/ingest'
 import { toast } from 'sonner'
 
 interface ChatAreaProps {
@@ -157,7 +158,12 @@ export function ChatArea({ viewMode, sidebarOpen, onToggleSidebar, loadConversat
               if (!isSubscribed) return
               
               if (reloadResponse.ok) {
-                const reloadData = await reloadResponse.json()
+                let reloadData = await reloadResponse.json()
+                if (reloadData.job_id) {
+                  // The PDF is being processed again; poll its job before the session can be used
+                  reloadData = await waitForIngestJob('', reloadData.job_id)
+                  if (!isSubscribed) return
+                }
                 setSessionId(reloadData.session_id)
                 toast.success('Conversation and PDF loaded')
               } else {
@@ -242,7 +248,22 @@ export function ChatArea({ viewMode, sidebarOpen, onToggleSidebar, loadConversat
           throw new Error(error.error || 'Failed to upload PDF')
         }
 
-        const data = await response.json()
+        // The PDF is queued; poll its job until it is searchable
+        const queued = await response.json()
+        const job = await waitForIngestJob('', queued.job_id, {
+          onProgress: (status) => setUploadStatus(
+            `Processing ${file.name} (${i + 1}/${fileCount})... ${Math.round(status.progress * 100)}%`
+          ),
+        })
+        if (queued.conversation_id) {
+          // Record the chunk count and the "PDF processed" message now that the job is done
+          await fetch(`/api/upload/${encodeURIComponent(queued.job_id)}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ conversationId: queued.conversation_id, pdfId: queued.pdf_id }),
+          }).catch((error) => console.error('Error saving processed PDF:', error))
+        }
+        const data = { ...job, conversation_id: queued.conversation_id }
         lastUploadData = data
         
         // Store session ID from first upload
@@ -528,7 +549,7 @@ export function ChatArea({ viewMode, sidebarOpen, onToggleSidebar, loadConversat
     abortControllerRef.current = new AbortController()
 
     try {
-      const response = await fetch('/api/chat', {
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -541,71 +562,77 @@ export function ChatArea({ viewMode, sidebarOpen, onToggleSidebar, loadConversat
         signal: abortControllerRef.current?.signal,
       })
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         const error = await response.json()
         throw new Error(error.error || 'Failed to get response')
       }
 
-      const data = await response.json()
-      
-      // Remove loading message and replace with actual response
-      const botMessageId = data.id || Date.now().toString()
-      const fullContent = data.content
-      
-      // Replace loading message with real message
-      setMessages((prev: Message[]) => 
-        prev.filter(msg => msg.id !== loadingMessageId).concat({
-          id: botMessageId,
-          author: data.author || 'FasarliAI',
-          avatar: '⚡',
-          timestamp: data.timestamp,
-          content: '',  // Start with empty content for typing effect
-        })
-      )
-
-      // Animate typing effect character by character
-      let currentIndex = 0
-      let isAborted = false
-
-      const typeCharacter = () => {
-        if (isAborted) {
-          setIsLoading(false)
-          setIsGenerating(false)
-          return
-        }
-        
-        if (currentIndex < fullContent.length) {
-          const currentContent = fullContent.substring(0, currentIndex + 1)
-          setMessages((prev: Message[]) => prev.map((msg: Message) => 
-            msg.id === botMessageId 
-              ? { ...msg, content: currentContent }
+      // Replace loading message with the streamed message as soon as the first token arrives
+      const botMessageId = 'stream-' + Date.now()
+      let streamedContent = ''
+      let started = false
+
+      const showContent = (content: string) => {
+        if (!started) {
+          started = true
+          setMessages((prev: Message[]) =>
+            prev.filter(msg => msg.id !== loadingMessageId).concat({
+              id: botMessageId,
+              author: 'FasarliAI',
+              avatar: '⚡',
+              timestamp: new Date().toLocaleTimeString('en-US', { hour: '2-digit', minute: '2-digit' }),
+              content,
+            })
+          )
+        } else {
+          setMessages((prev: Message[]) => prev.map((msg: Message) =>
+            msg.id === botMessageId
+              ? { ...msg, content }
               : msg
           ))
-          currentIndex++
-          // 30ms delay per character for smooth typing effect
-          setTimeout(typeCharacter, 30)
-        } else {
-          // Typing complete
-          setIsLoading(false)
-          setIsGenerating(false)
-          abortControllerRef.current = null
         }
       }
 
-      // Check if aborted during typing
-      const originalAbort = abortControllerRef.current
-      if (originalAbort) {
-        const checkAbort = () => {
-          if (!abortControllerRef.current || abortControllerRef.current !== originalAbort) {
-            isAborted = true
+      // Read server-sent events: sources, token..., then done or error
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffered = ''
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffered += decoder.decode(value, { stream: true })
+
+        let boundary = buffered.indexOf('\n\n')
+        while (boundary !== -1) {
+          const rawEvent = buffered.slice(0, boundary)
+          buffered = buffered.slice(boundary + 2)
+          boundary = buffered.indexOf('\n\n')
+
+          const eventLine = rawEvent.split('\n').find((line) => line.startsWith('event: '))
+          const dataLine = rawEvent.split('\n').find((line) => line.startsWith('data: '))
+          if (!eventLine || !dataLine) continue
+          const eventName = eventLine.slice(7)
+          const data = JSON.parse(dataLine.slice(6))
+
+          if (eventName === 'token') {
+            streamedContent += data.content
+            showContent(streamedContent)
+          } else if (eventName === 'done') {
+            showContent(data.content)
+          } else if (eventName === 'error') {
+            throw new Error(data.detail || 'Failed to get response')
           }
         }
-        const abortCheckInterval = setInterval(checkAbort, 100)
-        setTimeout(() => clearInterval(abortCheckInterval), 60000) // Clean up after 1 min max
       }
 
-      // Start typing effect
-      typeCharacter()
+      if (!started) {
+        // Stream ended without any answer text
+        setMessages((prev: Message[]) => prev.filter(msg => msg.id !== loadingMessageId))
+      }
+      setIsLoading(false)
+      setIsGenerating(false)
+      abortControllerRef.current = null
     } catch (error) {
       // Don't show error if user aborted
       if (error instanceof Error && error.name === 'AbortError') {
@@ -7,6 +7,7 @@ import { useAuth } from '@/contexts/auth-context'
 import { useSession } from '@/contexts/session-context'
 import { getConversations, getPDFByConversation, getChatMessages } from '@/lib/supabase/database'
 import { Conversation } from '@/lib/supabase/database'
+import { waitForIngestJob } from '@/lib/ingest'
 import { toast } from 'sonner'
 
 interface ConversationsListProps {
@@ -109,7 +110,12 @@ export function ConversationsList({ onSelectConversation }: ConversationsListPro
             })
             
             if (reloadResponse.ok) {
-              const { session_id } = await reloadResponse.json()
+              let reloadData = await reloadResponse.json()
+              if (reloadData.job_id) {
+                // The PDF is being processed again; poll its job before the session can be used
+                reloadData = await waitForIngestJob('', reloadData.job_id)
+              }
+              const { session_id } = reloadData
               console.log('[ConversationsList] PDF reloaded, session_id:', session_id)
               setSessionId(session_id)
               toast.success('Conversation loaded successfully')
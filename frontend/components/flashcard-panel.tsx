@@ -50,7 +50,8 @@ export function FlashcardPanel() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ sessionId }),
+        // The first set comes from the precomputed study pack, later ones are fresh
+        body: JSON.stringify({ sessionId, regenerate: flashcards.length > 0 }),
         signal: controller.signal,
       })
 
@@ -43,7 +43,8 @@ export function QuizPanel() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ sessionId }),
+        // The first set comes from the precomputed study pack, later ones are fresh
+        body: JSON.stringify({ sessionId, regenerate: questions.length > 0 }),
       })
 
       if (!response.ok) {
@@ -0,0 +1,69 @@
+/**
+ * Helpers for the backend's asynchronous PDF ingestion.
+ *
+ * POST /api/upload on the FastAPI backend returns 202 with a job id; the PDF is
+ * processed in the background and its status is polled at /api/upload/{job_id}.
+ * The Next.js upload and reload-pdf routes hand the job id straight back to the
+ * browser, which polls our /api/upload/[jobId] proxy with waitForIngestJob, so
+ * no server request stays open while a PDF is processed.
+ */
+
+export interface IngestJobStatus {
+  job_id: string
+  session_id: string
+  filename: string
+  status: 'queued' | 'running' | 'done' | 'failed'
+  stage: string
+  progress: number
+  chunks_count: number
+  message: string | null
+  error: string | null
+  // HTTP status for a failed job: 400 when the PDF itself is unusable, 500 otherwise
+  error_status?: number | null
+}
+
+export class IngestJobError extends Error {
+  status: number
+
+  constructor(message: string, status: number) {
+    super(message)
+    this.name = 'IngestJobError'
+    this.status = status
+  }
+}
+
+/**
+ * Poll an ingestion job until it finishes.
+ * baseUrl is '' in the browser (our proxy route) or the backend URL on the server.
+ * Resolves with the final status, throws IngestJobError if the job fails
+ * and an AbortError if the signal fires first.
+ */
+export async function waitForIngestJob(
+  baseUrl: string,
+  jobId: string,
+  options: { signal?: AbortSignal; onProgress?: (job: IngestJobStatus) => void; pollIntervalMs?: number } = {}
+): Promise<IngestJobStatus> {
+  const { signal, onProgress, pollIntervalMs = 1000 } = options
+  while (true) {
+    const response = await fetch(`${baseUrl}/api/upload/${encodeURIComponent(jobId)}`, { signal })
+
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({}))
+      throw new IngestJobError(error.error || error.detail || 'Failed to get upload status', response.status)
+    }
+
+    const job: IngestJobStatus = await response.json()
+    onProgress?.(job)
+    if (job.status === 'done') {
+      return job
+    }
+    if (job.status === 'failed') {
+      const status = job.error_status || 500
+      // Client errors (e.g. a PDF without text) keep the backend's own message, as before ingestion jobs
+      const message = status < 500 ? job.error || 'Failed to process PDF' : `Failed to process PDF: ${job.error || 'Unknown error'}`
+      throw new IngestJobError(message, status)
+    }
+
+    await new Promise((resolve) => setTimeout(resolve, pollIntervalMs))
+  }
+}
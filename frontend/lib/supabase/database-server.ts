@@ -75,6 +75,7 @@ export async function updatePDFServer(
   updates: {
     vector_store_session_id?: string | null
     storage_path?: string | null
+    chunks_count?: number | null
   }
 ) {
   const supabase = createServerClient(